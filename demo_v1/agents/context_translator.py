@@ -4,7 +4,6 @@ import pprint
 import sys
 import os
 
-from langchain_openai import ChatOpenAI
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
@@ -14,6 +13,7 @@ from langchain.output_parsers import PydanticOutputParser
 from typing import List
 from pydantic import BaseModel, Field
 from constants import Llm
+from llms import get_chat_model
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -92,7 +92,12 @@ Based on the query above, summarize and rewrite the information from the retriev
 - Highlights key points most relevant to the query
 """
 
-llm = ChatOpenAI(model=Llm.GPT_4O, temperature=0.5)
+llm = get_chat_model(
+    Llm.GPT_4O,
+    temperature=0.5,
+    agent="context_translator",
+    output_parser=parser,
+)
 
 test_query = "How does a history of occasional low back pain after heavy lifting relate to current symptoms in a 45-year-old male?"
 test_documents = """
@@ -0,0 +1,58 @@
+### Cross-encoder Grader
+import asyncio
+import sys
+import os
+from typing import List, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sentence_transformers import CrossEncoder
+from constants import Grading
+from registry import registry
+
+
+def get_cross_encoder(model_name: str = Grading.CROSS_ENCODER_MODEL) -> CrossEncoder:
+    return registry.get_or_create(
+        f"cross-encoder:{model_name}",
+        lambda: CrossEncoder(model_name, device="cpu"),
+    )
+
+
+def score_pairs(pairs: List[Tuple[str, str]]) -> List[float]:
+    """Scores (question, document) pairs in one batched forward pass, as probabilities in [0, 1]"""
+
+    if not pairs:
+        return []
+
+    # Single-logit cross-encoders apply a sigmoid by default, so scores are in [0, 1]
+    cross_encoder = get_cross_encoder()
+    scores = cross_encoder.predict(
+        pairs, batch_size=Grading.CROSS_ENCODER_BATCH_SIZE, convert_to_numpy=True
+    )
+    return [float(score) for score in scores]
+
+
+async def ascore_pairs(pairs: List[Tuple[str, str]]) -> List[float]:
+    """Async version of `score_pairs`, running the forward pass in an executor"""
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, score_pairs, pairs)
+
+
+def main():
+    pairs = [
+        (
+            "positive straight leg raise test at 45 degrees",
+            "The straight leg raise test is positive when radicular pain is reproduced between 30 and 70 degrees of hip flexion.",
+        ),
+        (
+            "positive straight leg raise test at 45 degrees",
+            "The Lachman test assesses the integrity of the anterior cruciate ligament.",
+        ),
+    ]
+    for (question, document), score in zip(pairs, score_pairs(pairs)):
+        print(f"{score:.3f} - {document}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,12 +7,12 @@ from typing import List, Optional
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from altair import Literal
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers.json import JsonOutputParser
 from langchain.prompts import PromptTemplate, ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from constants import Llm
+from llms import get_chat_model
 
 
 class ContextQuote(BaseModel):
@@ -164,7 +164,12 @@ As an expert physiotherapist, provide a comprehensive differential diagnosis bas
 Remember to ground all your analyses and conclusions in the provided context, ensuring a transparent and evidence-based diagnostic process.
 """
 
-llm = ChatOpenAI(model=Llm.GPT_4O, temperature=0.5)
+llm = get_chat_model(
+    Llm.GPT_4O,
+    temperature=0.5,
+    agent="diagnosis_generator",
+    output_parser=parser,
+)
 
 prompt = ChatPromptTemplate.from_messages(
     [
@@ -176,3 +181,4 @@ prompt = ChatPromptTemplate.from_messages(
 diagnosis_generator = (
     prompt | llm | JsonOutputParser(pydantic_object=DiagnosisGeneratorOutput)
 )
+diagnosis_generator = diagnosis_generator.with_retry()
@@ -0,0 +1,98 @@
+### Diagnosis Repair Agent
+
+import sys
+import os
+from typing import List
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from langchain_core.output_parsers.json import JsonOutputParser
+from langchain.prompts import ChatPromptTemplate
+from langchain.output_parsers import PydanticOutputParser
+from pydantic import BaseModel, Field
+from agents.diagnosis_generator import DifferentialDiagnosis
+from constants import Llm
+from llms import get_chat_model
+
+
+class DiagnosisRepairOutput(BaseModel):
+    """Model for a repaired differential diagnosis"""
+
+    differential_diagnosis: DifferentialDiagnosis = Field(
+        description="The repaired differential diagnosis, with every claim grounded in the context"
+    )
+    additional_references: List[str] = Field(
+        [],
+        description="References in IEEE format that are cited by the repaired diagnosis but missing from the existing reference list, in the order of their new citation numbers",
+    )
+
+
+parser = PydanticOutputParser(pydantic_object=DiagnosisRepairOutput)
+
+DIAGNOSIS_REPAIRER_SYSTEM_PROMPT = """# Differential Diagnosis Repair Agent for Physiotherapy
+
+You are an expert physiotherapist reviewing one differential diagnosis from a set that was checked against the retrieved medical documents. A verification agent found claims in this diagnosis that are not supported by the documents. Your task is to rewrite only this diagnosis so that every claim is grounded in the context, keeping everything that was already supported.
+
+## Your Tasks:
+
+1. Read the flagged problems and locate the unsupported claims in the diagnosis.
+2. Remove each unsupported claim, or replace it with a statement that is directly supported by a quote from the context.
+3. Make sure every quote in "relevant_quotes" is copied verbatim from the context.
+4. Keep the diagnosis name unless the context does not support the diagnosis at all, and adjust the likelihood if the remaining evidence is weaker.
+5. Keep the in-text citation numbers of the existing reference list. If you cite a source that is not in the list, number it after the last existing reference and add it to "additional_references".
+
+## Output Format:
+
+{format_instructions}
+
+## Important Notes:
+
+- Only repair the diagnosis you are given; the other diagnoses are shown for consistency and must not be repeated.
+- Do not introduce information that is not in the context or the patient query.
+- Format your entire response as a valid JSON object that can be parsed by the Pydantic model.
+"""
+
+DIAGNOSIS_REPAIRER_USER_PROMPT = """# Diagnosis Repair Task
+
+## Context:
+
+{context}
+
+## Patient Query:
+{question}
+
+## Full Differential Diagnosis:
+
+{generation}
+
+## Existing References:
+
+{references}
+
+## Diagnosis to Repair:
+
+{diagnosis}
+
+## Problems Found by Verification:
+
+{problems}
+"""
+
+llm = get_chat_model(
+    Llm.GPT_4O,
+    temperature=0.5,
+    agent="diagnosis_repairer",
+    output_parser=parser,
+)
+
+prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", DIAGNOSIS_REPAIRER_SYSTEM_PROMPT),
+        ("user", DIAGNOSIS_REPAIRER_USER_PROMPT),
+    ]
+).partial(format_instructions=parser.get_format_instructions())
+
+diagnosis_repairer = (
+    prompt | llm | JsonOutputParser(pydantic_object=DiagnosisRepairOutput)
+)
+diagnosis_repairer = diagnosis_repairer.with_retry()
@@ -4,13 +4,13 @@ from typing import List, Optional
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from langchain_openai import ChatOpenAI
 from langchain_groq import ChatGroq
 from langchain_core.output_parsers.json import JsonOutputParser
 from langchain.prompts import PromptTemplate, ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from constants import Llm
+from llms import get_chat_model
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -146,7 +146,12 @@ HALLUCINATION_CHECKER_USER_PROMPT = """# Verification Task
 - Check for any misuse or misinterpretation of physiotherapy-specific terminology.
 """
 
-llm = ChatOpenAI(model=Llm.GPT_4O, temperature=1)
+llm = get_chat_model(
+    Llm.GPT_4O,
+    temperature=1,
+    agent="hallucination_grader",
+    output_parser=parser,
+)
 
 
 prompt = ChatPromptTemplate.from_messages(
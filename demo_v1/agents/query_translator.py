@@ -3,7 +3,6 @@
 import sys
 import os
 
-from langchain_openai import ChatOpenAI
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
@@ -13,6 +12,7 @@ from langchain.output_parsers import PydanticOutputParser
 from typing import List
 from pydantic import BaseModel, Field
 from constants import Llm
+from llms import get_chat_model
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -96,7 +96,12 @@ Translate the provided query into a set of specific and focused subqueries that
 """
 
 # llm = ChatGroq(model=Llm.LLAMA3_70B, temperature=1, stop_sequences=["<|eot_id|>"])
-llm = ChatOpenAI(model=Llm.GPT_4O_MINI, temperature=0.5)
+llm = get_chat_model(
+    Llm.GPT_4O_MINI,
+    temperature=0.5,
+    agent="query_translator",
+    output_parser=parser,
+)
 
 prompt = ChatPromptTemplate.from_messages(
     [("system", QUERY_TRANSLATOR_SYSTEM_PROMPT), ("user", QUERY_TRANSLATOR_USER_PROMPT)]
@@ -2,15 +2,17 @@
 
 import sys
 import os
+import openai
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers.json import JsonOutputParser
 from langchain.prompts import PromptTemplate, ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional
 from constants import Llm
+from llms import get_chat_model
 
 
 # Create pydantic object for the grader result
@@ -72,7 +74,12 @@ RETRIEVAL_GRADER_USER_PROMPT = """
 Assess the relevance of the above document to the given physiotherapy question. Determine if it contains medically pertinent information that could contribute to understanding or answering the question.
 """
 
-llm = ChatOpenAI(model=Llm.GPT_4O_MINI, temperature=0.5)
+llm = get_chat_model(
+    Llm.GPT_4O_MINI,
+    temperature=0.5,
+    agent="retrieval_grader",
+    output_parser=parser,
+)
 # llm = ChatGroq(model=LLAMA3_80B, temperature=1)
 # llm = ChatOllama(model=LOCAL_LLM, format="json", temperature=0)
 
@@ -88,3 +95,99 @@ retrieval_grader = (
     prompt | llm | JsonOutputParser(pydantic_object=RetrievalGraderOutput)
 )
 retrieval_grader = retrieval_grader.with_retry()
+
+
+### Listwise Retrieval Grader
+
+
+# Create pydantic objects for grading all candidate documents of a question in one call
+class ListwiseDocumentVerdict(BaseModel):
+    document: int = Field(
+        ...,
+        description="The number of the document being graded, as given in its heading",
+    )
+    score: str = Field(
+        "",
+        description="A binary score 'yes' or 'no' to indicate whether the document is relevant to the question, 'yes' if relevant and 'no' if not relevant",
+    )
+
+
+class ListwiseRetrievalGraderOutput(BaseModel):
+    verdicts: List[ListwiseDocumentVerdict] = Field(
+        [],
+        description="One verdict for every document to evaluate, in the order the documents are given",
+    )
+
+
+listwise_parser = PydanticOutputParser(pydantic_object=ListwiseRetrievalGraderOutput)
+
+# Its own client, so the response cache validates replies against the listwise schema
+listwise_llm = get_chat_model(
+    Llm.GPT_4O_MINI,
+    temperature=0.5,
+    agent="listwise_retrieval_grader",
+    output_parser=listwise_parser,
+)
+
+LISTWISE_RETRIEVAL_GRADER_USER_PROMPT = """
+## Documents to Evaluate:
+
+{documents}
+
+## Physiotherapy Question:
+
+{question}
+
+## Task:
+Assess the relevance of each of the above {num_documents} documents to the given physiotherapy question, independently of the other documents. Determine if each contains medically pertinent information that could contribute to understanding or answering the question, and give exactly one verdict per document.
+"""
+
+listwise_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", RETRIEVAL_GRADER_SYSTEM_PROMPT),
+        ("user", LISTWISE_RETRIEVAL_GRADER_USER_PROMPT),
+    ]
+).partial(format_instructions=listwise_parser.get_format_instructions())
+
+# Create a listwise retrieval grader. Only transient API errors are retried, a malformed
+# verdict array falls back to grading the documents one by one with the retrieval grader
+listwise_retrieval_grader = (
+    listwise_prompt
+    | listwise_llm
+    | JsonOutputParser(pydantic_object=ListwiseRetrievalGraderOutput)
+)
+listwise_retrieval_grader = listwise_retrieval_grader.with_retry(
+    retry_if_exception_type=(
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+)
+
+
+def format_listwise_documents(documents: List[str]) -> str:
+    """Numbers the documents so the verdicts can be matched back to them"""
+
+    return "\n\n".join(
+        f"### Document {i}\n\n{document}" for i, document in enumerate(documents, start=1)
+    )
+
+
+def parse_listwise_verdicts(llm_result, num_documents: int) -> Optional[List[bool]]:
+    """Returns the relevance of each document, or None if the verdicts do not cover
+    every document exactly once"""
+
+    try:
+        parsed_llm_result = ListwiseRetrievalGraderOutput(**llm_result)
+    except (TypeError, ValidationError):
+        return None
+
+    verdicts = {}
+    for verdict in parsed_llm_result.verdicts:
+        if verdict.document in verdicts or verdict.score not in ("yes", "no"):
+            return None
+        verdicts[verdict.document] = verdict.score == "yes"
+
+    if sorted(verdicts) != list(range(1, num_documents + 1)):
+        return None
+    return [verdicts[i] for i in range(1, num_documents + 1)]
@@ -1,9 +1,16 @@
 import asyncio
+from datetime import datetime
 import streamlit as st
 from agents.halluncination_grader import HallucinationGraderOutput
 from graph import GraphState, construct_graph
 from chatbot_ui import chatbot_page  
 from ingest_ui import document_ingestion_page
+from constants import Grading, Pipelining, Tracing, VectorDb, WebSearch
+from db import get_query_embedding_cache_stats, get_retrieval_modes
+from llms import get_llm_scheduler, get_response_cache_stats
+from registry import registry
+from run_tracing import export_trace, summarize_trace
+from web_search import get_web_search
 
 # Main title
 st.title("🩺💪🩻 PhysioTriage")
@@ -18,12 +25,28 @@ with st.sidebar:
         This is a demo of the PhysioTriage system, which uses an LLM to generate potential differential diagnoses based on subjective and objective patient assessments.
         """
     )
+    with st.expander("Loaded resources"):
+        st.markdown(registry.report())
+        st.json(get_query_embedding_cache_stats())
+    with st.expander("LLM response cache"):
+        st.json(get_response_cache_stats())
+    with st.expander("LLM scheduler"):
+        st.json(get_llm_scheduler().stats())
+    with st.expander("Web search cache"):
+        st.json(get_web_search().stats())
 
 # Check which tab is active
 if tab == "PhysioTriage":
     # Original diagnosis logic here...
 
-    async def run_graph(query: str):
+    async def run_graph(
+        query: str,
+        retrieval_mode: str = VectorDb.RETRIEVAL_MODE,
+        grading_mode: str = Grading.MODE,
+        listwise: bool = Grading.LISTWISE,
+        execution_mode: str = Pipelining.MODE,
+        web_write_back: bool = WebSearch.WRITE_BACK,
+    ):
         st.info("🚀 Running the agentic AI workflow")
         graph = construct_graph()
         app = graph.compile()
@@ -37,6 +60,17 @@ if tab == "PhysioTriage":
             halluncination_check_balance=3,
             has_hallucinations=False,
             hallucination_grader_output=None,
+            context="",
+            packed_documents=[],
+            dropped_documents=[],
+            diagnosis_generator_output=None,
+            diagnosis_grades=[],
+            changed_diagnoses=None,
+            failing_diagnoses=[],
+            unmatched_quotes=[],
+            run_metrics={},
+            trace=[],
+            web_results=[],
         )
 
         step_count = 0
@@ -128,13 +162,79 @@ if tab == "PhysioTriage":
         def translate_documents_output(graph_state: GraphState, step_count: int):
             step_count += 1
             st.info("Translated retrieved documents", icon="📚")
+            run_metrics = graph_state.get("run_metrics", {})
+            calls_saved = run_metrics.get("grader_calls_saved", 0) + run_metrics.get(
+                "translator_calls_saved", 0
+            )
+            if calls_saved > 0:
+                st.caption(
+                    f"Shared chunks across subqueries saved {calls_saved} grader and translator calls"
+                )
             st.info(
                 f"{step_count}. Generating potential differential diagnoses...", icon="🧬"
             )
             return step_count
 
+        # One placeholder per subquery showing how far its own pipeline has got
+        subquery_placeholders = {}
+        subquery_stage_messages = {
+            "retrieve": "🔍 retrieved, checking for irrelevant information...",
+            "grade_documents": "👁️ checked for irrelevant information",
+            "websearch": "🌐 searched the web for additional information",
+            "translate_documents": "⚙️ translated the retrieved documents",
+        }
+
+        def subquery_progress(query_index: int, stage: str, graph_state: GraphState):
+            if query_index not in subquery_placeholders:
+                subquery_placeholders[query_index] = st.empty()
+            message = subquery_stage_messages[stage]
+            if stage == "grade_documents":
+                if graph_state["web_search"] == "Yes":
+                    message += ", searching the web..."
+                else:
+                    message += ", translating documents..."
+            subquery_placeholders[query_index].info(
+                f"Subquery {query_index + 1}: {message}"
+            )
+
+        def process_subqueries_output(graph_state: GraphState, step_count: int):
+            step_count += 1
+            cut_off = graph_state["run_metrics"].get("subqueries_cut_off", {})
+            if cut_off:
+                formatted_queries = "\n\n".join(
+                    f"ℹ️ {subquery} (stopped after: {stage or 'nothing'})"
+                    for subquery, stage in cut_off.items()
+                )
+                st.warning(
+                    f"Subqueries cut off by the deadline or failed, dropped from the context:\n\n {formatted_queries}"
+                )
+            st.info("Translated retrieved documents for every subquery", icon="📚")
+            st.info(
+                f"{step_count}. Generating potential differential diagnoses...", icon="🧬"
+            )
+            return step_count
+
+        def pack_context_output(graph_state: GraphState, step_count: int):
+            dropped_documents = graph_state["dropped_documents"]
+            if dropped_documents:
+                st.caption(
+                    f"{len(dropped_documents)} translated documents left out of the context "
+                    f"(duplicates or over the {graph_state['run_metrics'].get('context_token_budget')} token budget)"
+                )
+            return step_count
+
+        # Placeholder the diagnosis is rendered into while it streams in, a new one is
+        # created for every (re)generation
+        streamed_generation = {"placeholder": None}
+
+        def generation_progress(markdown: str):
+            if streamed_generation["placeholder"] is None:
+                streamed_generation["placeholder"] = st.empty()
+            streamed_generation["placeholder"].markdown(markdown)
+
         def generation_output(graph_state: GraphState, step_count: int):
             step_count += 1
+            streamed_generation["placeholder"] = None
             st.info("Potential differential diagnoses generated", icon="📋")
             st.info(
                 f"{step_count}. Checking for hallucinations in the generated text...",
@@ -142,6 +242,19 @@ if tab == "PhysioTriage":
             )
             return step_count
 
+        def repair_generation_output(graph_state: GraphState, step_count: int):
+            step_count += 1
+            streamed_generation["placeholder"] = None
+            st.info(
+                f"Regenerated {len(graph_state['changed_diagnoses'])} ungrounded differential diagnoses",
+                icon="🩹",
+            )
+            st.info(
+                f"{step_count}. Checking the regenerated diagnoses for hallucinations...",
+                icon="👻",
+            )
+            return step_count
+
         def check_hallucinations_output(graph_state: GraphState, step_count: int):
             step_count += 1
             halluncation_grader_output = graph_state["hallucination_grader_output"]
@@ -154,6 +267,22 @@ if tab == "PhysioTriage":
                 )
                 st.info(halluncination_grader_report)
 
+            unmatched_quotes = graph_state["unmatched_quotes"]
+            if unmatched_quotes:
+                formatted_quotes = "\n\n".join(
+                    f'- Diagnosis {item["diagnosis"] + 1}: "{item["quote"]}"'
+                    for item in unmatched_quotes
+                )
+                st.warning(f"Quotes not found in the retrieved documents:\n\n{formatted_quotes}")
+
+            return step_count
+
+        def write_back_web_results_output(graph_state: GraphState, step_count: int):
+            written = graph_state["run_metrics"].get("web_results_written", 0)
+            if written:
+                st.caption(
+                    f"Stored {written} validated web results for retrieval in later runs"
+                )
             return step_count
 
         node_action_output = {
@@ -162,13 +291,30 @@ if tab == "PhysioTriage":
             "grade_documents": grade_documents_output,
             "websearch": web_search_output,
             "translate_documents": translate_documents_output,
+            "process_subqueries": process_subqueries_output,
+            "pack_context": pack_context_output,
             "generate": generation_output,
+            "repair_generation": repair_generation_output,
             "check_hallucinations": check_hallucinations_output,
+            "write_back_web_results": write_back_web_results_output,
         }
 
         step_count += 1
         st.info(f"{step_count}. Translating the main query into subqueries...", icon="🧠")
-        async for output in app.astream(inputs):
+        async for output in app.astream(
+            inputs,
+            config={
+                "configurable": {
+                    "retrieval_mode": retrieval_mode,
+                    "grading_mode": grading_mode,
+                    "listwise": listwise,
+                    "execution_mode": execution_mode,
+                    "web_write_back": web_write_back,
+                    "on_generation_progress": generation_progress,
+                    "on_subquery_progress": subquery_progress,
+                }
+            },
+        ):
             for key, value in output.items():
                 if key in node_action_output:
                     step_count = node_action_output[key](value, step_count)
@@ -177,6 +323,27 @@ if tab == "PhysioTriage":
 
         st.info(value["generation"])
 
+        # Where the time and money of this run went
+        trace_summary = summarize_trace(value["trace"])
+        with st.sidebar:
+            with st.expander("Last run", expanded=True):
+                st.metric("Wall time", f"{trace_summary['wall_seconds']:.1f}s")
+                st.metric("Estimated cost", f"${trace_summary['cost']:.4f}")
+                for title in ["nodes", "agents", "models", "services"]:
+                    st.markdown(title.capitalize())
+                    st.dataframe(
+                        [
+                            {title[:-1]: name, **values}
+                            for name, values in trace_summary[title].items()
+                        ]
+                    )
+        if Tracing.EXPORT_DIRECTORY:
+            export_trace(
+                value["trace"],
+                Tracing.EXPORT_DIRECTORY,
+                f"run-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            )
+
     default_subjective_assessment = "The patient, is a 45-year-old male who presents to the clinic with complaints of lower back pain..."
     default_objective_assessment = "On physical examination, the patient appears uncomfortable..."
 
@@ -192,6 +359,48 @@ if tab == "PhysioTriage":
             height=200,
         )
 
+        # Hybrid is only offered when the collection was ingested with sparse vectors
+        retrieval_modes = get_retrieval_modes()
+        retrieval_mode = st.radio(
+            "Retrieval mode",
+            retrieval_modes,
+            index=retrieval_modes.index(
+                VectorDb.RETRIEVAL_MODE
+                if VectorDb.RETRIEVAL_MODE in retrieval_modes
+                else "dense"
+            ),
+            horizontal=True,
+        )
+        if "hybrid" not in retrieval_modes:
+            st.caption(
+                "Hybrid retrieval needs a collection ingested with VECTOR_DB_RETRIEVAL_MODE=hybrid"
+            )
+        grading_modes = ["llm", "cross-encoder", "cascade", "score-gate"]
+        grading_mode = st.radio(
+            "Document grading",
+            grading_modes,
+            index=grading_modes.index(Grading.MODE),
+            horizontal=True,
+        )
+        listwise = st.checkbox(
+            "Grade all documents of a subquery in one call", value=Grading.LISTWISE
+        )
+
+        execution_modes = ["staged", "pipelined"]
+        execution_mode = st.radio(
+            "Subquery execution",
+            execution_modes,
+            index=execution_modes.index(Pipelining.MODE),
+            horizontal=True,
+            help="Pipelined runs every subquery through retrieval, grading, web search and translation on its own",
+        )
+
+        web_write_back = st.checkbox(
+            "Store validated web results for later runs",
+            value=WebSearch.WRITE_BACK,
+            help="Web results the diagnosis was grounded in are added to their own collection, which retrieval searches as well",
+        )
+
         submitted = st.form_submit_button("Submit")
 
         if submitted:
@@ -202,7 +411,16 @@ if tab == "PhysioTriage":
             Objective assessment:
             {objective_assessment}
             """
-            asyncio.run(run_graph(query=query))
+            asyncio.run(
+                run_graph(
+                    query=query,
+                    retrieval_mode=retrieval_mode,
+                    grading_mode=grading_mode,
+                    listwise=listwise,
+                    execution_mode=execution_mode,
+                    web_write_back=web_write_back,
+                )
+            )
 
 elif tab == "Chatbot":
     # Call the chatbot page from chatbot.py
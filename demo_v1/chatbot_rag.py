@@ -4,31 +4,74 @@ It provides details on the retriever, the LLM being used, and the prompt used fo
 
 """
 from langchain_qdrant import QdrantVectorStore
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains.llm import LLMChain
 from langchain.chains.combine_documents.stuff import StuffDocumentsChain
 from langchain.chains import RetrievalQA
-from langchain_qdrant import FastEmbedSparse, RetrievalMode
+from langchain_qdrant import RetrievalMode
 from config import *
+from constants import VectorDb
+from db import (
+    get_qdrant_client,
+    get_query_embeddings,
+    get_raw_qdrant_client,
+    get_sparse_embeddings,
+    resolve_retrieval_mode,
+)
+from llms import get_chat_model
+from registry import registry
 
 # Step 1: Set up the Qdrant Vector Store
-# Create the vector store and fill it with embeddings from an existing collection
-qdrant = QdrantVectorStore.from_existing_collection(
-    embedding=HuggingFaceEmbeddings(model_name=VECTOR_EMBEDDING_MODEL),
-    collection_name=QDRANT_COLLECTION_NAME,
-    url=QDRANT_ENDPOINT,
-    retrieval_mode=RetrievalMode.DENSE,
-)
+# Reuse the process-wide Qdrant client and the cached query embeddings for the existing collection
+def get_vector_store(retrieval_mode: str):
+    if VectorDb.BACKEND == "local":
+        return get_qdrant_client(QDRANT_COLLECTION_NAME or VectorDb.COLLECTION_NAME)
+
+    # Collections ingested without sparse vectors can only be searched densely
+    retrieval_mode = resolve_retrieval_mode(
+        retrieval_mode, QDRANT_COLLECTION_NAME, QDRANT_ENDPOINT
+    )
+
+    def create_vector_store():
+        if retrieval_mode == "hybrid":
+            # Dense PubMedBERT and sparse BM25 results are fused with reciprocal-rank fusion
+            return QdrantVectorStore(
+                client=get_raw_qdrant_client(QDRANT_ENDPOINT),
+                collection_name=QDRANT_COLLECTION_NAME,
+                embedding=get_query_embeddings(VECTOR_EMBEDDING_MODEL),
+                retrieval_mode=RetrievalMode.HYBRID,
+                sparse_embedding=get_sparse_embeddings(),
+                sparse_vector_name=VectorDb.SPARSE_VECTOR_NAME,
+            )
+        return QdrantVectorStore(
+            client=get_raw_qdrant_client(QDRANT_ENDPOINT),
+            collection_name=QDRANT_COLLECTION_NAME,
+            embedding=get_query_embeddings(VECTOR_EMBEDDING_MODEL),
+            retrieval_mode=RetrievalMode.DENSE,
+        )
+
+    return registry.get_or_create(
+        f"chatbot-vector-store:{QDRANT_ENDPOINT}:{QDRANT_COLLECTION_NAME}:{retrieval_mode}",
+        create_vector_store,
+    )
+
 
 # Step 2: Define the retriever
 # Use the Qdrant vector store to retrieve the top k similar documents
-retriever = qdrant.as_retriever(search_type="similarity", search_kwargs={"k": 3})
+def get_retriever(retrieval_mode: str):
+    search_kwargs = {"k": 3}
+    if VectorDb.BACKEND == "local":
+        search_kwargs["retrieval_mode"] = retrieval_mode
+    return get_vector_store(retrieval_mode).as_retriever(
+        search_type="similarity", search_kwargs=search_kwargs
+    )
+
+
+retriever = get_retriever(VectorDb.RETRIEVAL_MODE)
 
 # Step 3: Define the Language Model (LLM)
 # Specify the LLM to use, here ChatGPT's mini variant is used
-llm = ChatOpenAI(model=LLM_MODEL_FOR_GENERATION)
+llm = get_chat_model(LLM_MODEL_FOR_GENERATION, temperature=0.7)
 
 # Step 4: Define the QA prompt template
 # Create a prompt template for the QA chain, ensuring the inputs are "context" and "question"
@@ -55,7 +98,7 @@ QA_CHAIN_PROMPT = PromptTemplate(
 # Step 5: Create the LLM Chain
 # Chain the LLM with the QA prompt template
 llm_chain = LLMChain(
-    llm=llm,
+    llm=llm.with_retry(),
     prompt=QA_CHAIN_PROMPT,
     verbose=True
 )
@@ -85,6 +128,19 @@ qa = RetrievalQA(
 )
 
 # Step 9: Define the response function
-# This function takes a user question and retrieves an answer from the QA pipeline
-def respond(question):
-    return qa({"query": question})["result"]
+# This function takes a user question and retrieves an answer from the QA pipeline,
+# using the chosen retrieval mode ("dense" or "hybrid")
+def respond(question, retrieval_mode=VectorDb.RETRIEVAL_MODE):
+    if retrieval_mode == VectorDb.RETRIEVAL_MODE:
+        return qa({"query": question})["result"]
+
+    mode_qa = registry.get_or_create(
+        f"chatbot-qa:{retrieval_mode}",
+        lambda: RetrievalQA(
+            combine_documents_chain=combine_documents_chain,
+            retriever=get_retriever(retrieval_mode),
+            return_source_documents=True,
+            verbose=True,
+        ),
+    )
+    return mode_qa({"query": question})["result"]
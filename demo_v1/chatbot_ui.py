@@ -1,5 +1,8 @@
 import streamlit as st
 from chatbot_rag import respond  # Assuming test3.py is in the same directory
+from config import QDRANT_COLLECTION_NAME, QDRANT_ENDPOINT
+from constants import VectorDb
+from db import get_retrieval_modes
 
 def chatbot_page():
     st.header("Chat with PhysioBot!")
@@ -38,6 +41,18 @@ def chatbot_page():
         unsafe_allow_html=True
     )
 
+    # Dense retrieval, or hybrid retrieval that also matches exact clinical terms when
+    # the collection was ingested with sparse vectors
+    retrieval_modes = get_retrieval_modes(QDRANT_COLLECTION_NAME, QDRANT_ENDPOINT)
+    retrieval_mode = st.radio(
+        "Retrieval mode",
+        retrieval_modes,
+        index=retrieval_modes.index(
+            VectorDb.RETRIEVAL_MODE if VectorDb.RETRIEVAL_MODE in retrieval_modes else "dense"
+        ),
+        horizontal=True,
+    )
+
     # Function to handle sending message
     def send_message():
         user_message = st.session_state.user_input
@@ -46,7 +61,7 @@ def chatbot_page():
             st.session_state.chat_history.append({'role': 'user', 'message': user_message})
 
             # Use the respond function to get the bot's answer
-            bot_response = respond(user_message)
+            bot_response = respond(user_message, retrieval_mode=retrieval_mode)
 
             # Append bot response to chat history
             st.session_state.chat_history.append({'role': 'bot', 'message': bot_response})
@@ -1,3 +1,6 @@
+import os
+
+
 class Llm:
     LLAMA3_405B = "llama-3.1-405b-reasoning"
     GPT_4O = "gpt-4o"
@@ -8,3 +11,188 @@ class Llm:
 class VectorDb:
     EMBEDDING_MODEL = "NeuML/pubmedbert-base-embeddings"
     VECTOR_DB_URL = "http://localhost:6333"
+    COLLECTION_NAME = "physio-textbooks"
+    VECTOR_DB_GRPC_PORT = 6334
+    PREFER_GRPC = False
+    SEARCH_K = 3
+    # "qdrant" for the Qdrant server, "local" for the embedded LocalVectorStore
+    BACKEND = os.getenv("VECTOR_DB_BACKEND", "qdrant")
+    LOCAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_store")
+    LOCAL_DTYPE = "float32"
+    LOCAL_INDEX = "exact"
+    LOCAL_IVF_LISTS = None
+    LOCAL_IVF_PROBES = 8
+    # None, "int8" (scalar) or "binary" (1-bit) quantization of the stored vectors
+    QUANTIZATION = os.getenv("VECTOR_DB_QUANTIZATION") or None
+    QUANTIZATION_OVERSAMPLING = 2.0
+    QUANTIZATION_RESCORE = True
+    # "dense" for PubMedBERT only, "hybrid" to fuse it with sparse BM25 vectors
+    RETRIEVAL_MODE = os.getenv("VECTOR_DB_RETRIEVAL_MODE", "dense")
+    SPARSE_EMBEDDING_MODEL = "Qdrant/bm25"
+    SPARSE_VECTOR_NAME = "langchain-sparse"
+    HYBRID_PREFETCH = 20
+
+
+class Caches:
+    DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+    EMBEDDING_MEMORY_ENTRIES = 2048
+    EMBEDDING_DISK_ENTRIES = 100_000
+    # Agents whose chat model responses are cached, comma separated, empty disables the cache.
+    # The diagnosis generator and hallucination grader are left out by default, a retry
+    # after a failed hallucination check has to get a new generation and a new grade
+    LLM_RESPONSE_AGENTS = os.getenv(
+        "LLM_CACHE_AGENTS",
+        "query_translator,retrieval_grader,listwise_retrieval_grader,context_translator,"
+        "diagnosis_repairer,zero_shot",
+    )
+    LLM_RESPONSE_TTL_SECONDS = 7 * 24 * 60 * 60
+    LLM_RESPONSE_MAX_ENTRIES = 50_000
+    # Web search results keyed by normalized query, "false" disables the cache
+    WEB_SEARCH_ENABLED = os.getenv("WEB_SEARCH_CACHE", "true").lower() == "true"
+    WEB_SEARCH_TTL_SECONDS = 7 * 24 * 60 * 60
+    WEB_SEARCH_MAX_ENTRIES = 10_000
+
+
+class WebSearch:
+    # "tavily" searches the web, "local" ranks the passages of a local document collection
+    BACKEND = os.getenv("WEB_SEARCH_BACKEND", "tavily")
+    MAX_RESULTS = 3
+    LOCAL_CORPUS = os.getenv(
+        "WEB_SEARCH_CORPUS",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "markdown_files"),
+    )
+    # Web results that survived translation and the hallucination check are stored in a
+    # collection of their own and retrieved next to the textbooks, "true" enables it
+    WRITE_BACK = os.getenv("WEB_SEARCH_WRITE_BACK", "false").lower() == "true"
+    WRITE_BACK_COLLECTION = "physio-web-results"
+    WRITE_BACK_TTL_SECONDS = 30 * 24 * 60 * 60
+    # Stored web results appended to the chunks retrieved for every subquery
+    WRITE_BACK_SEARCH_K = 2
+
+
+class Scheduling:
+    # (requests per minute, tokens per minute) budgets per model, from the account's rate limits
+    MODEL_LIMITS = {
+        Llm.GPT_4O: (500, 30_000),
+        Llm.GPT_4O_MINI: (500, 200_000),
+        Llm.GPT_3DOT5: (500, 200_000),
+    }
+    DEFAULT_LIMITS = (500, 30_000)
+    # Lower values are served first when calls are queued, the critical path goes first
+    AGENT_PRIORITIES = {
+        "diagnosis_generator": 0,
+        "diagnosis_repairer": 0,
+        "hallucination_grader": 0,
+        "query_translator": 1,
+        "context_translator": 1,
+        "zero_shot": 1,
+        "retrieval_grader": 2,
+        "listwise_retrieval_grader": 2,
+    }
+    DEFAULT_PRIORITY = 1
+    INITIAL_CONCURRENCY = 8
+    MAX_CONCURRENCY = 32
+    # Calls slower than the target of their agent shrink the concurrency limit of the
+    # model, long generations routinely take 20-40s and must not count as slow
+    LATENCY_TARGETS = {
+        "diagnosis_generator": 60.0,
+        "diagnosis_repairer": 45.0,
+        "hallucination_grader": 45.0,
+        "zero_shot": 60.0,
+        "context_translator": 30.0,
+        "query_translator": 15.0,
+        "retrieval_grader": 10.0,
+        "listwise_retrieval_grader": 20.0,
+    }
+    DEFAULT_LATENCY_TARGET_SECONDS = 20.0
+    # Completion size charged to the token budget when the call sets no max_tokens
+    COMPLETION_TOKENS_ESTIMATE = 512
+
+
+class Pipelining:
+    # "staged" runs retrieval, grading, web search and translation for all subqueries at
+    # once, "pipelined" runs each subquery through all of them on its own
+    MODE = os.getenv("EXECUTION_MODE", "staged")
+    # Generation starts with whatever the unfinished subqueries have once this passes
+    DEADLINE_SECONDS = 90
+
+
+class Tracing:
+    # USD per million (prompt, completion) tokens, for the cost estimate of the trace
+    COST_PER_MILLION_TOKENS = {
+        Llm.GPT_4O: (2.50, 10.00),
+        Llm.GPT_4O_MINI: (0.15, 0.60),
+        Llm.GPT_3DOT5: (0.50, 1.50),
+    }
+    # Directory the trace of every run is written to, unset to not write traces
+    EXPORT_DIRECTORY = os.getenv("RUN_TRACE_DIRECTORY") or None
+    # Comma separated, "jsonl" for one span per line, "otel" for OTLP/JSON spans and
+    # "chrome" for a Chrome/Perfetto trace event timeline
+    EXPORT_FORMATS = [
+        export_format.strip()
+        for export_format in os.getenv("RUN_TRACE_FORMATS", "jsonl,otel,chrome").split(",")
+        if export_format.strip()
+    ]
+    # Whether the evaluation scripts write a Chrome trace next to their outputs
+    EVALUATION_CHROME_TRACES = os.getenv("CHROME_TRACES", "false").lower() == "true"
+
+
+class ContextPacking:
+    # Tokens of translated documents packed into the generation and hallucination check
+    # prompts, per model, leaving room for the instructions and the generated answer
+    TOKEN_BUDGETS = {
+        Llm.GPT_4O: 24_000,
+        Llm.GPT_4O_MINI: 24_000,
+        Llm.GPT_3DOT5: 8_000,
+    }
+    DEFAULT_TOKEN_BUDGET = 8_000
+
+
+class Repair:
+    # Regenerate only the diagnoses that failed the hallucination check instead of the
+    # whole differential, as long as some of the diagnoses were grounded
+    ENABLED = os.getenv("REPAIR_GENERATION", "true").lower() == "true"
+
+
+class HallucinationCheck:
+    # Grade each differential diagnosis in its own concurrent call against only the
+    # documents it cites, instead of the whole generation against the whole context
+    SHARDED = os.getenv("SHARD_HALLUCINATION_CHECK", "true").lower() == "true"
+
+
+class QuoteGrounding:
+    # Check the quotes of each diagnosis against the context locally, diagnoses whose
+    # quotes all match skip the LLM hallucination grader
+    ENABLED = os.getenv("QUOTE_GROUNDING", "true").lower() == "true"
+    # Fraction of a quote's word 3-grams that must occur in the context
+    THRESHOLD = 0.9
+
+
+class Grading:
+    # "llm" grades every pair with the retrieval grader, "cross-encoder" uses only the local
+    # reranker, "cascade" sends only pairs scored between the two bounds to the LLM and
+    # "score-gate" does the same with thresholds fitted on the retrieval similarity scores
+    MODE = os.getenv("GRADING_MODE", "llm")
+    CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    CROSS_ENCODER_BATCH_SIZE = 32
+    CROSS_ENCODER_THRESHOLD = 0.5
+    CASCADE_LOWER_THRESHOLD = 0.2
+    CASCADE_UPPER_THRESHOLD = 0.8
+    # Grade all candidate documents of a subquery in one LLM call instead of one call each
+    LISTWISE = os.getenv("GRADING_LISTWISE", "true").lower() == "true"
+
+
+class ScoreGate:
+    # (subquery, chunk, score, verdict, source) tuples logged from grader decisions
+    DECISION_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "grader_decisions.jsonl")
+    # Gate thresholds fitted offline by evaluation/fit-score-gate.py
+    GATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "score_gate.json")
+    TARGET_AGREEMENT = 0.95
+    # Log every grader verdict with its subquery and chunk, off by default since the
+    # log holds patient subqueries
+    LOG_DECISIONS = os.getenv("LOG_GRADER_DECISIONS", "false").lower() == "true"
+
+
+class Deduplication:
+    # Grade and translate each distinct chunk once across all subqueries that retrieved it
+    ENABLED = os.getenv("DEDUPLICATE_CHUNKS", "true").lower() == "true"
@@ -0,0 +1,162 @@
+"""
+Token-budget-aware packing of the translated documents into one prompt context.
+
+`generate` and `check_hallucinations` both prompt with every translated document of
+every subquery, so long cases used to blow up prompt tokens or overflow the model
+context. The packer counts the tokens of each document with the model's tokenizer and
+fills a token budget, covering every subquery with its best documents before adding
+lower ranked ones.
+"""
+
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+import tiktoken
+from registry import registry
+
+SUBQUERY_SEPARATOR = "\n\n***\n\n"
+DOCUMENT_SEPARATOR = "\n\n---\n\n"
+
+
+def get_tokenizer(model: str) -> tiktoken.Encoding:
+    """Returns the shared tokenizer of a model, falling back to the gpt-4o encoding"""
+
+    def load_tokenizer():
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+
+    return registry.get_or_create(f"tokenizer:{model}", load_tokenizer)
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str) -> int:
+    """Counts the tokens of a text, documents are counted again on every retry so
+    the counts are memoized"""
+    return len(get_tokenizer(model).encode(text, disallowed_special=()))
+
+
+def format_subquery(question: str, docs: List[str]) -> str:
+    docs_str = DOCUMENT_SEPARATOR.join(docs)
+    return f"Subquery:\n{question}\n\nDocuments:\n{docs_str}"
+
+
+def format_context(documents: List[dict]) -> str:
+    """Formats the documents of every subquery into the context given to the agents"""
+
+    return SUBQUERY_SEPARATOR.join(
+        format_subquery(item["question"], item["documents"]) for item in documents
+    )
+
+
+def pack_documents(
+    documents: List[dict], model: str, token_budget: int
+) -> Tuple[List[dict], List[dict]]:
+    """Selects the documents that fit the token budget
+
+    Documents are ranked within their subquery by their relevance score (the
+    cross-encoder or retrieval score carried through grading and translation), and
+    taken rank by rank across the subqueries so every subquery is covered by its most
+    relevant document before any subquery gets a second one. Within a round the higher
+    scored documents go first. Documents without a score, such as web results, rank
+    after the scored ones in their original order. A document already packed for
+    another subquery is dropped as a duplicate instead of being paid for twice.
+
+    Returns the packed documents per subquery and the dropped documents with the
+    reason they were dropped.
+    """
+
+    packed = [{"question": item["question"], "documents": []} for item in documents]
+    dropped = []
+
+    # Every subquery costs its header even before any document is packed
+    used_tokens = count_tokens(format_context(packed), model)
+    separator_tokens = count_tokens(DOCUMENT_SEPARATOR, model)
+
+    def by_relevance(scored):
+        position, (doc, score) = scored
+        return (score is None, -(score or 0.0), position)
+
+    candidates = []
+    for i, item in enumerate(documents):
+        scores = item.get("scores") or [None] * len(item["documents"])
+        ranked = sorted(enumerate(zip(item["documents"], scores)), key=by_relevance)
+        candidates.extend(
+            (rank, i, doc, score) for rank, (_, (doc, score)) in enumerate(ranked)
+        )
+    candidates.sort(
+        key=lambda candidate: (
+            candidate[0],
+            candidate[3] is None,
+            -(candidate[3] or 0.0),
+            candidate[1],
+        )
+    )
+
+    packed_texts = set()
+    for rank, i, doc, score in candidates:
+        tokens = count_tokens(doc, model)
+        reason = None
+        if doc in packed_texts:
+            reason = "duplicate"
+        elif used_tokens + tokens + separator_tokens > token_budget:
+            reason = "over token budget"
+
+        if reason is not None:
+            dropped.append(
+                {
+                    "question": documents[i]["question"],
+                    "document": doc,
+                    "rank": rank,
+                    "tokens": tokens,
+                    "reason": reason,
+                }
+            )
+            continue
+
+        packed[i]["documents"].append(doc)
+        packed_texts.add(doc)
+        used_tokens += tokens + separator_tokens
+
+    return packed, dropped
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def document_source(document: str) -> str:
+    """Returns the source line of a translated document ("source:...\\ncontent:...")"""
+
+    first_line = document.split("\n", 1)[0]
+    return first_line[len("source:"):].strip() if first_line.startswith("source:") else ""
+
+
+def select_cited_documents(
+    documents: List[dict], quotes: List[Tuple[str, str]], min_overlap: float = 0.6
+) -> List[dict]:
+    """Keeps only the documents cited by the (source, text) quotes
+
+    A document is cited when it has the same source as a quote or contains most of the
+    words of a quote's text. Subqueries left without documents are dropped.
+    """
+
+    quote_sources = {source.strip().lower() for source, _ in quotes if source.strip()}
+    quote_words = [_words(text) for _, text in quotes if text.strip()]
+
+    def is_cited(document: str) -> bool:
+        if document_source(document).lower() in quote_sources:
+            return True
+        document_words = _words(document)
+        return any(
+            len(words & document_words) >= min_overlap * len(words) for words in quote_words
+        )
+
+    selected = []
+    for item in documents:
+        cited = [document for document in item["documents"] if is_cited(document)]
+        if cited:
+            selected.append({"question": item["question"], "documents": cited})
+    return selected
@@ -1,19 +1,316 @@
-from langchain_qdrant import Qdrant
-from qdrant_client import QdrantClient
+import asyncio
+import os
+import weakref
+from typing import Dict, List, Optional
+from langchain_qdrant import FastEmbedSparse, Qdrant, QdrantVectorStore, RetrievalMode
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 from langchain_huggingface import HuggingFaceEmbeddings
-from constants import VectorDb
+from constants import Caches, VectorDb
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from local_vector_store import LocalVectorStore
+from registry import registry
 
 
 def get_vector_embeddings(embedding_model: str):
-    embeddings = HuggingFaceEmbeddings(model_name=embedding_model)
-    return embeddings
+    return registry.get_or_create(
+        f"embeddings:{embedding_model}",
+        lambda: HuggingFaceEmbeddings(model_name=embedding_model),
+    )
+
+
+def get_query_embeddings(embedding_model: str = VectorDb.EMBEDDING_MODEL) -> CachedEmbeddings:
+    """Returns the embedding model wrapped with the persistent query embedding cache"""
+
+    def create_cached_embeddings():
+        cache = EmbeddingCache(
+            model_name=embedding_model,
+            directory=Caches.DIRECTORY,
+            memory_entries=Caches.EMBEDDING_MEMORY_ENTRIES,
+            disk_entries=Caches.EMBEDDING_DISK_ENTRIES,
+        )
+        return CachedEmbeddings(get_vector_embeddings(embedding_model), cache)
+
+    return registry.get_or_create(
+        f"query-embeddings:{embedding_model}", create_cached_embeddings
+    )
+
+
+def get_query_embedding_cache_stats() -> Dict[str, Dict[str, float]]:
+    """Returns the hit and miss counters of every query embedding cache created so far,
+    without loading an embedding model that has not been used yet"""
+
+    return {
+        embeddings.cache.model_name: embeddings.cache.stats()
+        for embeddings in registry.find(CachedEmbeddings)
+    }
+
+
+def get_sparse_embeddings(sparse_model: str = VectorDb.SPARSE_EMBEDDING_MODEL) -> FastEmbedSparse:
+    return registry.get_or_create(
+        f"sparse-embeddings:{sparse_model}",
+        lambda: FastEmbedSparse(model_name=sparse_model),
+    )
+
+
+def get_raw_qdrant_client(
+    url: str = VectorDb.VECTOR_DB_URL, prefer_grpc: bool = VectorDb.PREFER_GRPC
+) -> QdrantClient:
+    return registry.get_or_create(
+        f"qdrant-client:{url}:{'grpc' if prefer_grpc else 'http'}",
+        lambda: QdrantClient(
+            url,
+            grpc_port=VectorDb.VECTOR_DB_GRPC_PORT,
+            prefer_grpc=prefer_grpc,
+        ),
+    )
+
+
+# Async clients hold connection pools bound to the event loop that created them,
+# so one client is kept per running loop (Streamlit starts a new loop per run), and
+# closed when that loop shuts down
+_async_qdrant_clients = weakref.WeakKeyDictionary()
+_async_qdrant_closers = weakref.WeakKeyDictionary()
+
+
+async def _close_with_loop():
+    """Closes the clients of the running loop once it shuts down, `asyncio.run` cancels
+    this task before closing the loop"""
+
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # The task references the loop, it has to be dropped for the loop to be collected
+        _async_qdrant_closers.pop(loop, None)
+        for client in _async_qdrant_clients.pop(loop, {}).values():
+            await client.close()
+
+
+def get_async_qdrant_client(
+    url: str = VectorDb.VECTOR_DB_URL, prefer_grpc: bool = VectorDb.PREFER_GRPC
+) -> AsyncQdrantClient:
+    loop = asyncio.get_running_loop()
+    loop_clients = _async_qdrant_clients.setdefault(loop, {})
+    if loop not in _async_qdrant_closers:
+        # The loop only keeps weak references to its tasks
+        _async_qdrant_closers[loop] = loop.create_task(_close_with_loop())
+    key = (url, prefer_grpc)
+    if key not in loop_clients:
+        loop_clients[key] = AsyncQdrantClient(
+            url,
+            grpc_port=VectorDb.VECTOR_DB_GRPC_PORT,
+            prefer_grpc=prefer_grpc,
+        )
+    return loop_clients[key]
+
+
+def get_quantization_config(quantization: Optional[str] = VectorDb.QUANTIZATION):
+    """Returns the Qdrant quantization config for "int8", "binary" or None"""
+
+    if quantization == "int8":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+            )
+        )
+    if quantization == "binary":
+        return models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=True)
+        )
+    if quantization is None:
+        return None
+    raise ValueError(f"Unsupported quantization: {quantization}")
+
+
+def get_search_params(
+    quantization: Optional[str] = VectorDb.QUANTIZATION,
+    oversampling: float = VectorDb.QUANTIZATION_OVERSAMPLING,
+    rescore: bool = VectorDb.QUANTIZATION_RESCORE,
+) -> Optional[models.SearchParams]:
+    """Returns search params that oversample the quantized index and rescore at full precision"""
+
+    if quantization is None:
+        return None
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(
+            ignore=False, rescore=rescore, oversampling=oversampling
+        )
+    )
+
+
+def get_local_vector_store(collection_name: str = VectorDb.COLLECTION_NAME) -> LocalVectorStore:
+    return registry.get_or_create(
+        f"local-vector-store:{collection_name}",
+        lambda: LocalVectorStore(
+            path=VectorDb.LOCAL_PATH,
+            collection_name=collection_name,
+            embeddings=get_query_embeddings(VectorDb.EMBEDDING_MODEL),
+            dtype=VectorDb.LOCAL_DTYPE,
+            index=VectorDb.LOCAL_INDEX,
+            ivf_lists=VectorDb.LOCAL_IVF_LISTS,
+            ivf_probes=VectorDb.LOCAL_IVF_PROBES,
+            quantization=VectorDb.QUANTIZATION,
+            oversampling=VectorDb.QUANTIZATION_OVERSAMPLING,
+            rescore=VectorDb.QUANTIZATION_RESCORE,
+            retrieval_mode=VectorDb.RETRIEVAL_MODE,
+        ),
+    )
+
+
+def get_retrieval_modes(
+    collection_name: str = VectorDb.COLLECTION_NAME, url: str = VectorDb.VECTOR_DB_URL
+) -> List[str]:
+    """Returns the retrieval modes a collection supports
+
+    Hybrid retrieval needs the sparse BM25 vectors, which Qdrant collections only have
+    when they were ingested in hybrid mode. The local store indexes the chunk text itself,
+    and a collection that does not exist yet is created in whichever mode ingests it.
+    """
+
+    if VectorDb.BACKEND == "local":
+        return ["dense", "hybrid"]
+
+    client = get_raw_qdrant_client(url)
+    if not client.collection_exists(collection_name):
+        return ["dense", "hybrid"]
+    sparse_vectors = client.get_collection(collection_name).config.params.sparse_vectors
+    if VectorDb.SPARSE_VECTOR_NAME in (sparse_vectors or {}):
+        return ["dense", "hybrid"]
+    return ["dense"]
+
+
+def resolve_retrieval_mode(
+    retrieval_mode: str,
+    collection_name: str = VectorDb.COLLECTION_NAME,
+    url: str = VectorDb.VECTOR_DB_URL,
+) -> str:
+    """Returns the retrieval mode to use with a collection, falling back to dense when
+    hybrid was asked for but the collection has no sparse vectors"""
 
+    if retrieval_mode == "hybrid" and "hybrid" not in get_retrieval_modes(
+        collection_name, url
+    ):
+        print(
+            f"Collection {collection_name} has no sparse vectors, "
+            "falling back to dense retrieval (re-ingest it in hybrid mode to enable hybrid)"
+        )
+        return "dense"
+    return retrieval_mode
 
-def get_qdrant_client():
-    embeddings = get_vector_embeddings(VectorDb.EMBEDDING_MODEL)
-    client = QdrantClient(VectorDb.VECTOR_DB_URL)
-    return Qdrant(
-        client=client,
-        embeddings=embeddings,
-        collection_name="physio-textbooks",
+
+def get_collection_exists(collection_name: str) -> bool:
+    """Returns whether anything has been stored in the collection yet"""
+
+    if VectorDb.BACKEND == "local":
+        return os.path.exists(
+            os.path.join(VectorDb.LOCAL_PATH, collection_name, "vectors.npy")
+        )
+    return get_raw_qdrant_client().collection_exists(collection_name)
+
+
+def get_stored_metadata(collection_name: str, ids: List[str]) -> Dict[str, dict]:
+    """Returns the metadata of the points of the collection with the given ids"""
+
+    if not ids or not get_collection_exists(collection_name):
+        return {}
+
+    if VectorDb.BACKEND == "local":
+        return get_local_vector_store(collection_name).get_metadata(ids)
+
+    points = get_raw_qdrant_client().retrieve(
+        collection_name=collection_name, ids=ids, with_payload=True
     )
+    return {str(point.id): (point.payload or {}).get("metadata") or {} for point in points}
+
+
+def get_qdrant_client(collection_name: str = VectorDb.COLLECTION_NAME):
+    """Returns the vector store for a collection, backed by Qdrant or the embedded local store"""
+
+    if VectorDb.BACKEND == "local":
+        return get_local_vector_store(collection_name)
+
+    def create_vector_store():
+        if resolve_retrieval_mode(VectorDb.RETRIEVAL_MODE, collection_name) == "hybrid":
+            return QdrantVectorStore(
+                client=get_raw_qdrant_client(),
+                collection_name=collection_name,
+                embedding=get_query_embeddings(VectorDb.EMBEDDING_MODEL),
+                retrieval_mode=RetrievalMode.HYBRID,
+                sparse_embedding=get_sparse_embeddings(),
+                sparse_vector_name=VectorDb.SPARSE_VECTOR_NAME,
+            )
+        return Qdrant(
+            client=get_raw_qdrant_client(),
+            embeddings=get_query_embeddings(VectorDb.EMBEDDING_MODEL),
+            collection_name=collection_name,
+        )
+
+    return registry.get_or_create(
+        f"vector-store:{collection_name}", create_vector_store
+    )
+
+
+def store_documents(
+    documents,
+    url: str = VectorDb.VECTOR_DB_URL,
+    collection_name: str = VectorDb.COLLECTION_NAME,
+    quantization: Optional[str] = VectorDb.QUANTIZATION,
+    ids: Optional[List[str]] = None,
+):
+    """Embeds and stores documents in the configured vector database backend, points
+    with the same ids as existing ones replace them"""
+
+    if VectorDb.BACKEND == "local":
+        vector_store = get_local_vector_store(collection_name)
+        if quantization != vector_store.quantization:
+            vector_store.set_quantization(quantization)
+        vector_store.add_documents(documents, ids=ids)
+        return vector_store
+
+    quantization_config = get_quantization_config(quantization)
+
+    # Sparse BM25 vectors are stored next to the dense ones, this needs a collection
+    # created in hybrid mode. Documents added to an existing collection follow the mode
+    # it was created in (re-ingest into a new collection to switch it)
+    if get_raw_qdrant_client(url).collection_exists(collection_name):
+        hybrid = "hybrid" in get_retrieval_modes(collection_name, url)
+    else:
+        hybrid = VectorDb.RETRIEVAL_MODE == "hybrid"
+
+    if hybrid:
+        vector_store = QdrantVectorStore.from_documents(
+            documents,
+            get_vector_embeddings(VectorDb.EMBEDDING_MODEL),
+            url=url,
+            collection_name=collection_name,
+            prefer_grpc=False,
+            retrieval_mode=RetrievalMode.HYBRID,
+            sparse_embedding=get_sparse_embeddings(),
+            sparse_vector_name=VectorDb.SPARSE_VECTOR_NAME,
+            ids=ids,
+            vector_params={"on_disk": quantization_config is not None},
+            collection_create_options={"quantization_config": quantization_config},
+        )
+        return vector_store
+
+    vector_store = Qdrant.from_documents(
+        documents,
+        get_vector_embeddings(VectorDb.EMBEDDING_MODEL),
+        url=url,
+        collection_name=collection_name,
+        prefer_grpc=False,
+        ids=ids,
+        # Keep the full-precision vectors on disk when the quantized codes serve search from RAM
+        on_disk=quantization_config is not None,
+        quantization_config=quantization_config,
+    )
+
+    # Collections created before quantization was enabled are migrated in place
+    if quantization_config is not None:
+        vector_store.client.update_collection(
+            collection_name=collection_name,
+            vectors_config={"": models.VectorParamsDiff(on_disk=True)},
+            quantization_config=quantization_config,
+        )
+
+    return vector_store
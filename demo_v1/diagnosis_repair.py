@@ -0,0 +1,192 @@
+"""
+Helpers for repairing only the ungrounded diagnoses of a generation.
+
+The hallucination grader reports claims and hallucinations for the whole differential,
+so each finding is attributed to the diagnosis it most overlaps with. Grades are kept
+per diagnosis, which lets a retry regenerate and re-grade only the diagnoses that
+failed and merge the result with the grades of the untouched ones.
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+from agents.diagnosis_generator import DiagnosisGeneratorOutput, DifferentialDiagnosis
+from agents.halluncination_grader import HallucinationGraderOutput, OverallAssessment
+
+# Diagnoses graded below this score are regenerated by the repair loop
+DIAGNOSIS_GROUNDED_THRESHOLD = 0.7
+
+CONFIDENCE_ORDER = ["Low", "Moderate", "High"]
+
+
+def format_diagnosis(index: int, diagnosis: DifferentialDiagnosis) -> str:
+    """Formats one differential diagnosis as markdown, as it appears in the generation"""
+
+    text = f"### Diagnosis {index}: {diagnosis.diagnosis}\n"
+    text += f"**Rationale:** {diagnosis.rational}\n\n"
+
+    text += "##### In-text citations\n"
+    for quote in diagnosis.relevant_quotes:
+        text += f"\\[{quote.ieee_intext_citation}\\]: {quote.source}\n\n"
+        text += f"    - {quote.text}\n"
+        text += "\n\n"
+
+    text += "\n"
+    return text
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def attribute_statement(statement: str, diagnoses: List[DifferentialDiagnosis]) -> int:
+    """Returns the index of the diagnosis whose text shares the most words with the statement"""
+
+    statement_words = _words(statement)
+    overlaps = [
+        len(statement_words & _words(format_diagnosis(i, diagnosis)))
+        for i, diagnosis in enumerate(diagnoses, start=1)
+    ]
+    return max(range(len(diagnoses)), key=lambda i: overlaps[i])
+
+
+def diagnosis_score(grade: HallucinationGraderOutput, default: float) -> float:
+    """Fraction of the grounded claims of one diagnosis, hallucinations count as ungrounded"""
+
+    grounded = sum(claim.is_grounded for claim in grade.verified_claims)
+    total = len(grade.verified_claims) + len(grade.identified_hallucinations)
+    return grounded / total if total else default
+
+
+def split_grade(
+    grade: HallucinationGraderOutput, diagnoses: List[DifferentialDiagnosis]
+) -> List[HallucinationGraderOutput]:
+    """Splits a grade of several diagnoses into one grade per diagnosis"""
+
+    if not diagnoses:
+        return []
+
+    claims = [[] for _ in diagnoses]
+    hallucinations = [[] for _ in diagnoses]
+    for claim in grade.verified_claims:
+        claims[attribute_statement(claim.claim, diagnoses)].append(claim)
+    for hallucination in grade.identified_hallucinations:
+        hallucinations[attribute_statement(hallucination.statement, diagnoses)].append(
+            hallucination
+        )
+
+    grades = []
+    for i in range(len(diagnoses)):
+        diagnosis_grade = HallucinationGraderOutput(
+            overall_assessment=grade.overall_assessment,
+            verified_claims=claims[i],
+            identified_hallucinations=hallucinations[i],
+        )
+        score = diagnosis_score(
+            diagnosis_grade, grade.overall_assessment.grounded_score
+        )
+        diagnosis_grade.overall_assessment = OverallAssessment(
+            grounded_score=score,
+            confidence=grade.overall_assessment.confidence,
+            summary=grade.overall_assessment.summary,
+        )
+        grades.append(diagnosis_grade)
+    return grades
+
+
+def merge_grades(grades: List[HallucinationGraderOutput]) -> HallucinationGraderOutput:
+    """Merges per diagnosis grades into one grade of the whole differential
+
+    The grounded score is the mean of the per diagnosis scores and the confidence is
+    the lowest confidence of any diagnosis.
+    """
+
+    summaries = list(dict.fromkeys(grade.overall_assessment.summary for grade in grades))
+    return HallucinationGraderOutput(
+        overall_assessment=OverallAssessment(
+            grounded_score=sum(grade.overall_assessment.grounded_score for grade in grades)
+            / len(grades),
+            confidence=min(
+                (grade.overall_assessment.confidence for grade in grades),
+                key=CONFIDENCE_ORDER.index,
+            ),
+            summary=" ".join(summaries),
+        ),
+        verified_claims=[claim for grade in grades for claim in grade.verified_claims],
+        identified_hallucinations=[
+            hallucination
+            for grade in grades
+            for hallucination in grade.identified_hallucinations
+        ],
+    )
+
+
+def failing_diagnoses(grades: List[HallucinationGraderOutput]) -> List[int]:
+    """Returns the indices of the diagnoses graded as not grounded enough"""
+
+    return [
+        i
+        for i, grade in enumerate(grades)
+        if grade.identified_hallucinations
+        or grade.overall_assessment.grounded_score < DIAGNOSIS_GROUNDED_THRESHOLD
+    ]
+
+
+def describe_problems(grade: HallucinationGraderOutput) -> str:
+    """Lists the ungrounded claims and hallucinations of one diagnosis for the repairer"""
+
+    problems = [
+        f"- Unsupported claim: {claim.claim}\n  Reason: {claim.explanation}"
+        for claim in grade.verified_claims
+        if not claim.is_grounded
+    ]
+    problems += [
+        f"- Hallucination: {hallucination.statement}\n  Reason: {hallucination.explanation}"
+        for hallucination in grade.identified_hallucinations
+    ]
+    return "\n".join(problems) or "- The diagnosis is not sufficiently grounded in the context"
+
+
+def splice_diagnoses(
+    generation: DiagnosisGeneratorOutput,
+    repaired: Dict[int, Tuple[DifferentialDiagnosis, List[str]]],
+) -> DiagnosisGeneratorOutput:
+    """Replaces the repaired diagnoses in the generation, keeping every other field
+
+    `repaired` maps a diagnosis index to the repaired diagnosis and the references it
+    added after the existing ones. Repairs run independently, so their added references
+    are appended in diagnosis order and the citations renumbered to match.
+    """
+
+    differential_diagnoses = list(generation.differential_diagnoses)
+    ieee_references = list(generation.ieee_references)
+    existing_count = len(generation.ieee_references)
+
+    for i in sorted(repaired):
+        diagnosis, additional_references = repaired[i]
+        citation_numbers = {}
+        for offset, reference in enumerate(additional_references, start=1):
+            if reference not in ieee_references:
+                ieee_references.append(reference)
+            citation_numbers[existing_count + offset] = ieee_references.index(reference) + 1
+
+        relevant_quotes = [
+            quote.model_copy(
+                update={
+                    "ieee_intext_citation": citation_numbers.get(
+                        quote.ieee_intext_citation, quote.ieee_intext_citation
+                    )
+                }
+            )
+            for quote in diagnosis.relevant_quotes
+        ]
+        differential_diagnoses[i] = diagnosis.model_copy(
+            update={"relevant_quotes": relevant_quotes}
+        )
+
+    return generation.model_copy(
+        update={
+            "differential_diagnoses": differential_diagnoses,
+            "ieee_references": ieee_references,
+        }
+    )
@@ -4,16 +4,17 @@ from fastapi import FastAPI, UploadFile
 from typing import List
 import os
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import qdrant
 from langchain_community.document_loaders.pdf import PyPDFLoader
-from langchain_huggingface import HuggingFaceEmbeddings
+from constants import VectorDb
+from db import store_documents
+from registry import registry
 
 # FastAPI app
 app = FastAPI()
 
 # Qdrant setup
-VECTOR_DB_URL = "http://localhost:6333"
-COLLECTION_NAME = "physio-textbooks"
+VECTOR_DB_URL = VectorDb.VECTOR_DB_URL
+COLLECTION_NAME = VectorDb.COLLECTION_NAME
 
 # Directory to temporarily store uploaded files
 UPLOAD_DIR = "./uploaded_documents"
@@ -23,9 +24,6 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 async def ingest_documents(files: List[UploadFile]):
     results = {"success": [], "errors": []}
     
-    # Initialize embeddings model
-    embeddings = HuggingFaceEmbeddings(model_name="NeuML/pubmedbert-base-embeddings")
-
     for file in files:
         try:
             # Save uploaded file temporarily
@@ -39,13 +37,11 @@ async def ingest_documents(files: List[UploadFile]):
             text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=100)
             chunks = text_splitter.split_documents(documents)
             
-            # Embed and store chunks in Qdrant
-            qdrant.Qdrant.from_documents(
+            # Embed and store chunks with the process-wide embeddings model
+            store_documents(
                 chunks,
-                embeddings,
                 url=VECTOR_DB_URL,
                 collection_name=COLLECTION_NAME,
-                prefer_grpc=False,
             )
             
             # If successful, add to results
@@ -61,3 +57,9 @@ async def ingest_documents(files: List[UploadFile]):
     # Determine overall success
     overall_success = bool(results["success"])
     return {"success": overall_success, "results": results}
+
+
+@app.get("/resources/")
+async def resources():
+    # Load time and resident memory of every shared model and client in this process
+    return {"resources": [vars(item) for item in registry.stats()]}
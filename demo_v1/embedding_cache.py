@@ -0,0 +1,195 @@
+"""
+Two-tier cache for query embeddings.
+
+The query translator keeps producing the same subqueries across cases, so query
+embeddings are cached by model name and normalized text: an in-memory LRU tier in
+front of a size-bounded SQLite tier that survives restarts. Vectors are stored as
+float64 on disk, so both tiers return exactly what the model computed.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+# Version of the on-disk table, version 0 stored float32 vectors
+SCHEMA_VERSION = 1
+
+
+def normalize_query(text: str) -> str:
+    """Normalizes a query for cache lookups, PubMedBERT is uncased so case is dropped too"""
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """Query embedding cache with an in-memory LRU tier and an on-disk tier"""
+
+    def __init__(
+        self,
+        model_name: str,
+        directory: str,
+        memory_entries: int = 2048,
+        disk_entries: int = 100_000,
+        touch_batch: int = 256,
+    ):
+        self.model_name = model_name
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.touch_batch = touch_batch
+
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        # Access times of memory hits not yet written to the disk tier
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "query_embeddings.sqlite"),
+            check_same_thread=False,
+        )
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS embeddings")
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+        )
+        self._db.commit()
+        self._disk_size = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(
+            f"{self.model_name}\0{normalize_query(text)}".encode("utf-8")
+        ).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self):
+        """Writes the access times of memory hits to the disk tier, the caller commits"""
+
+        if self._touched:
+            self._db.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Returns a copy of the cached embedding of the query, or None on a miss"""
+
+        key = self._key(text)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                # Memory hits count as uses for the disk eviction too, written in batches
+                # so a hit does not cost a write
+                self._touched[key] = time.time()
+                if len(self._touched) >= self.touch_batch:
+                    self._flush_touched()
+                    self._db.commit()
+                return list(self._memory[key])
+
+            row = self._db.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            vector = array("d", row[0]).tolist()
+            self._db.execute(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self._db.commit()
+            self._remember(key, vector)
+            self.disk_hits += 1
+            return list(vector)
+
+    def put(self, text: str, vector: List[float]):
+        """Stores the embedding of the query in both tiers"""
+
+        key = self._key(text)
+        with self._lock:
+            self._remember(key, list(vector))
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                (key, array("d", vector).tobytes(), time.time()),
+            )
+            # Evict the least recently used rows once the disk tier is over its bound. The
+            # size only counts up here, puts follow misses so replaced keys are rare
+            self._disk_size += 1
+            if self._disk_size > self.disk_entries:
+                self._flush_touched()
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_entries,),
+                )
+                self._disk_size = self._db.execute(
+                    "SELECT COUNT(*) FROM embeddings"
+                ).fetchone()[0]
+            self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hit and miss counters of the cache"""
+
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves query embeddings from an `EmbeddingCache`
+
+    Document embeddings (ingestion) are passed straight through to the wrapped model.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embeds a batch of queries, running one forward pass for the cache misses only.
+        Queries with the same cache key are looked up and embedded once"""
+
+        unique = {}
+        for text in texts:
+            unique.setdefault(normalize_query(text), text)
+        vectors = {key: self.cache.get(text) for key, text in unique.items()}
+        missing = [key for key, vector in vectors.items() if vector is None]
+
+        if missing:
+            computed = self.embeddings.embed_documents([unique[key] for key in missing])
+            for key, vector in zip(missing, computed):
+                self.cache.put(unique[key], vector)
+                vectors[key] = list(vector)
+
+        return [vectors[normalize_query(text)] for text in texts]
@@ -5,14 +5,20 @@ from datetime import datetime
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from constants import Tracing
 from graph import run_graph, construct_graph
 
 
 async def evaluate():
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    chrome_trace_path = None
+    if Tracing.EVALUATION_CHROME_TRACES:
+        chrome_trace_path = os.path.join("traces", f"agentic-rag-{timestamp}.trace.json")
+
     graph_state = construct_graph()
-    generation = await run_graph(graph_state)
+    generation = await run_graph(graph_state, chrome_trace_path)
 
-    trace_file_name = f"agentic-rag-{datetime.now().strftime('%Y%m%d%H%M%S')}.txt"
+    trace_file_name = f"agentic-rag-{timestamp}.txt"
     trace_file_path = os.path.join("traces", trace_file_name)
 
     with open(trace_file_path, "w") as f:
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# The concurrent runs repeat the sequential ones, so LLM responses and
+# web search results must not be cached
+os.environ["LLM_CACHE_AGENTS"] = ""
+os.environ["WEB_SEARCH_CACHE"] = "false"
+
+from mock_servers import MockServer, use_mock_server
+
+TEST_PROMPTS_DIRECTORY = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "test_prompts")
+)
+NUM_RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+# The factor the mock API latencies are scaled by
+LATENCY_SCALE = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+# Concurrent runs pass if they finish within this factor of the slowest single run
+TOLERANCE = 1.5
+# The event loop is considered blocked when a heartbeat is late by more than this
+MAX_LOOP_STALL_SECONDS = 0.5
+HEARTBEAT_SECONDS = 0.05
+
+# Against the mock APIs the comparison measures the graph, not the providers' load.
+# The chat models are created when the agents are imported, so the mock server has
+# to be up and the clients pointed at it before the graph is imported
+server = MockServer(latency_scale=LATENCY_SCALE, seed=0).start()
+use_mock_server(server)
+
+from constants import Tracing
+from graph import GraphState, construct_graph
+from run_tracing import export_chrome_trace
+
+
+def load_test_prompts():
+    file_names = sorted(os.listdir(TEST_PROMPTS_DIRECTORY))
+    prompts = []
+    for file_name in file_names:
+        with open(os.path.join(TEST_PROMPTS_DIRECTORY, file_name), "r") as f:
+            prompts.append((file_name, f.read()))
+    return prompts
+
+
+async def run_case(app, main_query: str):
+    inputs = GraphState(
+        main_query=main_query,
+        subqueries=[],
+        documents=[],
+        web_search="No",
+        generation="",
+        halluncination_check_balance=3,
+        has_hallucinations=False,
+        hallucination_grader_output=None,
+        context="",
+        packed_documents=[],
+        dropped_documents=[],
+        diagnosis_generator_output=None,
+        diagnosis_grades=[],
+        changed_diagnoses=None,
+        failing_diagnoses=[],
+        unmatched_quotes=[],
+        run_metrics={},
+        trace=[],
+        web_results=[],
+    )
+
+    start = time.perf_counter()
+    final_state = await app.ainvoke(inputs)
+    return time.perf_counter() - start, final_state["trace"]
+
+
+async def monitor_event_loop(stalls: list, stop: asyncio.Event):
+    """Records how late each heartbeat wakes up, a late heartbeat means a node blocked the loop"""
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        stalls.append(time.perf_counter() - start - HEARTBEAT_SECONDS)
+
+
+async def evaluate():
+    app = construct_graph().compile()
+    prompts = load_test_prompts()
+    cases = [prompts[i % len(prompts)] for i in range(NUM_RUNS)]
+
+    # Untimed, so loading the embedding models and opening the clients is not
+    # billed to the first sequential run
+    await run_case(app, cases[0][1])
+
+    # Each case on its own first, so the concurrent run can be compared to the slowest
+    sequential_seconds = []
+    runs = []
+    for file_name, main_query in cases:
+        seconds, trace = await run_case(app, main_query)
+        sequential_seconds.append(seconds)
+        runs.append((f"sequential {file_name}", trace))
+        print(f"Sequential run of {file_name} took {seconds:.1f}s")
+
+    stalls = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_event_loop(stalls, stop))
+
+    start = time.perf_counter()
+    concurrent_results = await asyncio.gather(
+        *[run_case(app, main_query) for _, main_query in cases]
+    )
+    concurrent_total = time.perf_counter() - start
+    concurrent_seconds = [seconds for seconds, _ in concurrent_results]
+    runs += [
+        (f"concurrent {file_name}", trace)
+        for (file_name, _), (_, trace) in zip(cases, concurrent_results)
+    ]
+
+    stop.set()
+    await monitor
+    server.stop()
+
+    slowest = max(sequential_seconds)
+    passed = (
+        concurrent_total <= slowest * TOLERANCE and max(stalls) <= MAX_LOOP_STALL_SECONDS
+    )
+
+    report = [
+        f"# Concurrency check ({NUM_RUNS} simultaneous graph runs against the mock APIs)\n",
+        f"Mock API latency scale: {LATENCY_SCALE}x\n",
+        "| Case | Sequential (s) | Concurrent (s) |",
+        "| --- | --- | --- |",
+        *[
+            f"| {file_name} | {sequential:.1f} | {concurrent:.1f} |"
+            for (file_name, _), sequential, concurrent in zip(
+                cases, sequential_seconds, concurrent_seconds
+            )
+        ],
+        "",
+        f"Sum of sequential runs: {sum(sequential_seconds):.1f}s",
+        f"Slowest sequential run: {slowest:.1f}s",
+        f"Concurrent wall time: {concurrent_total:.1f}s "
+        f"({concurrent_total / slowest:.2f}x the slowest run, tolerance {TOLERANCE}x)",
+        f"Longest event loop stall: {max(stalls) * 1000:.0f}ms "
+        f"(limit {MAX_LOOP_STALL_SECONDS * 1000:.0f}ms)",
+        f"Result: {'PASS' if passed else 'FAIL'}",
+    ]
+    print("\n".join(report))
+
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    report_file_name = f"concurrency-check-{timestamp}.md"
+    report_file_path = os.path.join("traces", report_file_name)
+
+    with open(report_file_path, "w") as f:
+        f.write("\n".join(report))
+        print(f"Report saved as {report_file_name}")
+
+    if Tracing.EVALUATION_CHROME_TRACES:
+        # The concurrent runs share the timeline, overlapping calls show as parallel lanes
+        chrome_trace_file_name = f"concurrency-check-{timestamp}.trace.json"
+        export_chrome_trace(runs, os.path.join("traces", chrome_trace_file_name))
+        print(f"Chrome trace saved as {chrome_trace_file_name}")
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(evaluate())
@@ -0,0 +1,98 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from constants import ScoreGate, VectorDb
+from score_gate import SimilarityGate, load_grader_decisions
+
+RETRIEVAL_MODE = VectorDb.RETRIEVAL_MODE
+TARGET_AGREEMENT = ScoreGate.TARGET_AGREEMENT
+MIN_DECISIONS = 50
+
+
+def fit_thresholds(scores: np.ndarray, labels: np.ndarray, target: float):
+    """Picks the widest reject and accept regions whose verdict agreement meets the target"""
+
+    order = np.argsort(scores)
+    scores, labels = scores[order], labels[order]
+    n = len(scores)
+
+    # Reject region: the lowest i scores, agreement is the fraction judged irrelevant
+    reject_count = 0
+    irrelevant = np.cumsum(1 - labels)
+    for i in range(1, n + 1):
+        if irrelevant[i - 1] / i >= target:
+            reject_count = i
+
+    # Accept region: the highest i scores, agreement is the fraction judged relevant
+    accept_count = 0
+    relevant = np.cumsum(labels[::-1])
+    for i in range(1, n - reject_count + 1):
+        if relevant[i - 1] / i >= target:
+            accept_count = i
+
+    reject_below = scores[reject_count] if reject_count < n else np.inf
+    if reject_count == 0:
+        reject_below = -np.inf
+    accept_from = scores[n - accept_count] if accept_count else np.inf
+
+    gated = reject_count + accept_count
+    agreed = (irrelevant[reject_count - 1] if reject_count else 0) + (
+        relevant[accept_count - 1] if accept_count else 0
+    )
+    agreement = agreed / gated if gated else 1.0
+    return float(reject_below), float(accept_from), gated / n, float(agreement)
+
+
+def fit():
+    # Only verdicts of runs where the LLM graded every pair are used. The pairs of gated
+    # and cascade runs are truncated to the borderline band, and fitting on them would
+    # narrow the sample further with every refit
+    logged = [
+        decision
+        for decision in load_grader_decisions()
+        if decision.retrieval_mode == RETRIEVAL_MODE
+    ]
+    decisions = [decision for decision in logged if decision.source == "llm"]
+    print(
+        f"Using {len(decisions)} of {len(logged)} logged {RETRIEVAL_MODE} decisions "
+        "(set LOG_GRADER_DECISIONS=true and GRADING_MODE=llm to collect more)"
+    )
+    if len(decisions) < MIN_DECISIONS:
+        print(
+            f"Only {len(decisions)} logged {RETRIEVAL_MODE} LLM grader decisions, need at least {MIN_DECISIONS}"
+        )
+        return
+
+    scores = np.array([decision.score for decision in decisions], dtype=np.float64)
+    labels = np.array([decision.is_relevant for decision in decisions], dtype=np.float64)
+
+    reject_below, accept_from, skip_fraction, agreement = fit_thresholds(
+        scores, labels, TARGET_AGREEMENT
+    )
+
+    gate = SimilarityGate(
+        reject_below=reject_below,
+        accept_from=accept_from,
+        retrieval_mode=RETRIEVAL_MODE,
+        target_agreement=TARGET_AGREEMENT,
+        agreement=agreement,
+        skip_fraction=skip_fraction,
+    )
+    gate.save()
+
+    print(f"Fitted on {len(decisions)} decisions ({labels.mean():.1%} relevant)")
+    print(f"Auto-reject below {reject_below:.4f}")
+    print(f"Auto-accept from {accept_from:.4f}")
+    print(
+        f"{skip_fraction:.1%} of grader calls skipped at {agreement:.1%} agreement "
+        f"(target {TARGET_AGREEMENT:.0%})"
+    )
+    print(f"Gate saved to {ScoreGate.GATE_PATH}")
+
+
+if __name__ == "__main__":
+    fit()
@@ -0,0 +1,158 @@
+import asyncio
+import math
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Every run repeats the same prompts, so LLM responses and
+# web search results must not be cached
+os.environ["LLM_CACHE_AGENTS"] = ""
+os.environ["WEB_SEARCH_CACHE"] = "false"
+
+from mock_servers import MockServer, use_mock_server
+
+TEST_PROMPTS_DIRECTORY = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "test_prompts")
+)
+# Runs of every test prompt, and the factor the mock API latencies are scaled by
+NUM_RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+LATENCY_SCALE = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+PERCENTILES = [50, 95, 99]
+
+# The chat models are created when the agents are imported, so the mock server has
+# to be up and the clients pointed at it before the graph is imported
+server = MockServer(latency_scale=LATENCY_SCALE, seed=0).start()
+use_mock_server(server)
+
+from constants import Tracing
+from graph import GraphState, construct_graph
+from run_tracing import export_chrome_trace, summarize_trace
+
+
+def load_test_prompts():
+    file_names = sorted(os.listdir(TEST_PROMPTS_DIRECTORY))
+    prompts = []
+    for file_name in file_names:
+        with open(os.path.join(TEST_PROMPTS_DIRECTORY, file_name), "r") as f:
+            prompts.append((file_name, f.read()))
+    return prompts
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile"""
+
+    ordered = sorted(values)
+    rank = max(1, math.ceil(len(ordered) * p / 100))
+    return ordered[rank - 1]
+
+
+async def run_case(app, main_query: str):
+    """Runs the graph once, returning the trace of the run"""
+
+    inputs = GraphState(
+        main_query=main_query,
+        subqueries=[],
+        documents=[],
+        web_search="No",
+        generation="",
+        halluncination_check_balance=3,
+        has_hallucinations=False,
+        hallucination_grader_output=None,
+        context="",
+        packed_documents=[],
+        dropped_documents=[],
+        diagnosis_generator_output=None,
+        diagnosis_grades=[],
+        changed_diagnoses=None,
+        failing_diagnoses=[],
+        unmatched_quotes=[],
+        run_metrics={},
+        trace=[],
+        web_results=[],
+    )
+
+    async for output in app.astream(inputs):
+        for value in output.values():
+            final_state = value
+    return final_state["trace"]
+
+
+def format_row(name: str, values: list) -> str:
+    percentiles = " | ".join(f"{percentile(values, p):.3f}" for p in PERCENTILES)
+    return f"| {name} | {len(values)} | {sum(values) / len(values):.3f} | {percentiles} |"
+
+
+async def evaluate():
+    app = construct_graph().compile()
+    prompts = load_test_prompts()
+
+    node_samples = defaultdict(list)
+    end_to_end = []
+    traces = []
+    runs = []
+    for run in range(NUM_RUNS):
+        for file_name, main_query in prompts:
+            trace = await run_case(app, main_query)
+            for span in trace:
+                node_samples[span["name"]].append(span["seconds"])
+            traces.append(trace)
+            runs.append((f"run {run + 1} {file_name}", trace))
+            seconds = summarize_trace(trace)["wall_seconds"]
+            end_to_end.append(seconds)
+            print(f"Run {run + 1} of {file_name} took {seconds:.2f}s")
+
+    server.stop()
+    requests = Counter(agent for agent, _ in server.requests)
+    mock_seconds = defaultdict(float)
+    for agent, latency in server.requests:
+        mock_seconds[agent] += latency
+    # Token and cost totals of all runs, from the LLM call spans of their traces
+    models = summarize_trace([span for trace in traces for span in trace])["models"]
+
+    header = " | ".join(f"p{p} (s)" for p in PERCENTILES)
+    report = [
+        f"# Graph benchmark ({NUM_RUNS} runs of {len(prompts)} test prompts against the mock APIs)\n",
+        f"Mock API latency scale: {LATENCY_SCALE}x\n",
+        f"| Node | Runs | Mean (s) | {header} |",
+        "| --- | --- | --- |" + " --- |" * len(PERCENTILES),
+        *[format_row(node, values) for node, values in node_samples.items()],
+        format_row("**end to end**", end_to_end),
+        "",
+        "| Model | Calls per run | Prompt tokens per run | Completion tokens per run | Cost per run (USD) |",
+        "| --- | --- | --- | --- | --- |",
+        *[
+            f"| {model} | {values['calls'] / len(traces):.1f} "
+            f"| {values['prompt_tokens'] / len(traces):.0f} "
+            f"| {values['completion_tokens'] / len(traces):.0f} "
+            f"| {values['cost'] / len(traces):.4f} |"
+            for model, values in models.items()
+        ],
+        "",
+        "| Mock API | Requests | Mean latency (s) |",
+        "| --- | --- | --- |",
+        *[
+            f"| {agent} | {count} | {mock_seconds[agent] / count:.3f} |"
+            for agent, count in sorted(requests.items())
+        ],
+    ]
+    print("\n".join(report))
+
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    report_file_name = f"graph-benchmark-{timestamp}.md"
+    report_file_path = os.path.join("traces", report_file_name)
+
+    with open(report_file_path, "w") as f:
+        f.write("\n".join(report))
+        print(f"Report saved as {report_file_name}")
+
+    if Tracing.EVALUATION_CHROME_TRACES:
+        chrome_trace_file_name = f"graph-benchmark-{timestamp}.trace.json"
+        export_chrome_trace(runs, os.path.join("traces", chrome_trace_file_name))
+        print(f"Chrome trace saved as {chrome_trace_file_name}")
+
+
+if __name__ == "__main__":
+    asyncio.run(evaluate())
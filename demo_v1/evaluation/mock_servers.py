@@ -0,0 +1,505 @@
+"""
+Offline stand-ins for the OpenAI chat completions API and the Tavily search API.
+
+Both APIs are served by one local HTTP server so the graph can run without network
+access or API keys, and its own overhead can be measured apart from the providers:
+
+    POST /v1/chat/completions   OpenAI compatible, streaming and non-streaming
+    POST /search                Tavily compatible
+
+The agent behind a chat completion is recognised by the heading of its user prompt,
+and answered with a payload built from, and validated against, that agent's pydantic
+output model. The payloads are derived from the prompt (subqueries from the query,
+quotes copied verbatim from the context, ...) so the graph's own checks pass on them.
+
+Every response is delayed by a latency drawn from the agent's `LatencyDistribution`.
+
+Run on its own with `python mock_servers.py [port] [latency scale]`, or start it from
+a script with `MockServer().start()` and point the clients at it with
+`use_mock_server(server)` before the agents are imported.
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# The agent output models are imported by the responder methods, importing an agent
+# creates its chat model, which has to happen after `use_mock_server`
+
+
+@dataclass
+class LatencyDistribution:
+    """Log-normal response latency, the usual shape of LLM API latencies
+
+    `median` is in seconds, `sigma` the spread of the underlying normal distribution
+    and `per_output_token` the extra time per completion token, so long outputs such
+    as the diagnosis take longer than a relevance verdict.
+    """
+
+    median: float
+    sigma: float = 0.35
+    per_output_token: float = 0.0
+
+    def sample(self, rng: random.Random, output_tokens: int, scale: float = 1.0) -> float:
+        latency = rng.lognormvariate(math.log(self.median), self.sigma)
+        return scale * (latency + self.per_output_token * output_tokens)
+
+
+# Roughly what the agents take against the real APIs
+DEFAULT_LATENCIES = {
+    "query_translator": LatencyDistribution(median=1.2, per_output_token=0.01),
+    "retrieval_grader": LatencyDistribution(median=0.5),
+    "listwise_retrieval_grader": LatencyDistribution(median=0.8, per_output_token=0.005),
+    "context_translator": LatencyDistribution(median=2.0, per_output_token=0.01),
+    "diagnosis_generator": LatencyDistribution(median=3.0, per_output_token=0.015),
+    "diagnosis_repairer": LatencyDistribution(median=2.0, per_output_token=0.015),
+    "hallucination_grader": LatencyDistribution(median=2.5, per_output_token=0.01),
+    "zero_shot": LatencyDistribution(median=3.0, per_output_token=0.015),
+    "websearch": LatencyDistribution(median=1.0, sigma=0.5),
+}
+
+# The agent of a chat completion is identified by the heading of its user prompt
+AGENT_PROMPT_HEADINGS = [
+    ("## Query to translate:", "query_translator"),
+    ("## Document to Evaluate:", "retrieval_grader"),
+    ("## Documents to Evaluate:", "listwise_retrieval_grader"),
+    ("# Query and Retrieved Documents", "context_translator"),
+    ("# Physiotherapy Differential Diagnosis Task", "diagnosis_generator"),
+    ("# Diagnosis Repair Task", "diagnosis_repairer"),
+    ("# Verification Task", "hallucination_grader"),
+]
+
+
+def identify_agent(user_prompt: str) -> str:
+    for heading, agent in AGENT_PROMPT_HEADINGS:
+        if heading in user_prompt:
+            return agent
+    return "zero_shot"
+
+
+def section(text: str, heading: str, next_heading: Optional[str] = None) -> str:
+    """Returns the text between a heading of the prompt and the next heading"""
+
+    start = text.find(heading)
+    if start == -1:
+        return ""
+    start += len(heading)
+    end = text.find(next_heading, start) if next_heading else -1
+    return text[start : end if end != -1 else len(text)].strip()
+
+
+def is_relevant(document: str, question: str, relevance_rate: float) -> bool:
+    """Deterministic relevance verdict, so repeated runs grade the same way"""
+
+    digest = hashlib.sha256(f"{question}\n{document}".encode()).digest()
+    return digest[0] / 255 < relevance_rate
+
+
+def first_sentence(text: str, max_words: int = 25) -> str:
+    """Returns the first sentence of a text, cut to a number of words, verbatim"""
+
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return " ".join(sentence.split()[:max_words])
+
+
+def context_documents(context: str) -> List[Tuple[str, str]]:
+    """Returns the (source, content) of the translated documents in a packed context"""
+
+    documents = []
+    pattern = r"source:([^\n]*)\ncontent:(.*?)(?=\n\n---\n\n|\n\n\*\*\*\n\n|$)"
+    for match in re.finditer(pattern, context, re.S):
+        source, content = match.group(1).strip(), match.group(2).strip()
+        if content:
+            documents.append((source, content))
+    return documents
+
+
+class MockResponder:
+    """Builds schema valid agent outputs from the prompts they are asked with"""
+
+    def __init__(
+        self,
+        num_subqueries: int = 3,
+        num_diagnoses: int = 3,
+        relevance_rate: float = 0.7,
+        grounded_score: float = 0.95,
+    ):
+        self.num_subqueries = num_subqueries
+        self.num_diagnoses = num_diagnoses
+        self.relevance_rate = relevance_rate
+        self.grounded_score = grounded_score
+
+    def respond(self, agent: str, prompt: str) -> str:
+        handler = getattr(self, agent)
+        return handler(prompt)
+
+    def query_translator(self, prompt: str) -> str:
+        from agents.query_translator import QueryTranslatorOutput
+
+        main_query = section(prompt, "## Query to translate:")
+        sentences = [
+            " ".join(sentence.split())
+            for sentence in re.split(r"(?<=[.!?])\s+", main_query)
+            if len(sentence.split()) >= 4
+        ]
+        sentences = sentences or [" ".join(main_query.split()) or "lower back pain"]
+        subqueries = [
+            f"What physiotherapy conditions are associated with: {sentences[i % len(sentences)]}"
+            for i in range(self.num_subqueries)
+        ]
+        return QueryTranslatorOutput(subqueries=subqueries).model_dump_json()
+
+    def retrieval_grader(self, prompt: str) -> str:
+        from agents.retrieval_grader import RetrievalGraderOutput
+
+        document = section(prompt, "## Document to Evaluate:", "## Physiotherapy Question:")
+        question = section(prompt, "## Physiotherapy Question:", "## Task:")
+        score = "yes" if is_relevant(document, question, self.relevance_rate) else "no"
+        return RetrievalGraderOutput(score=score).model_dump_json()
+
+    def listwise_retrieval_grader(self, prompt: str) -> str:
+        from agents.retrieval_grader import (
+            ListwiseDocumentVerdict,
+            ListwiseRetrievalGraderOutput,
+        )
+
+        documents = section(prompt, "## Documents to Evaluate:", "## Physiotherapy Question:")
+        question = section(prompt, "## Physiotherapy Question:", "## Task:")
+        chunks = re.split(r"### Document \d+\n\n", documents)[1:]
+        verdicts = [
+            ListwiseDocumentVerdict(
+                document=i,
+                score="yes" if is_relevant(chunk.strip(), question, self.relevance_rate) else "no",
+            )
+            for i, chunk in enumerate(chunks, start=1)
+        ]
+        return ListwiseRetrievalGraderOutput(verdicts=verdicts).model_dump_json()
+
+    def context_translator(self, prompt: str) -> str:
+        from agents.context_translator import ContextDocument, ContextTranslatorOutput
+
+        documents = section(prompt, "## Retrieved Documents:", "## Instructions:")
+        translated = []
+        for document in documents.split("\n\n---\n\n"):
+            if not document.strip():
+                continue
+            first_line, _, rest = document.strip().partition("\n")
+            if first_line.startswith("source:"):
+                # Retrieved chunks are "source:...WebSource:...\n\ncontent:..."
+                source = first_line[len("source:") :].split("WebSource:")[0].strip()
+                content = re.sub(r"^content:", "", rest.strip()).strip()
+            else:
+                source, content = "", document.strip()
+            translated.append(
+                ContextDocument(
+                    thought_process="The document describes findings relevant to the query.",
+                    content=" ".join(content.split()[:120]),
+                    source=source or "Retrieved document",
+                )
+            )
+        return ContextTranslatorOutput(context_documents=translated).model_dump_json()
+
+    def _diagnosis(
+        self, index: int, name: str, documents: List[Tuple[str, str]], sources: List[str]
+    ):
+        from agents.diagnosis_generator import ContextQuote, DifferentialDiagnosis
+
+        quotes = []
+        for offset in range(2):
+            if not documents:
+                break
+            source, content = documents[(2 * index + offset) % len(documents)]
+            quotes.append(
+                ContextQuote(
+                    text=first_sentence(content),
+                    source=source,
+                    ieee_intext_citation=sources.index(source) + 1,
+                )
+            )
+        return DifferentialDiagnosis(
+            relevant_quotes=quotes,
+            rational=f"The patient's presentation is consistent with {name.lower()} as described in the quoted documents.",
+            diagnosis=name,
+            likelihood=["High", "Moderate", "Low"][min(index, 2)],
+        )
+
+    def diagnosis_generator(self, prompt: str) -> str:
+        from agents.diagnosis_generator import DiagnosisGeneratorOutput
+
+        context = section(prompt, "## Context:", "## Patient Query:")
+        documents = context_documents(context)
+        sources = list(dict.fromkeys(source for source, _ in documents))
+        diagnoses = [
+            self._diagnosis(i, f"Candidate diagnosis {i + 1}", documents, sources)
+            for i in range(self.num_diagnoses)
+        ]
+        return DiagnosisGeneratorOutput(
+            differential_diagnoses=diagnoses,
+            ieee_references=[f"[{i}] {source}" for i, source in enumerate(sources, start=1)],
+            summary="The differential diagnoses are ranked by how well the retrieved documents support them.",
+            patient_summary="Adult patient presenting with musculoskeletal complaints.",
+        ).model_dump_json()
+
+    def diagnosis_repairer(self, prompt: str) -> str:
+        from agents.diagnosis_repairer import DiagnosisRepairOutput
+
+        context = section(prompt, "## Context:", "## Patient Query:")
+        documents = context_documents(context)
+        references = section(prompt, "## Existing References:", "## Diagnosis to Repair:")
+        diagnosis = section(prompt, "## Diagnosis to Repair:", "## Problems Found by Verification:")
+        match = re.search(r"### Diagnosis (\d+): (.*)", diagnosis)
+        index, name = 0, "Candidate diagnosis"
+        if match:
+            index, name = int(match.group(1)) - 1, match.group(2).strip()
+        # Cite the existing references only, so no references have to be added
+        sources = list(dict.fromkeys(source for source, _ in documents))
+        cited = [(source, content) for source, content in documents if f"] {source}" in references]
+        repaired = self._diagnosis(index, name, cited or documents, sources)
+        return DiagnosisRepairOutput(differential_diagnosis=repaired).model_dump_json()
+
+    def hallucination_grader(self, prompt: str) -> str:
+        from agents.halluncination_grader import (
+            HallucinationGraderOutput,
+            OverallAssessment,
+            VerifiedClaim,
+        )
+
+        answer = section(prompt, "## Differential Diagnosis:", "## Reference Facts:")
+        claims = [line.strip()[2:] for line in answer.splitlines() if line.strip().startswith("- ")]
+        return HallucinationGraderOutput(
+            overall_assessment=OverallAssessment(
+                grounded_score=self.grounded_score,
+                confidence="High",
+                summary="The diagnoses are supported by the reference facts.",
+            ),
+            verified_claims=[
+                VerifiedClaim(
+                    claim=claim,
+                    is_grounded=True,
+                    supporting_evidence=claim,
+                    explanation="The claim is quoted from the reference facts.",
+                )
+                for claim in claims
+            ],
+            identified_hallucinations=[],
+        ).model_dump_json()
+
+    def zero_shot(self, prompt: str) -> str:
+        return "### Diagnosis 1: Candidate diagnosis 1\n**Rationale:** Consistent with the presentation."
+
+    def web_search(self, query: str, max_results: int) -> List[dict]:
+        return [
+            {
+                "title": f"Result {i} for {query[:40]}",
+                "url": f"https://example.org/physio/{hashlib.sha1(f'{query}{i}'.encode()).hexdigest()[:12]}",
+                "content": f"Clinical guidance on {query.rstrip('?')}. Assessment and management are described for physiotherapists.",
+                "score": round(0.9 - 0.1 * i, 2),
+                "raw_content": None,
+            }
+            for i in range(max_results)
+        ]
+
+
+def count_tokens(text: str) -> int:
+    # About four characters per token, as the scheduler estimates
+    return max(1, len(text) // 4)
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self.chat_completion(body)
+        elif self.path.rstrip("/").endswith("/search"):
+            self.search(body)
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def chat_completion(self, body: dict):
+        messages = body.get("messages", [])
+        prompt = "\n".join(str(message.get("content")) for message in messages)
+        user_prompt = "\n".join(
+            str(message.get("content")) for message in messages if message.get("role") == "user"
+        )
+        agent = identify_agent(user_prompt)
+        content = self.server.responder.respond(agent, user_prompt)
+
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(content)
+        latency = self.server.latency(agent, completion_tokens)
+        self.server.record(agent, latency)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o")
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+        if not body.get("stream"):
+            time.sleep(latency)
+            self.send_json(
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                            "logprobs": None,
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        # Stream the content in small pieces, the first one after a third of the latency
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        pieces = [content[i : i + 16] for i in range(0, len(content), 16)] or [""]
+        time.sleep(latency / 3)
+        for i, piece in enumerate(pieces):
+            delta = {"content": piece} if i else {"role": "assistant", "content": piece}
+            self.send_event(completion_id, created, model, delta, None)
+            time.sleep(2 * latency / 3 / len(pieces))
+        self.send_event(completion_id, created, model, {}, "stop", usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_event(self, completion_id, created, model, delta, finish_reason, usage=None):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage is not None:
+            chunk["usage"] = usage
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.flush()
+
+    def search(self, body: dict):
+        query = body.get("query", "")
+        latency = self.server.latency("websearch", 0)
+        self.server.record("websearch", latency)
+        time.sleep(latency)
+        self.send_json(
+            200,
+            {
+                "query": query,
+                "follow_up_questions": None,
+                "answer": None,
+                "images": [],
+                "results": self.server.responder.web_search(query, int(body.get("max_results", 5))),
+                "response_time": round(latency, 2),
+            },
+        )
+
+
+class MockServer(ThreadingHTTPServer):
+    """Serves the mock OpenAI and Tavily APIs from a background thread"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latencies: Optional[Dict[str, LatencyDistribution]] = None,
+        latency_scale: float = 1.0,
+        responder: Optional[MockResponder] = None,
+        seed: Optional[int] = None,
+    ):
+        super().__init__(("127.0.0.1", port), MockRequestHandler)
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.latency_scale = latency_scale
+        self.responder = responder or MockResponder()
+        self.random = random.Random(seed)
+        self.requests = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def latency(self, agent: str, output_tokens: int) -> float:
+        distribution = self.latencies.get(agent, DEFAULT_LATENCIES["zero_shot"])
+        with self._lock:
+            latency = distribution.sample(self.random, output_tokens, self.latency_scale)
+        return latency
+
+    def record(self, agent: str, latency: float):
+        with self._lock:
+            self.requests.append((agent, latency))
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def use_mock_server(server: MockServer):
+    """Points the OpenAI and Tavily clients at the mock server
+
+    Must run before the agents are imported, the chat models are created on import.
+    """
+
+    os.environ["OPENAI_API_KEY"] = os.environ.get("OPENAI_API_KEY") or "mock-key"
+    os.environ["OPENAI_API_BASE"] = f"{server.url}/v1"
+    os.environ["OPENAI_BASE_URL"] = f"{server.url}/v1"
+    os.environ["TAVILY_API_KEY"] = os.environ.get("TAVILY_API_KEY") or "mock-key"
+
+    # The Tavily wrapper has no base URL setting, it reads this module constant per call
+    from langchain_community.utilities import tavily_search
+
+    tavily_search.TAVILY_API_URL = server.url
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    latency_scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    server = MockServer(port=port, latency_scale=latency_scale)
+    print(f"Mock OpenAI API at {server.url}/v1, mock Tavily API at {server.url}/search")
+    print(f"Set OPENAI_BASE_URL={server.url}/v1 to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,179 @@
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from constants import VectorDb
+from db import get_local_vector_store, get_raw_qdrant_client, get_search_params
+from local_vector_store import LocalVectorStore
+from qdrant_client import models
+
+K = 3
+NUM_QUERIES = 200
+QUERY_NOISE = 0.05
+
+# (quantization, oversampling, rescore) settings compared against exact float32 search
+SETTINGS = [
+    (None, 1.0, True),
+    ("int8", 1.0, True),
+    ("int8", 2.0, True),
+    ("int8", 4.0, True),
+    ("int8", 2.0, False),
+    ("binary", 2.0, True),
+    ("binary", 4.0, True),
+    ("binary", 8.0, True),
+    ("binary", 4.0, False),
+]
+
+
+def dense_vector(point) -> list:
+    """Returns the dense vector of a point, hybrid collections store it next to the sparse
+    one as the unnamed ("") vector"""
+
+    if isinstance(point.vector, dict):
+        return point.vector[""]
+    return point.vector
+
+
+def load_collection_vectors():
+    """Loads every stored vector of the collection from the configured backend"""
+
+    if VectorDb.BACKEND == "local":
+        store = get_local_vector_store()
+        return np.asarray(store.vectors, dtype=np.float32)
+
+    client = get_raw_qdrant_client()
+    vectors, offset = [], None
+    while True:
+        points, offset = client.scroll(
+            collection_name=VectorDb.COLLECTION_NAME,
+            with_vectors=True,
+            with_payload=False,
+            limit=1024,
+            offset=offset,
+        )
+        vectors.extend(dense_vector(point) for point in points)
+        if offset is None:
+            break
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def sample_queries(vectors: np.ndarray) -> np.ndarray:
+    """Builds query vectors by perturbing stored vectors, so every query has near neighbours"""
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(vectors), min(NUM_QUERIES, len(vectors)), replace=False)
+    queries = vectors[rows] + rng.normal(0, QUERY_NOISE, size=(len(rows), vectors.shape[1]))
+    return queries.astype(np.float32)
+
+
+def ids_of(results):
+    return [{doc.metadata["_id"] for doc, score in hits} for hits in results]
+
+
+def recall(truth, found):
+    return statistics.mean(len(t & f) / len(t) for t, f in zip(truth, found) if t)
+
+
+def run_local_report(vectors: np.ndarray, queries: np.ndarray):
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        payloads = [{"page_content": "", "metadata": {}} for _ in range(len(vectors))]
+        ids = [str(i) for i in range(len(vectors))]
+        baseline = LocalVectorStore(directory, "baseline", embeddings=None)
+        baseline.upsert_vectors(vectors, payloads, ids)
+        truth = ids_of(baseline.search_by_vectors(queries, k=K))
+
+        for quantization, oversampling, rescore in SETTINGS:
+            name = f"{quantization}-{oversampling}-{rescore}"
+            store = LocalVectorStore(
+                directory,
+                baseline.collection_name,
+                embeddings=None,
+                quantization=quantization,
+                oversampling=oversampling,
+                rescore=rescore,
+            )
+
+            latencies = []
+            found = []
+            for query in queries:
+                start = time.perf_counter()
+                found.extend(ids_of(store.search_by_vectors([query], k=K)))
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            index_bytes = store.codes.nbytes if store.codes is not None else vectors.nbytes
+            rows.append(
+                f"| {name} | {recall(truth, found):.3f} | {statistics.mean(latencies):.2f} "
+                f"| {np.percentile(latencies, 95):.2f} | {index_bytes / (1024 * 1024):.1f} |"
+            )
+    return rows
+
+
+def run_qdrant_report(queries: np.ndarray):
+    """Measures the collection's configured quantization against exact search on the server"""
+
+    client = get_raw_qdrant_client()
+    exact = models.SearchParams(exact=True)
+    truth = [
+        {point.id for point in client.search(VectorDb.COLLECTION_NAME, query, limit=K, search_params=exact)}
+        for query in queries
+    ]
+
+    rows = []
+    for oversampling in (1.0, 2.0, 4.0):
+        for rescore in (True, False):
+            params = get_search_params(VectorDb.QUANTIZATION, oversampling, rescore)
+            latencies = []
+            found = []
+            for query in queries:
+                start = time.perf_counter()
+                points = client.search(
+                    VectorDb.COLLECTION_NAME, query, limit=K, search_params=params
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+                found.append({point.id for point in points})
+            rows.append(
+                f"| {VectorDb.QUANTIZATION}-{oversampling}-{rescore} | {recall(truth, found):.3f} "
+                f"| {statistics.mean(latencies):.2f} | {np.percentile(latencies, 95):.2f} |"
+            )
+    return rows
+
+
+def evaluate():
+    vectors = load_collection_vectors()
+    queries = sample_queries(vectors)
+
+    report = [
+        f"# Quantization recall vs latency ({VectorDb.COLLECTION_NAME})\n",
+        f"{len(vectors)} vectors, {len(queries)} queries, recall@{K} against exact float32 search\n",
+        "## Embedded store\n",
+        "| Setting (quantization-oversampling-rescore) | Recall | Mean ms | p95 ms | Index MB |",
+        "| --- | --- | --- | --- | --- |",
+        *run_local_report(vectors, queries),
+    ]
+
+    if VectorDb.BACKEND == "qdrant" and VectorDb.QUANTIZATION:
+        report += [
+            "\n## Qdrant server\n",
+            "| Setting (quantization-oversampling-rescore) | Recall | Mean ms | p95 ms |",
+            "| --- | --- | --- | --- |",
+            *run_qdrant_report(queries),
+        ]
+
+    report_file_name = f"quantization-report-{datetime.now().strftime('%Y%m%d%H%M%S')}.md"
+    report_file_path = os.path.join("traces", report_file_name)
+
+    with open(report_file_path, "w") as f:
+        f.write("\n".join(report))
+        print(f"Report saved as {report_file_name}")
+
+
+if __name__ == "__main__":
+    evaluate()
@@ -6,8 +6,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 
 from datetime import datetime
-from langchain_openai import ChatOpenAI
 from constants import Llm
+from llms import get_chat_model
 from langchain.prompts import ChatPromptTemplate
 
 
@@ -63,7 +63,7 @@ USER_PROMPT = """
 {assessment_data}
 """
 
-llm = ChatOpenAI(model=Llm.GPT_4O, temperature=0.5)
+llm = get_chat_model(Llm.GPT_4O, temperature=0.5, agent="zero_shot")
 
 prompt = ChatPromptTemplate.from_messages(
     [
@@ -72,7 +72,7 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-diagnosis_generator = prompt | llm
+diagnosis_generator = (prompt | llm).with_retry()
 
 
 def evaluate():
@@ -1,15 +1,73 @@
-from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import RunnableConfig
+from pydantic import ValidationError
 from langgraph.graph import StateGraph, END
 from pprint import pprint
 from typing import List, Literal, Optional
 from typing_extensions import TypedDict
 from agents.query_translator import query_translator, QueryTranslatorOutput
-from agents.retrieval_grader import retrieval_grader, RetrievalGraderOutput
-from agents.diagnosis_generator import diagnosis_generator, DiagnosisGeneratorOutput
-from agents.halluncination_grader import hallucination_grader, HallucinationGraderOutput
+from agents.retrieval_grader import (
+    format_listwise_documents,
+    listwise_retrieval_grader,
+    parse_listwise_verdicts,
+    retrieval_grader,
+    RetrievalGraderOutput,
+)
+from agents.diagnosis_generator import (
+    diagnosis_generator,
+    DiagnosisGeneratorOutput,
+    llm as diagnosis_generator_llm,
+)
+from agents.halluncination_grader import (
+    hallucination_grader,
+    HallucinationGraderOutput,
+    llm as hallucination_grader_llm,
+)
 from agents.context_translator import context_translator, ContextTranslatorOutput
-from db import get_qdrant_client
+from agents.diagnosis_repairer import diagnosis_repairer, DiagnosisRepairOutput
+from agents.cross_encoder_grader import ascore_pairs
+from constants import (
+    ContextPacking,
+    Deduplication,
+    Grading,
+    HallucinationCheck,
+    Pipelining,
+    QuoteGrounding,
+    Repair,
+    ScoreGate,
+    Tracing,
+    VectorDb,
+    WebSearch,
+)
+from context_packer import (
+    document_source,
+    format_context,
+    pack_documents,
+    select_cited_documents,
+)
+from diagnosis_repair import (
+    describe_problems,
+    failing_diagnoses,
+    format_diagnosis,
+    merge_grades,
+    splice_diagnoses,
+    split_grade,
+)
+from llm_cache import bypass_response_cache
+from retrieval import aretrieve_subqueries, chunk_id, chunk_source
+from quote_grounding import (
+    describe_unmatched,
+    grounding_ratio,
+    is_fully_verified,
+    local_grade,
+    match_quotes,
+)
+from run_tracing import export_chrome_trace, export_trace, traced_node
+from score_gate import GraderDecision, get_score_gate, log_grader_decisions
+from web_search import get_web_search, store_web_results
 import asyncio
+import openai
+from datetime import datetime
 
 ### Langgraph State
 
@@ -23,6 +81,18 @@ class GraphState(TypedDict):
         generation: LLM generation
         web_search: whether to add search
         documents: list of documents
+        context: translated documents packed into the token budget, shared by the
+            generation and hallucination check
+        packed_documents: documents of each subquery that made it into the context
+        dropped_documents: documents left out of the context, with the reason
+        diagnosis_generator_output: validated output of the last (re)generation
+        diagnosis_grades: hallucination grade of each differential diagnosis
+        changed_diagnoses: diagnoses changed by the last repair, None after a full generation
+        failing_diagnoses: diagnoses to regenerate in the repair loop
+        unmatched_quotes: quotes of the last check not found in the context
+        run_metrics: counters collected while running the graph (e.g. LLM calls saved)
+        trace: span of every node run so far, with the spans of its LLM calls
+        web_results: raw web search results of the run, candidates for the write-back
     """
 
     main_query: str
@@ -33,13 +103,24 @@ class GraphState(TypedDict):
     has_hallucinations: bool
     hallucination_grader_output: Optional[HallucinationGraderOutput]
     halluncination_check_balance: int
+    context: str
+    packed_documents: List[dict]
+    dropped_documents: List[dict]
+    diagnosis_generator_output: Optional[DiagnosisGeneratorOutput]
+    diagnosis_grades: List[HallucinationGraderOutput]
+    changed_diagnoses: Optional[List[int]]
+    failing_diagnoses: List[int]
+    unmatched_quotes: List[dict]
+    run_metrics: dict
+    trace: List[dict]
+    web_results: List[dict]
 
 
 # * Nodes
 
 
 ### Node - Translates main query into subqueries
-def translate_query(graph_state: GraphState) -> GraphState:
+async def translate_query(graph_state: GraphState) -> GraphState:
     """Translates the main query into multiple subqueries"""
 
     print("--- TRANSLATING MAIN QUERY INTO SUBQUERIES ---")
@@ -48,7 +129,7 @@ def translate_query(graph_state: GraphState) -> GraphState:
     main_query = graph_state["main_query"]
 
     # Translate the main query into subqueries
-    translator_result = query_translator.invoke(
+    translator_result = await query_translator.ainvoke(
         {"main_query": main_query}, {"run_name": "query-translator"}
     )
     parsed_translator_result = QueryTranslatorOutput(**translator_result)
@@ -57,27 +138,25 @@ def translate_query(graph_state: GraphState) -> GraphState:
 
 
 ### Node - conduct retrieval from vector database using subqueries
-async def retrieve(graph_state: GraphState) -> GraphState:
+async def retrieve(graph_state: GraphState, config: RunnableConfig) -> GraphState:
     """Retrieves documents from a vector database using the subqueries"""
 
     print("--- RETRIEVING DOCUMENTS FROM VECTOR DATABASE FOR EACH SUBQUERY ---")
 
-    # Get the subqueries
+    # Get the subqueries and the retrieval mode ("dense" or "hybrid") for this run
     subqueries = graph_state["subqueries"]
-    db = get_qdrant_client()
-
-    # Retrieve documents from a vector database using the subqueries
-    documents = []
-    for subquery in subqueries:
-        query_result = {"question": subquery, "documents": []}
-        results = db.similarity_search_with_score(subquery, k=3)
-
-        for doc, score in results:
-            query_result["documents"].append(
-                f"source:{doc.metadata['source']}WebSource:{doc.metadata['WebSource']}\n\ncontent:{doc.page_content}"
-            )
+    retrieval_mode = config.get("configurable", {}).get(
+        "retrieval_mode", VectorDb.RETRIEVAL_MODE
+    )
+    # Web results written back by earlier runs are searched next to the textbooks
+    web_results = config.get("configurable", {}).get(
+        "web_write_back", WebSearch.WRITE_BACK
+    )
 
-        documents.append(query_result)
+    # Embed all subqueries in one pass off the event loop and search them concurrently
+    documents = await aretrieve_subqueries(
+        subqueries, retrieval_mode=retrieval_mode, web_results=web_results
+    )
 
     return {
         **graph_state,
@@ -86,14 +165,22 @@ async def retrieve(graph_state: GraphState) -> GraphState:
 
 
 ### Node - grade the retrieved documents
-async def grade_documents(graph_state: GraphState) -> GraphState:
+async def grade_documents(graph_state: GraphState, config: RunnableConfig) -> GraphState:
     """Grades the retrieved documents based on relevance"""
 
     print("--- GRADING RETRIEVED DOCUMENTS ---")
 
-    # Get the ungraded documents and web search flag
+    # Get the ungraded documents, web search flag and grading mode for this run
     documents = graph_state["documents"]
     web_search = "No"
+    grading_mode = config.get("configurable", {}).get("grading_mode", Grading.MODE)
+    retrieval_mode = config.get("configurable", {}).get(
+        "retrieval_mode", VectorDb.RETRIEVAL_MODE
+    )
+    deduplicate = config.get("configurable", {}).get(
+        "deduplicate", Deduplication.ENABLED
+    )
+    listwise = config.get("configurable", {}).get("listwise", Grading.LISTWISE)
 
     async def grade_query_document_pair(query, document, query_index, document_index):
         llm_result = await retrieval_grader.ainvoke(
@@ -108,30 +195,162 @@ async def grade_documents(graph_state: GraphState) -> GraphState:
             "is_relevant": parsed_llm_result.score == "yes",
         }
 
-    # Create a list of coroutines for grading each query-document pair
-    invocations = []
-    for i, item in enumerate(documents):
-        query = item["question"]
-        docs = item["documents"]
-
-        for j, doc in enumerate(docs):
-            invocations.append(grade_query_document_pair(query, doc, i, j))
+    # Every query-document pair as (query_index, document_index, query, document, score)
+    pairs = [
+        (i, j, item["question"], doc, (item.get("scores") or [None] * len(item["documents"]))[j])
+        for i, item in enumerate(documents)
+        for j, doc in enumerate(item["documents"])
+    ]
+    verdicts = {}
+    # Relevance score kept with every relevant document for the context packer, the
+    # cross-encoder score when the pairs were scored with it, else the retrieval score
+    relevance = {(i, j): score for i, j, _, _, score in pairs}
+    # What decided each pair that was not graded by the LLM
+    decided_by = {}
+
+    # Score all pairs with the local cross-encoder in one batch, only borderline pairs
+    # (cascade mode) or no pairs at all (cross-encoder mode) go on to the LLM grader
+    llm_pairs = pairs
+    if grading_mode in ("cross-encoder", "cascade"):
+        scores = await ascore_pairs([(query, doc) for _, _, query, doc, _ in pairs])
+        llm_pairs = []
+        for pair, score in zip(pairs, scores):
+            i, j = pair[0], pair[1]
+            relevance[(i, j)] = float(score)
+            decided_by[(i, j)] = "cross-encoder"
+            if grading_mode == "cross-encoder":
+                verdicts[(i, j)] = score >= Grading.CROSS_ENCODER_THRESHOLD
+            elif score >= Grading.CASCADE_UPPER_THRESHOLD:
+                verdicts[(i, j)] = True
+            elif score < Grading.CASCADE_LOWER_THRESHOLD:
+                verdicts[(i, j)] = False
+            else:
+                llm_pairs.append(pair)
+                decided_by.pop((i, j))
+        print(f"Cross-encoder graded {len(pairs) - len(llm_pairs)} of {len(pairs)} pairs")
+
+    # Accept or reject pairs whose retrieval score is confidently on one side of the gate
+    gate = get_score_gate() if grading_mode == "score-gate" else None
+    if gate is not None:
+        llm_pairs = []
+        for pair in pairs:
+            verdict = gate.decide(pair[4], retrieval_mode)
+            if verdict is None:
+                llm_pairs.append(pair)
+            else:
+                verdicts[(pair[0], pair[1])] = verdict
+                decided_by[(pair[0], pair[1])] = "score-gate"
+        print(f"Score gate graded {len(pairs) - len(llm_pairs)} of {len(pairs)} pairs")
+
+    # Group the remaining pairs by chunk, so a chunk retrieved by several subqueries is
+    # graded once against all of them and the verdict fanned back out to each
+    chunk_pairs = {}
+    for pair in llm_pairs:
+        key = chunk_id(pair[3]) if deduplicate else (pair[0], pair[1])
+        chunk_pairs.setdefault(key, []).append(pair)
+
+    async def grade_chunk(grouped_pairs):
+        questions = list(dict.fromkeys(pair[2] for pair in grouped_pairs))
+        i, j, _, doc, _ = grouped_pairs[0]
+        result = await grade_query_document_pair("\n".join(questions), doc, i, j)
+        return grouped_pairs, result["is_relevant"]
+
+    async def grade_question_chunks(question, chunk_groups, question_index):
+        # Grade every chunk of the question in one listwise call, falling back to one
+        # call per chunk when the verdict array cannot be parsed or is incomplete, or the
+        # call still fails after its retries
+        if not listwise or len(chunk_groups) == 1:
+            results = await asyncio.gather(*[grade_chunk(group) for group in chunk_groups])
+            return results, len(chunk_groups), False
+
+        chunks = [grouped_pairs[0][3] for grouped_pairs in chunk_groups]
+        try:
+            llm_result = await listwise_retrieval_grader.ainvoke(
+                {
+                    "question": question,
+                    "documents": format_listwise_documents(chunks),
+                    "num_documents": len(chunks),
+                },
+                {"run_name": f"listwise-retrieval-grader-{question_index}"},
+            )
+            is_relevant = parse_listwise_verdicts(llm_result, len(chunks))
+        except (OutputParserException, ValidationError, openai.APIError) as error:
+            print(f"Listwise grader call failed: {error!r}")
+            is_relevant = None
+
+        if is_relevant is None:
+            print(f"Listwise grading failed for question {question_index}, grading per pair")
+            results = await asyncio.gather(*[grade_chunk(group) for group in chunk_groups])
+            return results, 1 + len(chunk_groups), True
+        return list(zip(chunk_groups, is_relevant)), 1, False
+
+    # Group the chunks by the question they are graded against, so listwise grading
+    # sends all candidate documents of a subquery in one call
+    question_chunks = {}
+    for grouped_pairs in chunk_pairs.values():
+        question = "\n".join(dict.fromkeys(pair[2] for pair in grouped_pairs))
+        question_chunks.setdefault(question, []).append(grouped_pairs)
+
+    # Create a list of coroutines for grading the chunks of each question
+    invocations = [
+        grade_question_chunks(question, chunk_groups, question_index)
+        for question_index, (question, chunk_groups) in enumerate(question_chunks.items())
+    ]
 
-    grading_results = await asyncio.gather(*invocations)
+    grading_results = []
+    grader_calls = 0
+    listwise_fallbacks = 0
+    for results, calls, fell_back in await asyncio.gather(*invocations):
+        grading_results.extend(results)
+        grader_calls += calls
+        listwise_fallbacks += fell_back
+
+    for grouped_pairs, is_relevant in grading_results:
+        for i, j, _, _, _ in grouped_pairs:
+            verdicts[(i, j)] = is_relevant
+
+    grader_calls_saved = len(llm_pairs) - grader_calls
+    print(f"Deduplication and listwise grading saved {grader_calls_saved} grader calls")
+
+    # Log the verdicts with their retrieval scores and what decided them, to fit the
+    # score gate offline. LLM verdicts are "llm-borderline" when a cross-encoder or gate
+    # picked the pairs the LLM saw. Verdicts of chunks graded against several
+    # subqueries at once are left out. The file is appended to off the event loop
+    if ScoreGate.LOG_DECISIONS:
+        llm_source = "llm" if grading_mode == "llm" else "llm-borderline"
+        shared = {
+            (i, j)
+            for grouped_pairs in chunk_pairs.values()
+            if len(grouped_pairs) > 1
+            for i, j, _, _, _ in grouped_pairs
+        }
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None,
+            log_grader_decisions,
+            [
+                GraderDecision(
+                    subquery=query,
+                    chunk=doc,
+                    score=score,
+                    is_relevant=verdicts[(i, j)],
+                    retrieval_mode=retrieval_mode,
+                    source=decided_by.get((i, j), llm_source),
+                )
+                for i, j, query, doc, score in pairs
+                if score is not None and (i, j) not in shared
+            ],
+        )
 
     # Create a list of filtered documents based on the grading results
     filtered_documents = [
-        {"question": item["question"], "documents": []} for item in documents
+        {"question": item["question"], "documents": [], "scores": []}
+        for item in documents
     ]
-    for result in grading_results:
-        query_index = result["query_index"]
-        document_index = result["document_index"]
-        is_relevant = result["is_relevant"]
-
-        if is_relevant:
-            filtered_documents[query_index]["documents"].append(
-                documents[query_index]["documents"][document_index]
-            )
+    for i, j, query, doc, _ in pairs:
+        if verdicts[(i, j)]:
+            filtered_documents[i]["documents"].append(doc)
+            filtered_documents[i]["scores"].append(relevance[(i, j)])
 
     # check for query with no relevant documents
     for item in filtered_documents:
@@ -139,7 +358,19 @@ async def grade_documents(graph_state: GraphState) -> GraphState:
             web_search = "Yes"
             break
 
-    return {**graph_state, "documents": filtered_documents, "web_search": web_search}
+    run_metrics = {
+        **graph_state.get("run_metrics", {}),
+        "grader_calls": grader_calls,
+        "grader_calls_saved": grader_calls_saved,
+        "listwise_fallbacks": listwise_fallbacks,
+    }
+
+    return {
+        **graph_state,
+        "documents": filtered_documents,
+        "web_search": web_search,
+        "run_metrics": run_metrics,
+    }
 
 
 ### Node - conduct web search for subqueries with no relevant documents
@@ -148,14 +379,12 @@ async def web_search(graph_state: GraphState) -> GraphState:
 
     print("--- CONDUCTING WEB SEARCH FOR SUBQUERIES WITH NO RELEVANT DOCUMENTS ---")
 
-    web_search_tool = TavilySearchResults(max_results=3)
     documents = graph_state["documents"]
+    search = get_web_search()
 
     async def query_web_search(query, query_index):
-        web_results = await web_search_tool.ainvoke(
-            query, {"run_name": f"web-search-{query_index}"}
-        )
-        return {"query_index": query_index, "documents": web_results}
+        result = await search.search(query, WebSearch.MAX_RESULTS)
+        return {"query_index": query_index, "result": result}
 
     # Web search for each query that did not have relevant documents
     invocations = []
@@ -171,19 +400,45 @@ async def web_search(graph_state: GraphState) -> GraphState:
     # Gather the results of the web search
     results = await asyncio.gather(*invocations)
 
+    web_results = list(graph_state.get("web_results", []))
     for result in results:
         query_index = result["query_index"]
-        docs = result["documents"]
+        docs = result["result"].results
 
         documents[query_index]["documents"] = [
             f'source:{doc["url"]}\n{doc["content"]}' for doc in docs
         ]
+        # Web results have no score comparable to the retrieval scores, the packer
+        # keeps them in the order the search returned them
+        documents[query_index]["scores"] = [None] * len(docs)
+        web_results += [
+            {"question": documents[query_index]["question"], **doc} for doc in docs
+        ]
 
-    return {**graph_state, "documents": documents}
+    # Searches answered from the cache, and the time their original searches took
+    cache_hits = sum(result["result"].cache_hit for result in results)
+    run_metrics = {
+        **graph_state.get("run_metrics", {}),
+        "web_search_cache_hits": cache_hits,
+        "web_search_cache_misses": len(results) - cache_hits,
+        "web_search_hit_ratio": cache_hits / len(results) if results else 0.0,
+        "web_search_seconds_saved": sum(
+            result["result"].seconds for result in results if result["result"].cache_hit
+        ),
+    }
+
+    return {
+        **graph_state,
+        "documents": documents,
+        "web_results": web_results,
+        "run_metrics": run_metrics,
+    }
 
 
 ### Node - translate the retrieved documents into a format suitable for the generation model
-async def translate_documents(graph_state: GraphState) -> GraphState:
+async def translate_documents(
+    graph_state: GraphState, config: RunnableConfig
+) -> GraphState:
     """Translate the retrieved documents into a format suitable for the generation model"""
 
     print(
@@ -191,11 +446,11 @@ async def translate_documents(graph_state: GraphState) -> GraphState:
     )
 
     documents = graph_state["documents"]
+    deduplicate = config.get("configurable", {}).get(
+        "deduplicate", Deduplication.ENABLED
+    )
 
-    async def translate_query_documents(query_index, query_item):
-        question = query_item["question"]
-        documents = query_item["documents"]
-
+    async def translate_query_documents(query_index, question, documents):
         llm_result = await context_translator.ainvoke(
             {
                 "query": question,
@@ -210,44 +465,254 @@ async def translate_documents(graph_state: GraphState) -> GraphState:
 
         return {
             "query_index": query_index,
+            "chunks": documents,
             "documents": formatted_documents,
+            "sources": [item.source.strip() for item in parsed_llm_result.context_documents],
+        }
+
+    # Relevance score of every chunk for each subquery that retrieved it
+    chunk_scores = [
+        {
+            chunk_id(doc): score
+            for doc, score in zip(
+                item["documents"], item.get("scores") or [None] * len(item["documents"])
+            )
         }
+        for item in documents
+    ]
+
+    # Map every subquery to the documents it translates, and the subqueries whose
+    # questions the translator is given for them
+    chunk_slots = sum(len(item["documents"]) for item in documents)
+    groups = {}
+    owners = {}
+    if deduplicate:
+        # Every distinct chunk is translated once, in the batch of the subquery that
+        # ranked it highest, so there is at most one translator call per subquery. The
+        # other subqueries that retrieved it are named in the question of that batch
+        for i, item in enumerate(documents):
+            for rank, doc in enumerate(item["documents"]):
+                owner = owners.setdefault(chunk_id(doc), [rank, i, []])
+                if rank < owner[0]:
+                    owner[0], owner[1] = rank, i
+                if i not in owner[2]:
+                    owner[2].append(i)
+        for i, item in enumerate(documents):
+            for doc in item["documents"]:
+                _, owner_index, retrieved_by = owners[chunk_id(doc)]
+                if owner_index != i:
+                    continue
+                question_indices, docs = groups.setdefault(i, ([i], []))
+                if doc in docs:
+                    continue
+                docs.append(doc)
+                question_indices.extend(j for j in retrieved_by if j not in question_indices)
+    else:
+        groups = {i: ([i], item["documents"]) for i, item in enumerate(documents)}
 
     invocations = []
-    for i, item in enumerate(documents):
-        invocations.append(translate_query_documents(i, item))
+    for query_index, (question_indices, docs) in groups.items():
+        question = "\n".join(documents[i]["question"] for i in question_indices)
+        invocations.append(translate_query_documents(query_index, question, docs))
     translated_documents = await asyncio.gather(*invocations)
 
+    # Fan every translated document back out to each subquery that retrieved the chunks
+    # it was translated from. The translator may merge chunks, so a document goes to
+    # the retrievers of the chunks with its source, or of the whole batch if none match.
+    # Its score for a subquery is the best score of those chunks for that subquery
+    translated_by_query = [([], []) for _ in documents]
     for result in translated_documents:
-        query_index = result["query_index"]
-        docs = result["documents"]
-        documents[query_index]["documents"] = docs
+        for translated, source in zip(result["documents"], result["sources"]):
+            cited = [
+                doc for doc in result["chunks"] if chunk_source(doc) == source
+            ] or result["chunks"]
+            receivers = [result["query_index"]]
+            for doc in cited:
+                if chunk_id(doc) in owners:
+                    receivers.extend(owners[chunk_id(doc)][2])
+            for i in dict.fromkeys(receivers):
+                translated_docs, translated_scores = translated_by_query[i]
+                if translated in translated_docs:
+                    continue
+                scores = [
+                    chunk_scores[i][chunk_id(doc)]
+                    for doc in cited
+                    if chunk_scores[i].get(chunk_id(doc)) is not None
+                ]
+                translated_docs.append(translated)
+                translated_scores.append(max(scores) if scores else None)
+    for item, (translated_docs, translated_scores) in zip(documents, translated_by_query):
+        item["documents"] = translated_docs
+        item["scores"] = translated_scores
+
+    translator_calls_saved = len(documents) - len(groups)
+    translated_chunks_saved = chunk_slots - sum(len(docs) for _, docs in groups.values())
+    print(
+        f"Deduplication saved {translator_calls_saved} translator calls "
+        f"and {translated_chunks_saved} chunk translations"
+    )
 
-    return {**graph_state, "documents": documents}
+    run_metrics = {
+        **graph_state.get("run_metrics", {}),
+        "translator_calls_saved": translator_calls_saved,
+        "translated_chunks_saved": translated_chunks_saved,
+    }
 
+    return {**graph_state, "documents": documents, "run_metrics": run_metrics}
 
-### Node - Generate differential diagnosis based on the retrieved documents
-async def generate(graph_state: GraphState) -> GraphState:
-    print("---GENERATE---")
-    question = graph_state["main_query"]
-    documents = graph_state["documents"]
 
-    formatted_documents = []
-    for item in documents:
-        docs = item["documents"]
-        query_str = item["question"]
-        docs_str = "\n\n---\n\n".join(docs)
-        text = f"Subquery:\n{query_str}\n\nDocuments:\n{docs_str}"
-        formatted_documents.append(text)
+### Node - run retrieval, grading, web search and translation per subquery
+async def process_subqueries(
+    graph_state: GraphState, config: RunnableConfig
+) -> GraphState:
+    """Runs every subquery through its own retrieve, grade, web search and translate
+    pipeline concurrently, without waiting for the other subqueries between stages"""
+
+    print("--- PROCESSING EACH SUBQUERY IN ITS OWN PIPELINE ---")
+
+    subqueries = graph_state["subqueries"]
+    deadline = config.get("configurable", {}).get(
+        "subquery_deadline", Pipelining.DEADLINE_SECONDS
+    )
+    # Callback receiving (subquery index, stage, single subquery state) after each stage
+    on_subquery_progress = config.get("configurable", {}).get("on_subquery_progress")
+
+    # Translated documents of each subquery. A subquery cut off by the deadline before
+    # translation contributes none, its graded chunks are raw "source:...WebSource:..."
+    # text the generator and hallucination grader are not prompted with
+    latest_documents = [
+        {"question": subquery, "documents": []} for subquery in subqueries
+    ]
+    completed_stages = [None] * len(subqueries)
+    web_results = list(graph_state.get("web_results", []))
+
+    def report(query_index, stage, subquery_state):
+        completed_stages[query_index] = stage
+        if stage == "translate_documents":
+            latest_documents[query_index] = subquery_state["documents"][0]
+        if stage == "websearch":
+            web_results.extend(subquery_state["web_results"])
+        if on_subquery_progress is not None:
+            on_subquery_progress(query_index, stage, subquery_state)
+
+    async def run_pipeline(query_index, subquery):
+        subquery_state = {
+            **graph_state,
+            "subqueries": [subquery],
+            "documents": [],
+            "web_results": [],
+            "run_metrics": {},
+        }
+        subquery_state = await retrieve(subquery_state, config)
+        report(query_index, "retrieve", subquery_state)
+        subquery_state = await grade_documents(subquery_state, config)
+        report(query_index, "grade_documents", subquery_state)
+        if subquery_state["web_search"] == "Yes":
+            subquery_state = await web_search(subquery_state)
+            report(query_index, "websearch", subquery_state)
+        subquery_state = await translate_documents(subquery_state, config)
+        report(query_index, "translate_documents", subquery_state)
+        return subquery_state
+
+    tasks = [
+        asyncio.ensure_future(run_pipeline(i, subquery))
+        for i, subquery in enumerate(subqueries)
+    ]
+    done, pending = set(), set()
+    if tasks:
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        print(f"Deadline of {deadline}s reached with {len(pending)} subqueries unfinished")
+
+    # A pipeline that raised is dropped like one cut off by the deadline, so a single
+    # failing subquery does not abort the run
+    failed = {task for task in done if task.exception() is not None}
+    for i, task in enumerate(tasks):
+        if task in failed:
+            print(f"Subquery {i} pipeline failed: {task.exception()!r}")
+            latest_documents[i] = {"question": subqueries[i], "documents": []}
+    done = done - failed
+
+    # Sum the counters of the subquery pipelines into the run metrics
+    run_metrics = dict(graph_state.get("run_metrics", {}))
+    for task in done:
+        for key, value in task.result()["run_metrics"].items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                run_metrics[key] = run_metrics.get(key, 0) + value
+            else:
+                run_metrics.setdefault(key, value)
+    lookups = run_metrics.get("web_search_cache_hits", 0) + run_metrics.get(
+        "web_search_cache_misses", 0
+    )
+    if lookups:
+        run_metrics["web_search_hit_ratio"] = run_metrics["web_search_cache_hits"] / lookups
+    run_metrics["subqueries_cut_off"] = {
+        subqueries[i]: stage
+        for i, stage in enumerate(completed_stages)
+        if tasks[i] in pending or tasks[i] in failed
+    }
+    run_metrics["subqueries_failed"] = len(failed)
+
+    needs_web_search = any(task.result()["web_search"] == "Yes" for task in done)
+
+    return {
+        **graph_state,
+        "documents": latest_documents,
+        "web_search": "Yes" if needs_web_search else "No",
+        "web_results": web_results,
+        "run_metrics": run_metrics,
+    }
+
 
-    formatted_context = "\n\n***\n\n".join(formatted_documents)
+### Node - pack the translated documents into the context for generation
+async def pack_context(graph_state: GraphState, config: RunnableConfig) -> GraphState:
+    """Packs the translated documents into a token budget once for generation and
+    the hallucination check"""
 
-    # RAG generation
-    generation_result = diagnosis_generator.invoke(
-        {"context": formatted_context, "question": question},
-        {"run_name": "diagnosis-generator"},
+    print("--- PACKING TRANSLATED DOCUMENTS INTO THE CONTEXT ---")
+
+    documents = graph_state["documents"]
+
+    # The context is given to both agents, so it has to fit the smaller budget
+    models = (diagnosis_generator_llm.model_name, hallucination_grader_llm.model_name)
+    token_budget = config.get("configurable", {}).get(
+        "context_token_budget",
+        min(
+            ContextPacking.TOKEN_BUDGETS.get(model, ContextPacking.DEFAULT_TOKEN_BUDGET)
+            for model in models
+        ),
     )
-    parsed_generation_result = DiagnosisGeneratorOutput(**generation_result)
+
+    # Tokenizing every document is CPU bound, keep it off the event loop
+    loop = asyncio.get_running_loop()
+    packed_documents, dropped_documents = await loop.run_in_executor(
+        None, pack_documents, documents, models[0], token_budget
+    )
+    print(
+        f"Packed {sum(len(item['documents']) for item in packed_documents)} documents "
+        f"into {token_budget} tokens, dropped {len(dropped_documents)}"
+    )
+
+    run_metrics = {
+        **graph_state.get("run_metrics", {}),
+        "context_token_budget": token_budget,
+        "context_documents_dropped": len(dropped_documents),
+    }
+
+    return {
+        **graph_state,
+        "context": format_context(packed_documents),
+        "packed_documents": packed_documents,
+        "dropped_documents": dropped_documents,
+        "run_metrics": run_metrics,
+    }
+
+
+def format_generation(parsed_generation_result: DiagnosisGeneratorOutput) -> str:
+    """Formats the validated diagnosis generator output as markdown"""
 
     generation_result = (
         "## Differential diagnoses based on assessments of the patient:\n\n"
@@ -260,18 +725,7 @@ async def generate(graph_state: GraphState) -> GraphState:
     for index, diagnosis in enumerate(
         parsed_generation_result.differential_diagnoses, start=1
     ):
-        generation_result += f"### Diagnosis {index}: {diagnosis.diagnosis}\n"
-        generation_result += f"**Rationale:** {diagnosis.rational}\n\n"
-
-        generation_result += "##### In-text citations\n"
-        for quote in diagnosis.relevant_quotes:
-            generation_result += (
-                f"\\[{quote.ieee_intext_citation}\\]: {quote.source}\n\n"
-            )
-            generation_result += f"    - {quote.text}\n"
-            generation_result += "\n\n"
-
-        generation_result += "\n"
+        generation_result += format_diagnosis(index, diagnosis)
 
     # Add references
     if parsed_generation_result.ieee_references:
@@ -279,38 +733,278 @@ async def generate(graph_state: GraphState) -> GraphState:
         for citation in parsed_generation_result.ieee_references:
             generation_result += f"- {citation}\n"
 
+    return generation_result
+
+
+def format_partial_generation(partial_result: dict) -> str:
+    """Formats the fields of a partially streamed diagnosis generator output that have
+    arrived so far as markdown"""
+
+    generation_result = (
+        "## Differential diagnoses based on assessments of the patient:\n\n"
+    )
+
+    if partial_result.get("summary"):
+        generation_result += f"### Summary\n{partial_result['summary']}\n"
+
+    for index, diagnosis in enumerate(
+        partial_result.get("differential_diagnoses") or [], start=1
+    ):
+        if not isinstance(diagnosis, dict) or not diagnosis.get("diagnosis"):
+            continue
+        generation_result += f"### Diagnosis {index}: {diagnosis['diagnosis']}\n"
+        if diagnosis.get("rational"):
+            generation_result += f"**Rationale:** {diagnosis['rational']}\n\n"
+
+    return generation_result
+
+
+### Node - Generate differential diagnosis based on the retrieved documents
+async def generate(graph_state: GraphState, config: RunnableConfig) -> GraphState:
+    print("---GENERATE---")
+    question = graph_state["main_query"]
+
+    # Callback receiving the markdown of the diagnosis as it streams in, if any
+    on_generation_progress = config.get("configurable", {}).get(
+        "on_generation_progress"
+    )
+
+    # Context packed once by pack_context and reused on every regeneration
+    formatted_context = graph_state["context"]
+    generator_inputs = {"context": formatted_context, "question": question}
+
+    # A regeneration after a failed hallucination check must not be answered with the
+    # rejected generation from the response cache
+    regenerating = graph_state["hallucination_grader_output"] is not None
+    with bypass_response_cache(regenerating):
+        # Stream the generation and report the partially parsed JSON as it arrives, the
+        # complete output is validated the same way as a non-streamed generation
+        parsed_generation_result = None
+        if on_generation_progress is not None:
+            generation_result = None
+            try:
+                async for partial_result in diagnosis_generator.astream(
+                    generator_inputs, {"run_name": "diagnosis-generator"}
+                ):
+                    generation_result = partial_result
+                    if isinstance(partial_result, dict):
+                        on_generation_progress(format_partial_generation(partial_result))
+                parsed_generation_result = DiagnosisGeneratorOutput(**generation_result)
+            except (OutputParserException, ValidationError, TypeError, openai.APIError):
+                # Streams are not retried, the generation below is
+                print("Streamed generation failed or could not be parsed, generating again")
+
+        # RAG generation
+        if parsed_generation_result is None:
+            generation_result = await diagnosis_generator.ainvoke(
+                generator_inputs,
+                {"run_name": "diagnosis-generator"},
+            )
+            parsed_generation_result = DiagnosisGeneratorOutput(**generation_result)
+
+    generation_result = format_generation(parsed_generation_result)
+    if on_generation_progress is not None:
+        on_generation_progress(generation_result)
+
+    return {
+        **graph_state,
+        "generation": generation_result,
+        "diagnosis_generator_output": parsed_generation_result,
+        "diagnosis_grades": [],
+        "changed_diagnoses": None,
+    }
+
+
+### Node - Regenerate only the differential diagnoses that failed the hallucination check
+async def repair_generation(graph_state: GraphState, config: RunnableConfig) -> GraphState:
+    """Regenerates the failing diagnoses and splices them into the generation"""
+
+    print("--- REPAIRING UNGROUNDED DIFFERENTIAL DIAGNOSES ---")
+
+    question = graph_state["main_query"]
+    formatted_context = graph_state["context"]
+    generation = graph_state["generation"]
+    parsed_generation_result = graph_state["diagnosis_generator_output"]
+    diagnosis_grades = graph_state["diagnosis_grades"]
+    failing = graph_state["failing_diagnoses"]
+    on_generation_progress = config.get("configurable", {}).get(
+        "on_generation_progress"
+    )
+
+    references = "\n".join(
+        f"[{number}] {reference}"
+        for number, reference in enumerate(parsed_generation_result.ieee_references, start=1)
+    )
+
+    async def repair_diagnosis(diagnosis_index):
+        diagnosis = parsed_generation_result.differential_diagnoses[diagnosis_index]
+        llm_result = await diagnosis_repairer.ainvoke(
+            {
+                "context": formatted_context,
+                "question": question,
+                "generation": generation,
+                "references": references or "None",
+                "diagnosis": format_diagnosis(diagnosis_index + 1, diagnosis),
+                "problems": describe_problems(diagnosis_grades[diagnosis_index]),
+            },
+            {"run_name": f"diagnosis-repairer-{diagnosis_index}"},
+        )
+        parsed_llm_result = DiagnosisRepairOutput(**llm_result)
+
+        return diagnosis_index, (
+            parsed_llm_result.differential_diagnosis,
+            parsed_llm_result.additional_references,
+        )
+
+    # Repair every failing diagnosis concurrently, the others are kept as they are
+    repaired = dict(await asyncio.gather(*[repair_diagnosis(i) for i in failing]))
+    parsed_generation_result = splice_diagnoses(parsed_generation_result, repaired)
+    print(
+        f"Repaired {len(repaired)} of "
+        f"{len(parsed_generation_result.differential_diagnoses)} differential diagnoses"
+    )
+
+    generation_result = format_generation(parsed_generation_result)
+    if on_generation_progress is not None:
+        on_generation_progress(generation_result)
+
+    run_metrics = {
+        **graph_state.get("run_metrics", {}),
+        "repaired_diagnoses": graph_state.get("run_metrics", {}).get("repaired_diagnoses", 0)
+        + len(repaired),
+    }
+
     return {
         **graph_state,
         "generation": generation_result,
+        "diagnosis_generator_output": parsed_generation_result,
+        "changed_diagnoses": sorted(repaired),
+        "run_metrics": run_metrics,
     }
 
 
 ### Node - Check the generated differential diagnosis for hallucinations
-def check_hallucinations(graph_state: GraphState) -> GraphState:
+async def check_hallucinations(
+    graph_state: GraphState, config: RunnableConfig
+) -> GraphState:
     """Check the generated differential diagnosis for hallucinations"""
 
     print("--- CHECKING IF GENERATION IS GROUNDED IN THE DOCUMENTS ---")
 
     generation = graph_state["generation"]
-    documents = graph_state["documents"]
+    formatted_context = graph_state["context"]
     hallucination_count_balance = graph_state["halluncination_check_balance"]
+    diagnoses = graph_state["diagnosis_generator_output"].differential_diagnoses
+    changed_diagnoses = graph_state["changed_diagnoses"]
+    repair = config.get("configurable", {}).get("repair", Repair.ENABLED)
+    sharded = config.get("configurable", {}).get(
+        "shard_hallucination_check", HallucinationCheck.SHARDED
+    )
+    quote_grounding = config.get("configurable", {}).get(
+        "quote_grounding", QuoteGrounding.ENABLED
+    )
 
-    formatted_documents = []
-    for item in documents:
-        docs = item["documents"]
-        query_str = item["question"]
-        docs_str = "\n\n---\n\n".join(docs)
-        text = f"Subquery:\n{query_str}\n\nDocuments:\n{docs_str}"
-        formatted_documents.append(text)
+    # After a repair only the changed diagnoses are graded again
+    to_grade = (
+        list(range(len(diagnoses))) if changed_diagnoses is None else changed_diagnoses
+    )
 
-    formatted_context = "\n\n***\n\n".join(formatted_documents)
+    # Match the quotes against the context locally first, diagnoses whose quotes are all
+    # found skip the LLM grader and the others are graded with their unmatched quotes.
+    # With quote grounding off nothing is matched, so the grader input is unchanged
+    quote_matches = []
+    if quote_grounding:
+        quote_matches = match_quotes(
+            [(i, diagnoses[i]) for i in to_grade],
+            formatted_context,
+            QuoteGrounding.THRESHOLD,
+        )
+    matches_by_diagnosis = {
+        i: [match for match in quote_matches if match.diagnosis_index == i]
+        for i in to_grade
+    }
+    locally_verified = [
+        i
+        for i in to_grade
+        if quote_grounding and is_fully_verified(diagnoses[i], matches_by_diagnosis[i])
+    ]
+    llm_to_grade = [i for i in to_grade if i not in locally_verified]
+    if quote_grounding:
+        print(
+            f"Quote grounding ratio {grounding_ratio(quote_matches):.2f}, "
+            f"{len(locally_verified)} of {len(to_grade)} diagnoses verified locally"
+        )
+
+    def format_answer(diagnosis_index):
+        answer = format_diagnosis(diagnosis_index + 1, diagnoses[diagnosis_index])
+        unmatched = describe_unmatched(matches_by_diagnosis[diagnosis_index])
+        if unmatched:
+            answer += f"##### Quotes not found verbatim in the reference facts\n{unmatched}\n\n"
+        return answer
+
+    async def grade_diagnosis(diagnosis_index):
+        # Grade one diagnosis against only the documents its quotes cite
+        diagnosis = diagnoses[diagnosis_index]
+        cited_documents = select_cited_documents(
+            graph_state["packed_documents"],
+            [(quote.source, quote.text) for quote in diagnosis.relevant_quotes],
+        )
+        facts = format_context(cited_documents) if cited_documents else formatted_context
+        llm_result = await hallucination_grader.ainvoke(
+            {"facts": facts, "answer": format_answer(diagnosis_index)},
+            {"run_name": f"hallucination-grader-{diagnosis_index}"},
+        )
+        return HallucinationGraderOutput(**llm_result)
+
+    parsed_hallucination_result = None
+    if sharded and diagnoses:
+        # One shard per diagnosis graded concurrently, each grade belongs to its diagnosis
+        graded = await asyncio.gather(*[grade_diagnosis(i) for i in llm_to_grade])
+    elif llm_to_grade or not diagnoses:
+        if changed_diagnoses is not None or locally_verified:
+            generation = "".join(format_answer(i) for i in llm_to_grade)
+
+        # Run hallucination grader on the generated differential diagnosis
+        hallucination_result = await hallucination_grader.ainvoke(
+            {"facts": formatted_context, "answer": generation},
+            {"run_name": "hallucination-grader"},
+        )
+        parsed_hallucination_result = HallucinationGraderOutput(**hallucination_result)
+        graded = split_grade(
+            parsed_hallucination_result, [diagnoses[i] for i in llm_to_grade]
+        )
+    else:
+        graded = []
 
-    # Run hallucination grader on the generated differential diagnosis
-    hallucination_result = hallucination_grader.invoke(
-        {"facts": formatted_context, "answer": generation},
-        {"run_name": "hallucination-grader"},
+    # Keep a grade per diagnosis, so a repair can replace the grades of what it changed
+    diagnosis_grades = (
+        [None] * len(diagnoses)
+        if changed_diagnoses is None
+        else list(graph_state["diagnosis_grades"])
     )
-    parsed_hallucination_result = HallucinationGraderOutput(**hallucination_result)
+    for i in locally_verified:
+        diagnosis_grades[i] = local_grade(matches_by_diagnosis[i])
+    for i, grade in zip(llm_to_grade, graded):
+        diagnosis_grades[i] = grade
+
+    # The grader's own assessment is kept when it graded the whole generation in one call
+    if (
+        parsed_hallucination_result is None
+        or changed_diagnoses is not None
+        or locally_verified
+    ):
+        parsed_hallucination_result = merge_grades(diagnosis_grades)
+
+    run_metrics = graph_state.get("run_metrics", {})
+    if quote_grounding:
+        run_metrics = {
+            **run_metrics,
+            "quote_grounding_ratio": grounding_ratio(quote_matches),
+            "hallucination_checks_skipped": run_metrics.get(
+                "hallucination_checks_skipped", 0
+            )
+            + len(locally_verified),
+        }
 
     if parsed_hallucination_result.overall_assessment.grounded_score > 0.7:
         has_hallucinations = False
@@ -327,12 +1021,79 @@ def check_hallucinations(graph_state: GraphState) -> GraphState:
         "has_hallucinations": has_hallucinations,
         "hallucination_grader_output": parsed_hallucination_result,
         "halluncination_check_balance": hallucination_count_balance - 1,
+        "diagnosis_grades": diagnosis_grades,
+        "failing_diagnoses": failing_diagnoses(diagnosis_grades) if repair else [],
+        "unmatched_quotes": [
+            {"diagnosis": match.diagnosis_index, "quote": match.text, "score": match.score}
+            for match in quote_matches
+            if not match.verified
+        ],
+        "run_metrics": run_metrics,
+    }
+
+
+### Node - store the web results the final generation was grounded in
+async def write_back_web_results(
+    graph_state: GraphState, config: RunnableConfig
+) -> GraphState:
+    """Stores the web results that survived translation, packing and the hallucination
+    check in the web results collection, so later runs retrieve them directly"""
+
+    write_back = config.get("configurable", {}).get(
+        "web_write_back", WebSearch.WRITE_BACK
+    )
+    web_results = graph_state.get("web_results", [])
+    if not write_back or not web_results or graph_state["has_hallucinations"]:
+        return graph_state
+
+    print("--- WRITING VALIDATED WEB RESULTS BACK INTO THE VECTOR STORE ---")
+
+    # A web result survived when the translator kept it and it was packed into the
+    # context the generation passed the hallucination check against
+    packed_sources = {
+        document_source(doc).lower()
+        for item in graph_state["packed_documents"]
+        for doc in item["documents"]
+    }
+    validated = [
+        result for result in web_results if result["url"].lower() in packed_sources
+    ]
+
+    # Embedding and upserting are blocking, keep them off the event loop
+    loop = asyncio.get_running_loop()
+    written = await loop.run_in_executor(None, store_web_results, validated)
+    print(f"Stored {written} of {len(validated)} validated web results")
+
+    run_metrics = {
+        **graph_state.get("run_metrics", {}),
+        "web_results_validated": len(validated),
+        "web_results_written": written,
     }
 
+    return {**graph_state, "run_metrics": run_metrics}
+
 
 # * Edges
 
 
+### Conditional edge - Determines whether subqueries run through staged or pipelined execution
+def decide_execution_mode(
+    graph_state: GraphState, config: RunnableConfig
+) -> Literal["retrieve", "process_subqueries"]:
+    """Decides whether to run the stages for all subqueries at once or per subquery"""
+
+    execution_mode = config.get("configurable", {}).get(
+        "execution_mode", Pipelining.MODE
+    )
+
+    if execution_mode == "pipelined":
+        print("---DECISION: PROCESS EACH SUBQUERY IN ITS OWN PIPELINE---")
+        return "process_subqueries"
+
+    print("---DECISION: PROCESS ALL SUBQUERIES STAGE BY STAGE---")
+    return "retrieve"
+
+
 ### Conditional edge - Determines whether to go to web search or generation based on the web_search flag
 def decide_to_do_additional_search(
     graph_state: GraphState,
@@ -355,12 +1116,24 @@ def decide_to_do_additional_search(
 ### Conditional edge - Determines whether to go end the process or check for hallucinations based on the hallucination_check_balance
 def decide_to_check_hallucinations_or_end(
     graph_state: GraphState,
-) -> Literal["retry", "end"]:
+) -> Literal["retry", "repair", "end"]:
     """Decides whether to check for hallucinations or end the process"""
 
     print("---ASSESS HALLUCINATIONS---")
     has_hallucinations = graph_state["has_hallucinations"]
     hallucination_check_balance = graph_state["halluncination_check_balance"]
+    failing = graph_state["failing_diagnoses"]
+    diagnoses = graph_state["diagnosis_generator_output"].differential_diagnoses
+
+    # Regenerating every diagnosis costs the same as a full generation, so only repair
+    # when some of the diagnoses are grounded
+    if (
+        has_hallucinations
+        and hallucination_check_balance > 0
+        and 0 < len(failing) < len(diagnoses)
+    ):
+        print("---DECISION: HALLUCINATIONS DETECTED, REPAIR FAILING DIAGNOSES---")
+        return "repair"
 
     if has_hallucinations and hallucination_check_balance > 0:
         print("---DECISION: HALLUCINATIONS DETECTED, RETRY GENERATION---")
@@ -394,17 +1167,28 @@ async def test_nodes():
             "has_hallucinations": False,
             "halluncination_check_balance": 3,
             "hallucination_grader_output": None,
+            "context": "",
+            "packed_documents": [],
+            "dropped_documents": [],
+            "diagnosis_generator_output": None,
+            "diagnosis_grades": [],
+            "changed_diagnoses": None,
+            "failing_diagnoses": [],
+            "unmatched_quotes": [],
+            "run_metrics": {},
+            "trace": [],
+            "web_results": [],
         }
     )
 
     # Translate the main query into subqueries
-    graph_state = translate_query(graph_state)
+    graph_state = await translate_query(graph_state)
 
     # Retrieve documents from a vector database using the subqueries
-    graph_state = await retrieve(graph_state)
+    graph_state = await retrieve(graph_state, {})
 
     # Grade the retrieved documents based on relevance
-    graph_state = await grade_documents(graph_state)
+    graph_state = await grade_documents(graph_state, {})
 
     # Check if there are any subqueries with no relevant documents
     for item in graph_state["documents"]:
@@ -422,15 +1206,19 @@ async def test_nodes():
         print("All subqueries have relevant documents.")
 
     # Translate the retrieved documents into a format suitable for the generation model
-    graph_state = await translate_documents(graph_state)
+    graph_state = await translate_documents(graph_state, {})
     pprint(graph_state["documents"])
 
+    # Pack the translated documents into the context
+    graph_state = await pack_context(graph_state, {})
+    pprint(graph_state["dropped_documents"])
+
     # Generate differential diagnosis based on the retrieved documents
-    # graph_state = await generate(graph_state)
+    # graph_state = await generate(graph_state, {})
     # pprint(graph_state["generation"])
 
     # # Check the generated differential diagnosis for hallucinations
-    # graph_state = check_hallucinations(graph_state)
+    # graph_state = await check_hallucinations(graph_state, {})
 
 
 def construct_graph() -> StateGraph:
@@ -438,20 +1226,33 @@ def construct_graph() -> StateGraph:
 
     workflow = StateGraph(GraphState)
 
+    def add_node(name: str, node):
+        # Every node records its own span and the spans of its LLM calls in the trace
+        workflow.add_node(name, traced_node(name, node))
+
     # Define the nodes
-    workflow.add_node("translate_query", translate_query)  # translate query
-    workflow.add_node("retrieve", retrieve)  # retrieve
-    workflow.add_node("grade_documents", grade_documents)  # grade documents
-    workflow.add_node("websearch", web_search)  # web search
-    workflow.add_node("translate_documents", translate_documents)  # translate documents
-    workflow.add_node("generate", generate)  # generate
-    workflow.add_node(
-        "check_hallucinations", check_hallucinations
-    )  # check hallucinations
+    add_node("translate_query", translate_query)  # translate query
+    add_node("retrieve", retrieve)  # retrieve
+    add_node("grade_documents", grade_documents)  # grade documents
+    add_node("websearch", web_search)  # web search
+    add_node("translate_documents", translate_documents)  # translate documents
+    add_node("process_subqueries", process_subqueries)  # pipelined subqueries
+    add_node("pack_context", pack_context)  # pack context
+    add_node("generate", generate)  # generate
+    add_node("repair_generation", repair_generation)  # repair generation
+    add_node("check_hallucinations", check_hallucinations)  # check hallucinations
+    add_node("write_back_web_results", write_back_web_results)  # write back web results
 
     # Build the graph
     workflow.set_entry_point("translate_query")  # entry point
-    workflow.add_edge("translate_query", "retrieve")  # translate query -> retrieve
+    workflow.add_conditional_edges(  # translate query -> staged or pipelined subqueries
+        "translate_query",
+        decide_execution_mode,
+        {
+            "retrieve": "retrieve",
+            "process_subqueries": "process_subqueries",
+        },
+    )
     workflow.add_edge("retrieve", "grade_documents")  # retrieve -> grade documents
     workflow.add_conditional_edges(  # grade documents -> decide to translate documents or websearch
         "grade_documents",
@@ -465,8 +1266,12 @@ def construct_graph() -> StateGraph:
         "websearch", "translate_documents"
     )  # web search -> grade documents
     workflow.add_edge(
-        "translate_documents", "generate"
-    )  # translate documents -> generate
+        "translate_documents", "pack_context"
+    )  # translate documents -> pack context
+    workflow.add_edge(
+        "process_subqueries", "pack_context"
+    )  # pipelined subqueries -> pack context
+    workflow.add_edge("pack_context", "generate")  # pack context -> generate
     workflow.add_edge(
         "generate", "check_hallucinations"
     )  # generate -> check hallucinations
@@ -475,14 +1280,19 @@ def construct_graph() -> StateGraph:
         decide_to_check_hallucinations_or_end,
         {
             "retry": "generate",
-            "end": END,
+            "repair": "repair_generation",
+            "end": "write_back_web_results",
         },
     )
+    workflow.add_edge(
+        "repair_generation", "check_hallucinations"
+    )  # repair generation -> check hallucinations
+    workflow.add_edge("write_back_web_results", END)  # write back web results -> end
 
     return workflow
 
 
-async def run_graph(graph: StateGraph) -> str:
+async def run_graph(graph: StateGraph, chrome_trace_path: Optional[str] = None) -> str:
     graph = construct_graph()
     app = graph.compile()
 
@@ -500,12 +1310,32 @@ async def run_graph(graph: StateGraph) -> str:
         halluncination_check_balance=3,
         has_hallucinations=False,
         hallucination_grader_output=None,
+        context="",
+        packed_documents=[],
+        dropped_documents=[],
+        diagnosis_generator_output=None,
+        diagnosis_grades=[],
+        changed_diagnoses=None,
+        failing_diagnoses=[],
+        unmatched_quotes=[],
+        run_metrics={},
+        trace=[],
+        web_results=[],
     )
 
     async for output in app.astream(inputs):
         for key, value in output.items():
             pprint(f"Finished running: {key}")
 
+    if chrome_trace_path:
+        export_chrome_trace([("agentic-rag", value["trace"])], chrome_trace_path)
+        print(f"Chrome trace saved as {chrome_trace_path}")
+
+    if Tracing.EXPORT_DIRECTORY:
+        trace_name = f"run-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        for path in export_trace(value["trace"], Tracing.EXPORT_DIRECTORY, trace_name):
+            print(f"Trace saved as {path}")
+
     return value["generation"]
 
 
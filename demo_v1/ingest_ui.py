@@ -10,6 +10,8 @@ from helper_funcs import (
     is_valid_pdf,
 )  # Make sure to import the postprocess_json function
 from config import *
+from constants import VectorDb
+from db import store_documents
 
 
 
@@ -58,6 +60,13 @@ def document_ingestion_page():
                         f"⚠️ {file.name} exceeds the {MAX_FILE_SIZE_MB}MB size limit and will not be uploaded."
                     )
 
+        # Vector quantization trades a little recall for a much smaller in-RAM index
+        quantization = st.selectbox(
+            "Vector quantization",
+            ["none", "int8", "binary"],
+            index=["none", "int8", "binary"].index(VectorDb.QUANTIZATION or "none"),
+        )
+
         # Button to start processing and storing the uploaded documents
         if st.button("Process and Store Documents"):
             if valid_files:
@@ -129,17 +138,12 @@ def document_ingestion_page():
                     if all_documents:
                         st.spinner("Storing documents in Qdrant...")
                         try:
-                            # Load embeddings model
-                            embeddings = HuggingFaceEmbeddings(
-                                model_name=VECTOR_EMBEDDING_MODEL
-                            )
-                            # Store documents in the Qdrant vector database
-                            qdrant.Qdrant.from_documents(
+                            # Store documents in the configured vector database with the shared embeddings model
+                            store_documents(
                                 all_documents,
-                                embeddings,
-                                url= QDRANT_ENDPOINT,  # Specify the vector database URL
+                                url=QDRANT_ENDPOINT,  # Specify the vector database URL
                                 collection_name=QDRANT_COLLECTION_NAME,  # Name of the collection
-                                prefer_grpc=False,  # Disable GRPC (optional)
+                                quantization=None if quantization == "none" else quantization,
                             )
                             st.success(
                                 "Documents successfully processed and stored in Qdrant."
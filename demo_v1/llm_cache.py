@@ -0,0 +1,224 @@
+"""
+Persistent exact-match cache for LLM responses.
+
+The graders and translators see the same (question, document) pairs again and again
+across cases and evaluation runs, so chat model responses are cached on disk keyed on
+the model configuration (model, temperature, ...) and the rendered prompt. Entries expire
+after a TTL and the table is bounded by evicting the least recently used rows.
+
+Each agent opts in with its own `AgentResponseCache`, which shares the SQLite store with
+the other agents but keeps its own hit and miss counters.
+
+A response is only stored once it parses with the agent's output parser, so a malformed
+completion is never served again, and entries that do not parse are dropped on lookup.
+Regenerations that must not get the previous answer back run under
+`bypass_response_cache`, which skips lookups while still storing the new response.
+
+Generations served from the cache carry `CACHE_HIT_KEY` in their `generation_info`,
+so callbacks can tell them from calls that reached the API.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.exceptions import OutputParserException
+from langchain_core.load import dumps, loads
+from langchain_core.output_parsers import BaseOutputParser
+
+# Set in the `generation_info` of generations answered from the cache
+CACHE_HIT_KEY = "response_cache_hit"
+
+# Set while the calls of the current context must not be answered from the cache
+_bypass_response_cache: ContextVar[bool] = ContextVar(
+    "bypass_response_cache", default=False
+)
+
+
+@contextmanager
+def bypass_response_cache(enabled: bool = True):
+    """Skips cache lookups for the chat model calls made inside the block when enabled,
+    e.g. when regenerating an answer that was rejected"""
+
+    token = _bypass_response_cache.set(enabled or _bypass_response_cache.get())
+    try:
+        yield
+    finally:
+        _bypass_response_cache.reset(token)
+
+
+class ResponseStore:
+    """SQLite table of serialized LLM generations with TTL and size-based eviction"""
+
+    def __init__(self, directory: str, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "llm_responses.sqlite"),
+            check_same_thread=False,
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, agent TEXT NOT NULL, generations TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        """Content address of a response, the llm string carries model and temperature"""
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the serialized generations stored under the key, or None if absent or expired"""
+
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT generations, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            generations, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+
+            self._db.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+            return generations
+
+    def put(self, key: str, agent: str, generations: str):
+        """Stores serialized generations, evicting expired and least recently used rows"""
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, agent, generations, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, agent, generations, now, now),
+            )
+            self._db.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def clear(self, agent: Optional[str] = None):
+        """Removes every stored response, or only those of one agent"""
+
+        with self._lock:
+            if agent is None:
+                self._db.execute("DELETE FROM responses")
+            else:
+                self._db.execute("DELETE FROM responses WHERE agent = ?", (agent,))
+            self._db.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class AgentResponseCache(BaseCache):
+    """LangChain cache for one agent's chat model, backed by a shared `ResponseStore`
+
+    With an `output_parser`, only generations whose text it parses are stored or served.
+    """
+
+    def __init__(
+        self,
+        agent: str,
+        store: ResponseStore,
+        output_parser: Optional[BaseOutputParser] = None,
+    ):
+        self.agent = agent
+        self.store = store
+        self.output_parser = output_parser
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.rejected = 0
+
+    def _parses(self, return_val: RETURN_VAL_TYPE) -> bool:
+        if self.output_parser is None:
+            return True
+        try:
+            for generation in return_val:
+                self.output_parser.parse(generation.text)
+        except (OutputParserException, ValueError):
+            return False
+        return True
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if _bypass_response_cache.get():
+            self.bypassed += 1
+            return None
+
+        key = ResponseStore.key(prompt, llm_string)
+        generations = self.store.get(key)
+        if generations is None:
+            self.misses += 1
+            return None
+
+        return_val = [loads(generation) for generation in json.loads(generations)]
+        # Entries stored before the output was validated may hold malformed completions
+        if not self._parses(return_val):
+            self.store.delete(key)
+            self.misses += 1
+            return None
+
+        for generation in return_val:
+            generation.generation_info = {
+                **(generation.generation_info or {}),
+                CACHE_HIT_KEY: True,
+            }
+        self.hits += 1
+        return return_val
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if not self._parses(return_val):
+            self.rejected += 1
+            return
+        generations = json.dumps([dumps(generation) for generation in return_val])
+        self.store.put(ResponseStore.key(prompt, llm_string), self.agent, generations)
+
+    def clear(self, **kwargs: Any) -> None:
+        self.store.clear(agent=self.agent)
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hit and miss counters of the agent"""
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "rejected": self.rejected,
+        }
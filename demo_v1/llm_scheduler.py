@@ -0,0 +1,320 @@
+"""
+Rate-limit-aware scheduler for LLM calls.
+
+The graph fans out one LLM call per subquery or document with `asyncio.gather`, and with
+several cases running at once that used to end in 429s and retry storms. Every chat
+model call now waits for a slot from the scheduler first:
+
+- per model requests-per-minute and tokens-per-minute buckets, charged with the
+  estimated prompt and completion size of the call
+- an AIMD concurrency limit per model that grows while calls come back fast and is
+  cut on responses slower than their agent's latency target and halved on 429s
+- a priority queue, so the critical path (generation and hallucination checks) is
+  served before the graders when the limit is reached
+
+The scheduler state is guarded by thread locks, so concurrent Streamlit sessions (each
+with their own event loop) and synchronous callers share the same budgets.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import openai
+
+
+class TokenBucket:
+    """Budget that refills continuously up to `per_minute` units per minute"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Charges the bucket and returns how long to wait before the budget covers it"""
+
+        with self._lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def drain(self):
+        """Empties the bucket, used when the provider reports a rate limit anyway"""
+
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+
+class AdaptiveLimiter:
+    """Priority-ordered concurrency limit adjusted by additive increase, multiplicative decrease"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, Callable[[], None]]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _enqueue_or_acquire(self, priority: int, wake: Callable[[], None]) -> bool:
+        with self._lock:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            heapq.heappush(self._waiters, (priority, next(self._sequence), wake))
+            return False
+
+    def _hand_over(self):
+        # Called with the lock held, passes free slots to the highest priority waiters
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, wake = heapq.heappop(self._waiters)
+            try:
+                wake()
+            except RuntimeError:
+                # The waiter's event loop has already been closed
+                continue
+            self.in_flight += 1
+
+    async def acquire(self, priority: int):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def on_granted():
+            if granted.cancelled():
+                # The waiter gave up after the slot was handed to it
+                self.release()
+            else:
+                granted.set_result(None)
+
+        if self._enqueue_or_acquire(
+            priority, lambda: loop.call_soon_threadsafe(on_granted)
+        ):
+            return
+        await granted
+
+    def acquire_blocking(self, priority: int):
+        granted = threading.Event()
+        if not self._enqueue_or_acquire(priority, granted.set):
+            granted.wait()
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        rate_limited: bool = False,
+        latency_target: Optional[float] = None,
+    ):
+        """Frees a slot and adapts the limit to the outcome of the call, a call is slow
+        when its latency is over the target of its agent"""
+
+        with self._lock:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif latency is not None and latency > (latency_target or float("inf")):
+                self.limit = max(self.minimum, self.limit * 0.9)
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._hand_over()
+
+
+@dataclass
+class QueueWaitStats:
+    """Queue wait recorded for the calls of one agent"""
+
+    calls: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    rate_limited: int = 0
+    recent_waits: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+
+    def record(self, wait: float):
+        self.calls += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.recent_waits.append(wait)
+
+    def summary(self) -> Dict[str, float]:
+        waits = sorted(self.recent_waits)
+        return {
+            "calls": self.calls,
+            "rate_limited": self.rate_limited,
+            "mean_wait_s": self.total_wait / self.calls if self.calls else 0.0,
+            "p95_wait_s": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            "max_wait_s": self.max_wait,
+        }
+
+
+class ModelLane:
+    """Request and token budgets plus the concurrency limit of one model"""
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        initial_concurrency: int,
+        max_concurrency: int,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limiter = AdaptiveLimiter(initial_concurrency, 1, max_concurrency)
+
+    def budget_delay(self, tokens: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    return isinstance(error, openai.RateLimitError)
+
+
+class LlmScheduler:
+    """Admits LLM calls per model within their rate limits, most critical agents first"""
+
+    def __init__(
+        self,
+        model_limits: Dict[str, Tuple[int, int]],
+        default_limits: Tuple[int, int],
+        agent_priorities: Dict[str, int],
+        default_priority: int,
+        initial_concurrency: int,
+        max_concurrency: int,
+        latency_targets: Dict[str, float],
+        default_latency_target: float,
+    ):
+        self.model_limits = model_limits
+        self.default_limits = default_limits
+        self.agent_priorities = agent_priorities
+        self.default_priority = default_priority
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_targets = latency_targets
+        self.default_latency_target = default_latency_target
+
+        self._lanes: Dict[str, ModelLane] = {}
+        self._waits: Dict[str, QueueWaitStats] = {}
+        self._lock = threading.Lock()
+
+    def _lane(self, model: str) -> ModelLane:
+        with self._lock:
+            if model not in self._lanes:
+                requests_per_minute, tokens_per_minute = self.model_limits.get(
+                    model, self.default_limits
+                )
+                self._lanes[model] = ModelLane(
+                    requests_per_minute,
+                    tokens_per_minute,
+                    self.initial_concurrency,
+                    self.max_concurrency,
+                )
+            return self._lanes[model]
+
+    def _wait_stats(self, agent: Optional[str]) -> QueueWaitStats:
+        with self._lock:
+            return self._waits.setdefault(agent or "unnamed", QueueWaitStats())
+
+    def _priority(self, agent: Optional[str]) -> int:
+        return self.agent_priorities.get(agent, self.default_priority)
+
+    def _latency_target(self, agent: Optional[str]) -> float:
+        return self.latency_targets.get(agent, self.default_latency_target)
+
+    @asynccontextmanager
+    async def slot(self, model: str, agent: Optional[str], tokens: int):
+        """Waits for the rate limit budget and a concurrency slot, then runs the call"""
+
+        lane = self._lane(model)
+        wait_stats = self._wait_stats(agent)
+
+        # The budget is waited for before taking a slot, so a call sleeping on the budget
+        # does not hold a slot the calls that are ready to run could use
+        queued = time.monotonic()
+        delay = lane.budget_delay(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+        await lane.limiter.acquire(self._priority(agent))
+        wait_stats.record(time.monotonic() - queued)
+
+        started = time.monotonic()
+        rate_limited = False
+        try:
+            yield
+        except BaseException as error:
+            rate_limited = is_rate_limit_error(error)
+            raise
+        finally:
+            self._finish(
+                lane, wait_stats, time.monotonic() - started, rate_limited, agent
+            )
+
+    @contextmanager
+    def blocking_slot(self, model: str, agent: Optional[str], tokens: int):
+        """Synchronous counterpart of `slot` for callers outside an event loop"""
+
+        lane = self._lane(model)
+        wait_stats = self._wait_stats(agent)
+
+        queued = time.monotonic()
+        delay = lane.budget_delay(tokens)
+        if delay:
+            time.sleep(delay)
+        lane.limiter.acquire_blocking(self._priority(agent))
+        wait_stats.record(time.monotonic() - queued)
+
+        started = time.monotonic()
+        rate_limited = False
+        try:
+            yield
+        except BaseException as error:
+            rate_limited = is_rate_limit_error(error)
+            raise
+        finally:
+            self._finish(
+                lane, wait_stats, time.monotonic() - started, rate_limited, agent
+            )
+
+    def _finish(
+        self,
+        lane: ModelLane,
+        wait_stats: QueueWaitStats,
+        latency: float,
+        rate_limited: bool,
+        agent: Optional[str],
+    ):
+        if rate_limited:
+            # Stop admitting calls to the model until its budgets have refilled
+            wait_stats.rate_limited += 1
+            lane.requests.drain()
+            lane.tokens.drain()
+        lane.limiter.release(latency, rate_limited, self._latency_target(agent))
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Returns queue wait per agent and the current concurrency limit per model"""
+
+        with self._lock:
+            lanes = dict(self._lanes)
+            waits = dict(self._waits)
+        return {
+            "agents": {agent: stats.summary() for agent, stats in waits.items()},
+            "models": {
+                model: {
+                    "concurrency_limit": round(lane.limiter.limit, 2),
+                    "in_flight": lane.limiter.in_flight,
+                }
+                for model, lane in lanes.items()
+            },
+        }
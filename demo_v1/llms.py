@@ -0,0 +1,188 @@
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import BaseOutputParser
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from constants import Caches, Scheduling
+from llm_cache import AgentResponseCache, ResponseStore
+from llm_scheduler import LlmScheduler
+from registry import registry
+from run_tracing import record_queue_wait
+
+
+def get_llm_scheduler() -> LlmScheduler:
+    """Returns the scheduler every chat model call of the process goes through"""
+
+    return registry.get_or_create(
+        "llm-scheduler",
+        lambda: LlmScheduler(
+            model_limits=Scheduling.MODEL_LIMITS,
+            default_limits=Scheduling.DEFAULT_LIMITS,
+            agent_priorities=Scheduling.AGENT_PRIORITIES,
+            default_priority=Scheduling.DEFAULT_PRIORITY,
+            initial_concurrency=Scheduling.INITIAL_CONCURRENCY,
+            max_concurrency=Scheduling.MAX_CONCURRENCY,
+            latency_targets=Scheduling.LATENCY_TARGETS,
+            default_latency_target=Scheduling.DEFAULT_LATENCY_TARGET_SECONDS,
+        ),
+    )
+
+
+class ScheduledChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose calls wait for a slot from the shared `LlmScheduler`
+
+    Cache hits are answered before `_generate` is reached, so they are never queued.
+    """
+
+    agent: Optional[str] = None
+
+    def _estimate_tokens(self, messages: List[BaseMessage]) -> int:
+        # About four characters per token, plus the completion the call may produce
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        return prompt_chars // 4 + (self.max_tokens or Scheduling.COMPLETION_TOKENS_ESTIMATE)
+
+    def _get_invocation_params(
+        self, stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        # Reported to the callbacks only, so traces can attribute the call to its agent
+        return {**super()._get_invocation_params(stop=stop, **kwargs), "agent": self.agent}
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return super()._generate(messages, stop, run_manager, **kwargs)
+        queued_at = time.perf_counter()
+        with get_llm_scheduler().blocking_slot(
+            self.model_name, self.agent, self._estimate_tokens(messages)
+        ):
+            record_queue_wait(run_manager, time.perf_counter() - queued_at)
+            return super()._generate(messages, stop, run_manager, **kwargs)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Streaming generations go through `_astream`, which takes the slot itself
+        if self.streaming:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        queued_at = time.perf_counter()
+        async with get_llm_scheduler().slot(
+            self.model_name, self.agent, self._estimate_tokens(messages)
+        ):
+            record_queue_wait(run_manager, time.perf_counter() - queued_at)
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        queued_at = time.perf_counter()
+        with get_llm_scheduler().blocking_slot(
+            self.model_name, self.agent, self._estimate_tokens(messages)
+        ):
+            record_queue_wait(run_manager, time.perf_counter() - queued_at)
+            yield from super()._stream(messages, stop, run_manager, **kwargs)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        queued_at = time.perf_counter()
+        async with get_llm_scheduler().slot(
+            self.model_name, self.agent, self._estimate_tokens(messages)
+        ):
+            record_queue_wait(run_manager, time.perf_counter() - queued_at)
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                yield chunk
+
+
+def get_response_store() -> ResponseStore:
+    """Returns the on-disk store shared by the response caches of all agents"""
+
+    return registry.get_or_create(
+        "llm-response-store",
+        lambda: ResponseStore(
+            Caches.DIRECTORY,
+            ttl_seconds=Caches.LLM_RESPONSE_TTL_SECONDS,
+            max_entries=Caches.LLM_RESPONSE_MAX_ENTRIES,
+        ),
+    )
+
+
+def get_response_cache(
+    agent: str, output_parser: Optional[BaseOutputParser] = None
+) -> Optional[AgentResponseCache]:
+    """Returns the response cache of an agent, or None if the agent has not opted in"""
+
+    agents = {name.strip() for name in Caches.LLM_RESPONSE_AGENTS.split(",") if name.strip()}
+    if agent not in agents:
+        return None
+
+    return registry.get_or_create(
+        f"llm-response-cache:{agent}",
+        lambda: AgentResponseCache(agent, get_response_store(), output_parser),
+    )
+
+
+def get_response_cache_stats() -> Dict[str, Dict[str, float]]:
+    """Returns the hit and miss counters of every agent response cache created so far"""
+
+    return {
+        cache.agent: cache.stats()
+        for cache in registry.find(AgentResponseCache)
+    }
+
+
+def get_chat_model(
+    model: str,
+    temperature: float = 0.5,
+    agent: Optional[str] = None,
+    output_parser: Optional[BaseOutputParser] = None,
+) -> ChatOpenAI:
+    """Returns the shared chat model client for a model and temperature
+
+    When `agent` is given and listed in `Caches.LLM_RESPONSE_AGENTS`, identical prompts
+    are answered from the persistent response cache instead of calling the model. Only
+    responses `output_parser` parses are cached, pass the agent's `PydanticOutputParser`
+    so replies that are JSON but miss the schema are not cached either, and retries
+    after such a reply call the model again. Calls are admitted by the shared scheduler
+    with the priority of the agent. Streamed responses report their token usage like
+    the others, for the run trace.
+
+    The client does not retry by itself, a 429 retried inside the client would hold
+    the scheduler slot and reach the scheduler only after every attempt failed. Chains
+    retry with `.with_retry()` instead, after the scheduler has seen the error.
+    """
+
+    cache = get_response_cache(agent, output_parser) if agent else None
+    return registry.get_or_create(
+        f"llm:{model}:{temperature}:{agent}",
+        lambda: ScheduledChatOpenAI(
+            model=model,
+            temperature=temperature,
+            cache=cache or False,
+            agent=agent,
+            stream_usage=True,
+            max_retries=0,
+        ),
+    )
@@ -0,0 +1,790 @@
+"""
+Embedded, in-process vector store used as a drop-in for the Qdrant server.
+
+Each collection lives in its own directory:
+
+    <path>/<collection>/config.json      store settings and vector dimension
+    <path>/<collection>/vectors.npy      L2-normalized float32/float16 matrix, memory-mapped
+    <path>/<collection>/payloads.jsonl   one {"id", "page_content", "metadata"} per row
+    <path>/<collection>/ivf.npz          IVF centroids and list assignments (approximate mode)
+    <path>/<collection>/quantized.npz    int8 or 1-bit codes kept in RAM (quantized mode)
+
+Scores are cosine similarities, matching the COSINE distance the LangChain Qdrant
+store creates collections with, so thresholds carry over between backends.
+
+In hybrid mode a BM25 index over the chunk text is searched next to the dense
+vectors and the two rankings are merged with reciprocal-rank fusion, so exact
+clinical terms ("Lachman", "Spurling") are not lost to the embedding.
+
+With quantization enabled only the compact codes are scanned; the best
+`k * oversampling` candidates are then rescored against the full-precision matrix,
+which stays on disk and is only paged in for those rows.
+
+Writes append to the matrix and payload files instead of rewriting them, and build the
+new state next to the one being searched, which is swapped in under a read/write lock,
+so web results can be written back while searches run.
+"""
+
+import io
+import json
+import math
+import os
+import re
+import threading
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Number of set bits for every byte value, used for Hamming distances on packed codes
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def _tokenize(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Merges ranked row lists into one ranking scored by sum(1 / (k + rank))"""
+
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+class _ReadWriteLock:
+    """Lets any number of searches run together while a write gets exclusive access,
+    waiting writes hold back new searches so they are not starved"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+# Range bounds of a filter value, named like the bounds of a Qdrant `Range`
+_RANGE_BOUNDS = {
+    "gt": lambda value, bound: value > bound,
+    "gte": lambda value, bound: value >= bound,
+    "lt": lambda value, bound: value < bound,
+    "lte": lambda value, bound: value <= bound,
+}
+
+
+def _matches(metadata: dict, filter: Optional[Dict[str, Any]]) -> bool:
+    """Returns whether the metadata satisfies a filter
+
+    List values match any of their items, dict values are ranges such as
+    `{"gt": 10}` and match numbers within all of their bounds, other values match
+    exactly.
+    """
+
+    if not filter:
+        return True
+    for key, expected in filter.items():
+        value = metadata.get(key)
+        if isinstance(expected, dict):
+            if not isinstance(value, (int, float)):
+                return False
+            if not all(
+                _RANGE_BOUNDS[bound](value, limit)
+                for bound, limit in expected.items()
+                if limit is not None
+            ):
+                return False
+        elif isinstance(expected, (list, tuple, set)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+class LocalVectorStore(VectorStore):
+    """Persistent NumPy vector store with exact and IVF approximate search and optional quantization"""
+
+    def __init__(
+        self,
+        path: str,
+        collection_name: str,
+        embeddings: Embeddings,
+        dtype: str = "float32",
+        index: str = "exact",
+        ivf_lists: Optional[int] = None,
+        ivf_probes: int = 8,
+        quantization: Optional[str] = None,
+        oversampling: float = 2.0,
+        rescore: bool = True,
+        retrieval_mode: str = "dense",
+    ):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        if index not in ("exact", "ivf"):
+            raise ValueError(f"Unsupported index type: {index}")
+        if quantization not in (None, "int8", "binary"):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        if retrieval_mode not in ("dense", "hybrid"):
+            raise ValueError(f"Unsupported retrieval mode: {retrieval_mode}")
+
+        self.directory = os.path.join(path, collection_name)
+        self.collection_name = collection_name
+        self._embeddings = embeddings
+        self.dtype = dtype
+        self.index = index
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.quantization = quantization
+        self.oversampling = oversampling
+        self.rescore = rescore
+        self.retrieval_mode = retrieval_mode
+
+        self.ids: List[str] = []
+        self.payloads: List[dict] = []
+        self.vectors: Optional[np.ndarray] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.inverted_lists: List[np.ndarray] = []
+        self.codes: Optional[np.ndarray] = None
+        self.code_scale: Optional[np.ndarray] = None
+        self.code_offset: Optional[np.ndarray] = None
+        self._postings: Optional[Dict[str, List[Tuple[int, int]]]] = None
+        self._doc_lengths: Optional[np.ndarray] = None
+
+        # Searches share the read side, swapping in the state a write built takes the
+        # write side, and writes are serialized among themselves while they build
+        self._lock = _ReadWriteLock()
+        self._write_lock = threading.RLock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    # * Persistence
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        if os.path.exists(self._path("config.json")):
+            with open(self._path("config.json"), "r") as f:
+                config = json.load(f)
+            # The on-disk matrix decides the dtype, a collection is not silently converted
+            self.dtype = config["dtype"]
+
+        if os.path.exists(self._path("vectors.npy")):
+            self.vectors = np.load(self._path("vectors.npy"), mmap_mode="r")
+
+        if os.path.exists(self._path("payloads.jsonl")):
+            with open(self._path("payloads.jsonl"), "r") as f:
+                for line in f:
+                    payload = json.loads(line)
+                    self.ids.append(payload.pop("id"))
+                    self.payloads.append(payload)
+
+        # A write interrupted between the matrix and the payloads leaves one longer than
+        # the other, the collection is rewritten with only the rows both have
+        if self.vectors is not None and len(self.vectors) != len(self.ids):
+            rows = min(len(self.vectors), len(self.ids))
+            self.ids, self.payloads = self.ids[:rows], self.payloads[:rows]
+            self.vectors = self._save(
+                np.asarray(self.vectors[:rows], dtype=np.float32), self.ids, self.payloads
+            )
+
+        if self.index == "ivf" and os.path.exists(self._path("ivf.npz")):
+            ivf = np.load(self._path("ivf.npz"))
+            if len(ivf["assignments"]) == len(self.ids):
+                self.centroids = ivf["centroids"]
+                assignments = ivf["assignments"]
+                self.inverted_lists = [
+                    np.flatnonzero(assignments == i) for i in range(len(self.centroids))
+                ]
+        if self.index == "ivf" and self.centroids is None and self.vectors is not None:
+            self.build_ivf_index()
+
+        if self.quantization and self.vectors is not None:
+            self._load_quantized()
+
+    def _save(self, vectors: np.ndarray, ids: List[str], payloads: List[dict]) -> np.ndarray:
+        """Rewrites the whole collection and returns the new memory-mapped matrix"""
+
+        # Write to temporary files first so a crash never leaves a half-written collection
+        tmp_vectors = self._path("vectors.tmp.npy")
+        np.save(tmp_vectors, vectors.astype(self.dtype))
+        os.replace(tmp_vectors, self._path("vectors.npy"))
+
+        self._write_payloads(ids, payloads, 0)
+
+        with open(self._path("config.json"), "w") as f:
+            json.dump(
+                {"dtype": self.dtype, "dimension": int(vectors.shape[1])}, f, indent=2
+            )
+
+        return np.load(self._path("vectors.npy"), mmap_mode="r")
+
+    def _append_vectors(self, appended: np.ndarray) -> bool:
+        """Appends rows to vectors.npy in place, returns False when the file has to be
+        rewritten instead (no file yet, or a header without room for the new shape)"""
+
+        path = self._path("vectors.npy")
+        if self.vectors is None or not os.path.exists(path):
+            return False
+
+        with open(path, "r+b") as f:
+            if np.lib.format.read_magic(f) != (1, 0):
+                return False
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            offset = f.tell()
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(
+                header,
+                {
+                    "descr": np.lib.format.dtype_to_descr(dtype),
+                    "fortran_order": fortran_order,
+                    "shape": (shape[0] + len(appended), shape[1]),
+                },
+            )
+            if header.tell() != offset:
+                return False
+
+            # Rows first and the header last, so an interrupted write keeps the old shape
+            f.seek(offset + shape[0] * shape[1] * dtype.itemsize)
+            f.write(appended.astype(dtype).tobytes())
+            f.seek(0)
+            f.write(header.getvalue())
+        return True
+
+    def _write_payloads(self, ids: List[str], payloads: List[dict], start: int):
+        """Appends the payloads from row `start` on, or rewrites the file when start is 0"""
+
+        if start:
+            with open(self._path("payloads.jsonl"), "a") as f:
+                for point_id, payload in zip(ids[start:], payloads[start:]):
+                    f.write(json.dumps({"id": point_id, **payload}) + "\n")
+            return
+
+        tmp_payloads = self._path("payloads.jsonl.tmp")
+        with open(tmp_payloads, "w") as f:
+            for point_id, payload in zip(ids, payloads):
+                f.write(json.dumps({"id": point_id, **payload}) + "\n")
+        os.replace(tmp_payloads, self._path("payloads.jsonl"))
+
+    # * Quantization
+
+    def _load_quantized(self):
+        path = self._path("quantized.npz")
+        if os.path.exists(path):
+            quantized = np.load(path)
+            if (
+                str(quantized["kind"]) == self.quantization
+                and len(quantized["codes"]) == len(self.ids)
+            ):
+                self.codes = quantized["codes"]
+                self.code_scale = quantized["scale"]
+                self.code_offset = quantized["offset"]
+                return
+        self.build_quantized_codes()
+
+    def set_quantization(self, quantization: Optional[str]):
+        """Switches the quantization of the collection, re-encoding the stored vectors"""
+
+        if quantization not in (None, "int8", "binary"):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        with self._write_lock:
+            codes = self._encode_stored(quantization)
+            with self._lock.write():
+                self.quantization = quantization
+                self.codes, self.code_scale, self.code_offset = codes
+
+    def build_quantized_codes(self):
+        """Encodes the full-precision matrix into int8 or 1-bit codes"""
+
+        with self._write_lock:
+            codes = self._encode_stored(self.quantization)
+            with self._lock.write():
+                self.codes, self.code_scale, self.code_offset = codes
+
+    def _encode_stored(self, quantization: Optional[str]) -> tuple:
+        """Encodes and saves the codes of the stored matrix, fitting the int8 mapping to it"""
+
+        if quantization is None or self.vectors is None:
+            return None, None, None
+        codes = self._encode(quantization, np.asarray(self.vectors, dtype=np.float32))
+        self._save_quantized(quantization, *codes)
+        return codes
+
+    @staticmethod
+    def _encode(
+        quantization: str,
+        vectors: np.ndarray,
+        scale: Optional[np.ndarray] = None,
+        offset: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the codes, scale and offset of the vectors, int8 codes use the given
+        mapping or one fitted to the vectors"""
+
+        if quantization == "int8":
+            if scale is None:
+                # Per-dimension affine mapping of the 0.5..99.5 percentile range onto int8
+                offset = np.percentile(vectors, 0.5, axis=0)
+                high = np.percentile(vectors, 99.5, axis=0)
+                scale = np.maximum(high - offset, 1e-12) / 255.0
+            codes = np.clip(np.round((vectors - offset) / scale) - 128, -128, 127)
+            return (
+                codes.astype(np.int8),
+                scale.astype(np.float32),
+                offset.astype(np.float32),
+            )
+
+        return (
+            np.packbits(vectors > 0, axis=1),
+            np.zeros(0, dtype=np.float32),
+            np.zeros(0, dtype=np.float32),
+        )
+
+    def _save_quantized(
+        self, quantization: str, codes: np.ndarray, scale: np.ndarray, offset: np.ndarray
+    ):
+        np.savez(
+            self._path("quantized.npz"),
+            kind=quantization,
+            codes=codes,
+            scale=scale,
+            offset=offset,
+        )
+
+    def _approximate_scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Scores the rows against the query using only their quantized codes"""
+
+        codes = self.codes[rows]
+        if self.quantization == "int8":
+            # v ~= (code + 128) * scale + offset, so q.v splits into two dot products
+            return (codes.astype(np.float32) + 128.0) @ (query * self.code_scale) + float(
+                query @ self.code_offset
+            )
+
+        # Binary codes: similarity is the number of matching sign bits
+        query_bits = np.packbits(query > 0)
+        mismatches = _POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1)
+        return -mismatches.astype(np.float32)
+
+    # * Lexical index
+
+    def _build_lexical_index(self):
+        """Builds the BM25 postings over the chunk text, rebuilt lazily after writes"""
+
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths = []
+        for row, payload in enumerate(self.payloads):
+            tokens = _tokenize(payload["page_content"])
+            lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings[term].append((row, frequency))
+        # Concurrent searches check the postings, so the lengths are set first
+        self._doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self._postings = postings
+
+    def lexical_search(
+        self, query: str, limit: int, allowed: Optional[np.ndarray] = None, k1: float = 1.2, b: float = 0.75
+    ) -> List[int]:
+        """Returns the rows with the highest BM25 score for the query"""
+
+        with self._lock.read():
+            return self._lexical_search(query, limit, allowed, k1, b)
+
+    def _lexical_search(
+        self, query: str, limit: int, allowed: Optional[np.ndarray], k1: float, b: float
+    ) -> List[int]:
+        if self._postings is None:
+            self._build_lexical_index()
+        if len(self.ids) == 0:
+            return []
+
+        average_length = float(self._doc_lengths.mean()) or 1.0
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(_tokenize(query)):
+            postings = self._postings.get(term, [])
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.ids) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, frequency in postings:
+                if allowed is not None and not allowed[row]:
+                    continue
+                norm = k1 * (1 - b + b * self._doc_lengths[row] / average_length)
+                scores[row] += idf * frequency * (k1 + 1) / (frequency + norm)
+        return sorted(scores, key=lambda row: -scores[row])[:limit]
+
+    # * IVF index
+
+    def build_ivf_index(self, iterations: int = 10, seed: int = 0):
+        """Trains spherical k-means centroids and assigns every vector to its nearest list"""
+
+        with self._write_lock:
+            if self.vectors is None or len(self.vectors) == 0:
+                return
+            centroids, assignments = self._train_ivf(iterations, seed)
+            np.savez(self._path("ivf.npz"), centroids=centroids, assignments=assignments)
+            inverted_lists = [
+                np.flatnonzero(assignments == i) for i in range(len(centroids))
+            ]
+            with self._lock.write():
+                self.centroids = centroids
+                self.inverted_lists = inverted_lists
+
+    def _train_ivf(self, iterations: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+        vectors = np.asarray(self.vectors, dtype=np.float32)
+        n_lists = self.ivf_lists or max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = vectors[assignments == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Returns the row indices to scan for a query, None means scan everything"""
+
+        if self.index != "ivf" or self.centroids is None:
+            return None
+        probes = min(self.ivf_probes, len(self.centroids))
+        nearest = np.argsort(-(self.centroids @ query))[:probes]
+        return np.concatenate([self.inverted_lists[i] for i in nearest])
+
+    # * Writes
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+
+        vectors = self._embeddings.embed_documents(texts)
+        payloads = [
+            {"page_content": text, "metadata": metadata}
+            for text, metadata in zip(texts, metadatas)
+        ]
+        return self.upsert_vectors(vectors, payloads, ids)
+
+    def upsert_vectors(
+        self,
+        vectors: List[List[float]],
+        payloads: List[dict],
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Stores precomputed vectors with their `{"page_content", "metadata"}` payloads
+
+        New rows are appended to the files and get their codes and IVF lists from the
+        existing quantization mapping and centroids, so a write does not load the matrix
+        into RAM. The new state is built while searches keep using the current one.
+        """
+
+        if not payloads:
+            return []
+        ids = ids or [str(uuid.uuid4()) for _ in payloads]
+        new_vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+
+        with self._write_lock:
+            # Upsert semantics: points with an existing id are replaced in place
+            point_ids, point_payloads = list(self.ids), list(self.payloads)
+            rows = {point_id: row for row, point_id in enumerate(point_ids)}
+            stored = len(point_ids)
+            replaced: Dict[int, np.ndarray] = {}
+            appended = []
+            for payload, point_id, vector in zip(payloads, ids, new_vectors):
+                if point_id not in rows:
+                    rows[point_id] = len(point_ids)
+                    point_ids.append(point_id)
+                    point_payloads.append(payload)
+                    appended.append(vector)
+                    continue
+                row = rows[point_id]
+                if row < stored:
+                    replaced[row] = vector
+                else:
+                    appended[row - stored] = vector
+                point_payloads[row] = payload
+            appended = np.asarray(appended, dtype=np.float32).reshape(
+                -1, new_vectors.shape[1]
+            )
+
+            codes = (self.codes, self.code_scale, self.code_offset)
+            if self.codes is not None:
+                codes = self._updated_codes(replaced, appended)
+            inverted_lists = self.inverted_lists
+            if self.centroids is not None:
+                inverted_lists = self._updated_inverted_lists(replaced, appended)
+
+            in_place = self._append_vectors(appended)
+            if in_place:
+                self._write_payloads(point_ids, point_payloads, 0 if replaced else stored)
+                vectors_file = self._path("vectors.npy")
+            else:
+                matrix = np.concatenate(
+                    [
+                        np.asarray(self.vectors, dtype=np.float32)
+                        if self.vectors is not None
+                        else np.empty((0, appended.shape[1]), dtype=np.float32),
+                        appended,
+                    ]
+                )
+                for row, vector in replaced.items():
+                    matrix[row] = vector
+                self._save(matrix, point_ids, point_payloads)
+
+            with self._lock.write():
+                if in_place and replaced:
+                    # Rows being read are overwritten, so only while no search runs
+                    matrix = np.load(vectors_file, mmap_mode="r+")
+                    for row, vector in replaced.items():
+                        matrix[row] = vector
+                    matrix.flush()
+                    del matrix
+                self.vectors = np.load(self._path("vectors.npy"), mmap_mode="r")
+                self.ids, self.payloads = point_ids, point_payloads
+                self.codes, self.code_scale, self.code_offset = codes
+                self.inverted_lists = inverted_lists
+                self._postings = None
+
+            # A new collection has no centroids or mapping to extend yet
+            if self.index == "ivf" and self.centroids is None:
+                self.build_ivf_index()
+            if self.quantization and self.codes is None:
+                self.build_quantized_codes()
+
+        return ids
+
+    def _updated_codes(self, replaced: Dict[int, np.ndarray], appended: np.ndarray) -> tuple:
+        """Encodes the replaced and appended rows with the existing int8 mapping, which was
+        fitted to the collection it was built for"""
+
+        codes = self.codes.copy() if replaced else self.codes
+        if replaced:
+            codes[list(replaced)] = self._encode(
+                self.quantization,
+                np.asarray(list(replaced.values())),
+                self.code_scale,
+                self.code_offset,
+            )[0]
+        appended_codes = self._encode(
+            self.quantization, appended, self.code_scale, self.code_offset
+        )[0]
+        codes = np.concatenate([codes, appended_codes])
+        self._save_quantized(self.quantization, codes, self.code_scale, self.code_offset)
+        return codes, self.code_scale, self.code_offset
+
+    def _updated_inverted_lists(
+        self, replaced: Dict[int, np.ndarray], appended: np.ndarray
+    ) -> List[np.ndarray]:
+        """Assigns the replaced and appended rows to their nearest existing centroid"""
+
+        assignments = np.empty(len(self.ids), dtype=np.int64)
+        for i, members in enumerate(self.inverted_lists):
+            assignments[members] = i
+        if replaced:
+            assignments[list(replaced)] = np.argmax(
+                np.asarray(list(replaced.values())) @ self.centroids.T, axis=1
+            )
+        assignments = np.concatenate(
+            [assignments, np.argmax(appended @ self.centroids.T, axis=1)]
+        )
+        np.savez(self._path("ivf.npz"), centroids=self.centroids, assignments=assignments)
+        return [np.flatnonzero(assignments == i) for i in range(len(self.centroids))]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        path: str = "vector_store",
+        collection_name: str = "physio-textbooks",
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(path=path, collection_name=collection_name, embeddings=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    # * Search
+
+    def get_metadata(self, ids: List[str]) -> Dict[str, dict]:
+        """Returns the metadata of the stored points with the given ids"""
+
+        with self._lock.read():
+            rows = {point_id: row for row, point_id in enumerate(self.ids)}
+            return {
+                point_id: self.payloads[rows[point_id]]["metadata"]
+                for point_id in ids
+                if point_id in rows
+            }
+
+    def _document(self, row: int) -> Document:
+        payload = self.payloads[row]
+        return Document(
+            page_content=payload["page_content"],
+            metadata={**payload["metadata"], "_id": self.ids[row]},
+        )
+
+    def _allowed_rows(self, filter: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        if not filter:
+            return None
+        return np.array([_matches(payload["metadata"], filter) for payload in self.payloads])
+
+    def _dense_search(
+        self, query: np.ndarray, k: int, allowed: Optional[np.ndarray]
+    ) -> List[Tuple[int, float]]:
+        """Returns the top k (row, cosine score) pairs for one normalized query vector"""
+
+        candidates = self._candidates(query)
+        if candidates is None:
+            candidates = np.arange(len(self.ids))
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+        if len(candidates) == 0:
+            return []
+
+        if self.codes is not None:
+            # Shortlist on the codes, then rescore the shortlist at full precision
+            approximate = self._approximate_scores(candidates, query)
+            shortlist = np.argsort(-approximate)[: max(k, int(k * self.oversampling))]
+            candidates = candidates[shortlist]
+            if self.rescore:
+                scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+            else:
+                scores = approximate[shortlist]
+        else:
+            scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+
+        top = np.argsort(-scores)[:k]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+    def search_by_vectors(
+        self,
+        queries: List[List[float]],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """Searches the top k documents for every query vector"""
+
+        with self._lock.read():
+            if self.vectors is None or len(self.ids) == 0:
+                return [[] for _ in queries]
+
+            allowed = self._allowed_rows(filter)
+            queries = _normalize(np.asarray(queries, dtype=np.float32))
+            return [
+                [(self._document(row), score) for row, score in self._dense_search(query, k, allowed)]
+                for query in queries
+            ]
+
+    def hybrid_search(
+        self,
+        queries: List[List[float]],
+        texts: List[str],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        prefetch: int = 20,
+    ) -> List[List[Tuple[Document, float]]]:
+        """Fuses dense and BM25 rankings with reciprocal-rank fusion, scores are RRF scores"""
+
+        with self._lock.read():
+            if self.vectors is None or len(self.ids) == 0:
+                return [[] for _ in queries]
+
+            allowed = self._allowed_rows(filter)
+            queries = _normalize(np.asarray(queries, dtype=np.float32))
+            results = []
+            for query, text in zip(queries, texts):
+                dense = [row for row, score in self._dense_search(query, prefetch, allowed)]
+                lexical = self._lexical_search(text, prefetch, allowed, 1.2, 0.75)
+                fused = reciprocal_rank_fusion([dense, lexical])[:k]
+                results.append([(self._document(row), score) for row, score in fused])
+            return results
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        retrieval_mode: Optional[str] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        vector = self._embeddings.embed_query(query)
+        if (retrieval_mode or self.retrieval_mode) == "hybrid":
+            return self.hybrid_search([vector], [query], k=k, filter=filter)[0]
+        return self.search_by_vectors([vector], k=k, filter=filter)[0]
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        retrieval_mode: Optional[str] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, score in self.similarity_search_with_score(
+                query, k, filter, retrieval_mode
+            )
+        ]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
@@ -0,0 +1,136 @@
+"""
+Local check that the quotes of a generation appear in the packed context.
+
+Every differential diagnosis carries `relevant_quotes` that are meant to be verbatim
+from the context. Quotes and context are normalized (case, punctuation, quote marks,
+whitespace) and a quote is matched by the fraction of its word n-grams found in the
+context, which tolerates small edits such as dropped words or changed punctuation.
+Diagnoses whose quotes all match do not need the LLM hallucination grader.
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Set, Tuple
+
+from agents.diagnosis_generator import DifferentialDiagnosis
+from agents.halluncination_grader import (
+    HallucinationGraderOutput,
+    OverallAssessment,
+    VerifiedClaim,
+)
+
+NGRAM_SIZE = 3
+
+
+@dataclass
+class QuoteMatch:
+    """Result of matching one quote against the context"""
+
+    diagnosis_index: int
+    quote_index: int
+    text: str
+    score: float
+    verified: bool
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """Lowercases, folds unicode punctuation and splits the text into word tokens"""
+
+    text = unicodedata.normalize("NFKC", text).lower()
+    # PDF extraction hyphenates words across lines ("physio-\ntherapy")
+    text = re.sub(r"-\s*\n\s*", "", text)
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def ngrams(tokens: List[str], n: int = NGRAM_SIZE) -> Set[Tuple[str, ...]]:
+    if len(tokens) < n:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i : i + n]) for i in range(len(tokens) - n + 1)}
+
+
+class ContextIndex:
+    """N-gram index of the context that quotes are matched against"""
+
+    def __init__(self, context: str, n: int = NGRAM_SIZE):
+        self.n = n
+        self.tokens = normalize_tokens(context)
+        self.ngrams = ngrams(self.tokens, n)
+        self.text = " ".join(self.tokens)
+
+    def match(self, quote: str) -> float:
+        """Fraction of the quote's n-grams that occur in the context"""
+
+        tokens = normalize_tokens(quote)
+        if not tokens:
+            return 0.0
+        if len(tokens) < self.n:
+            # Too short for n-grams, require the words to appear contiguously
+            return 1.0 if f" {' '.join(tokens)} " in f" {self.text} " else 0.0
+
+        quote_ngrams = [tuple(tokens[i : i + self.n]) for i in range(len(tokens) - self.n + 1)]
+        return sum(ngram in self.ngrams for ngram in quote_ngrams) / len(quote_ngrams)
+
+
+def match_quotes(
+    diagnoses: List[Tuple[int, DifferentialDiagnosis]], context: str, threshold: float
+) -> List[QuoteMatch]:
+    """Matches every quote of the (index, diagnosis) pairs against the context"""
+
+    index = ContextIndex(context)
+    matches = []
+    for diagnosis_index, diagnosis in diagnoses:
+        for quote_index, quote in enumerate(diagnosis.relevant_quotes):
+            score = index.match(quote.text)
+            matches.append(
+                QuoteMatch(
+                    diagnosis_index=diagnosis_index,
+                    quote_index=quote_index,
+                    text=quote.text,
+                    score=score,
+                    verified=score >= threshold,
+                )
+            )
+    return matches
+
+
+def grounding_ratio(matches: List[QuoteMatch]) -> float:
+    """Fraction of the quotes that were verified, 1.0 when there are no quotes"""
+    return sum(match.verified for match in matches) / len(matches) if matches else 1.0
+
+
+def is_fully_verified(diagnosis: DifferentialDiagnosis, matches: List[QuoteMatch]) -> bool:
+    """A diagnosis is verified locally when it has quotes and all of them matched"""
+    return bool(diagnosis.relevant_quotes) and all(match.verified for match in matches)
+
+
+def local_grade(matches: List[QuoteMatch]) -> HallucinationGraderOutput:
+    """Builds the grade of a diagnosis whose quotes were all verified locally"""
+
+    return HallucinationGraderOutput(
+        overall_assessment=OverallAssessment(
+            grounded_score=sum(match.score for match in matches) / len(matches),
+            confidence="High",
+            summary="All quotes were found in the reference facts by the local quote check.",
+        ),
+        verified_claims=[
+            VerifiedClaim(
+                claim=match.text,
+                is_grounded=True,
+                supporting_evidence=match.text,
+                explanation=f"{match.score:.0%} of the quote's word {NGRAM_SIZE}-grams occur in the reference facts",
+            )
+            for match in matches
+        ],
+        identified_hallucinations=[],
+    )
+
+
+def describe_unmatched(matches: List[QuoteMatch]) -> str:
+    """Lists the quotes that could not be found, for the LLM grader to focus on"""
+
+    return "\n".join(
+        f'- "{match.text}" ({match.score:.0%} matched)'
+        for match in matches
+        if not match.verified
+    )
@@ -0,0 +1,115 @@
+"""
+Process-wide registry for heavyweight resources.
+
+Embedding models, vector database clients and LLM clients are expensive to build
+(seconds of load time and hundreds of MB of RAM for PubMedBERT), so they are created
+once per process here and shared by the PhysioTriage, Chatbot and Ingest tabs, the
+FastAPI app and the evaluation scripts.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+import psutil
+
+
+@dataclass
+class ResourceStats:
+    """Load statistics recorded for a registered resource
+
+    `rss_delta_mb` is the change in process RSS while the factory ran, so it is only
+    approximate: it includes resources loaded at the same time on other threads and
+    the resources the factory itself loads through the registry.
+    """
+
+    name: str
+    load_seconds: float
+    rss_delta_mb: float
+    hits: int = 0
+
+
+class ResourceRegistry:
+    """Creates each named resource once and hands out the shared instance afterwards"""
+
+    def __init__(self):
+        self._resources: Dict[str, Any] = {}
+        self._stats: Dict[str, ResourceStats] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+        self._process = psutil.Process()
+
+    def _lock_for(self, name: str) -> threading.Lock:
+        with self._registry_lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def get_or_create(self, name: str, factory: Callable[[], Any]) -> Any:
+        """Returns the resource registered under `name`, building it with `factory` on first use"""
+
+        hit = self._hit(name)
+        if hit is not None:
+            return hit[0]
+
+        # One lock per resource so loading a model does not block unrelated lookups
+        with self._lock_for(name):
+            hit = self._hit(name)
+            if hit is not None:
+                return hit[0]
+
+            rss_before = self._process.memory_info().rss
+            start = time.perf_counter()
+            resource = factory()
+            load_seconds = time.perf_counter() - start
+            rss_delta_mb = (self._process.memory_info().rss - rss_before) / (1024 * 1024)
+
+            with self._registry_lock:
+                self._stats[name] = ResourceStats(
+                    name=name, load_seconds=load_seconds, rss_delta_mb=rss_delta_mb
+                )
+                self._resources[name] = resource
+
+            print(
+                f"--- LOADED RESOURCE {name} in {load_seconds:.2f}s (~{rss_delta_mb:+.1f} MB RSS) ---"
+            )
+            return resource
+
+    def _hit(self, name: str):
+        """Returns `(resource,)` counting a reuse if it exists, None otherwise"""
+
+        with self._registry_lock:
+            if name not in self._resources:
+                return None
+            self._stats[name].hits += 1
+            return (self._resources[name],)
+
+    def find(self, resource_type: type) -> List[Any]:
+        """Returns every created resource that is an instance of `resource_type`"""
+        return [
+            resource
+            for resource in list(self._resources.values())
+            if isinstance(resource, resource_type)
+        ]
+
+    def stats(self) -> List[ResourceStats]:
+        """Returns the load statistics of every resource created so far"""
+        with self._registry_lock:
+            return list(self._stats.values())
+
+    def report(self) -> str:
+        """Returns a markdown table of load time and resident memory per resource"""
+
+        lines = [
+            "| Resource | Load time (s) | Approx. RSS delta (MB) | Reuses |",
+            "| --- | --- | --- | --- |",
+        ]
+        for item in self.stats():
+            lines.append(
+                f"| {item.name} | {item.load_seconds:.2f} | {item.rss_delta_mb:.1f} | {item.hits} |"
+            )
+        rss_mb = self._process.memory_info().rss / (1024 * 1024)
+        lines.append(f"\nProcess RSS: {rss_mb:.1f} MB")
+        return "\n".join(lines)
+
+
+registry = ResourceRegistry()
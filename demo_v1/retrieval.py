@@ -0,0 +1,323 @@
+"""
+Retrieval helpers for the subqueries produced by the query translator.
+
+All subqueries of a case are embedded in one batched forward pass and sent to Qdrant
+in a single batch-search request, instead of one embedding and one round trip each.
+Query embeddings go through the persistent embedding cache, so repeated subqueries
+skip the PubMedBERT forward pass entirely.
+The async variants run the embedding in an executor and use the async Qdrant client,
+so graph runs sharing an event loop are not blocked by retrieval.
+In hybrid mode sparse BM25 vectors are queried in the same request as the dense ones
+and merged server-side with reciprocal-rank fusion; scores are then RRF scores.
+Collections ingested without sparse vectors fall back to dense retrieval.
+With web write-back enabled the collection of stored web results is searched as well,
+and its unexpired hits are appended to the chunks of every subquery.
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+from qdrant_client import models
+
+from constants import VectorDb, WebSearch
+from db import (
+    get_async_qdrant_client,
+    get_collection_exists,
+    get_local_vector_store,
+    get_query_embeddings,
+    get_raw_qdrant_client,
+    get_search_params,
+    get_sparse_embeddings,
+    resolve_retrieval_mode,
+)
+from run_tracing import traced_call
+
+
+def format_document(doc: Document) -> str:
+    """Formats a retrieved chunk the way the grader and translator agents expect it"""
+    return f"source:{doc.metadata['source']}WebSource:{doc.metadata['WebSource']}\n\ncontent:{doc.page_content}"
+
+
+def chunk_source(document: str) -> str:
+    """Returns the source of a formatted chunk or web result ("source:...WebSource:...")"""
+
+    first_line = document.split("\n", 1)[0]
+    if not first_line.startswith("source:"):
+        return ""
+    return first_line[len("source:"):].split("WebSource:", 1)[0].strip()
+
+
+def chunk_id(document: str) -> str:
+    """Returns a stable, content-addressed ID for a formatted chunk or web result"""
+    return hashlib.sha1(document.encode("utf-8")).hexdigest()[:16]
+
+
+def point_to_document(point: models.ScoredPoint) -> Document:
+    """Converts a Qdrant point written by the LangChain Qdrant store into a Document"""
+    payload = point.payload or {}
+    return Document(
+        page_content=payload.get("page_content", ""),
+        metadata=payload.get("metadata") or {},
+    )
+
+
+def embed_sparse_queries(queries: List[str]) -> List[models.SparseVector]:
+    """Encodes the queries into sparse BM25 vectors"""
+
+    sparse_embeddings = get_sparse_embeddings()
+    vectors = []
+    for query in queries:
+        sparse = sparse_embeddings.embed_query(query)
+        vectors.append(models.SparseVector(indices=sparse.indices, values=sparse.values))
+    return vectors
+
+
+def hybrid_prefetch(
+    vector: List[float],
+    sparse_vector: models.SparseVector,
+    query_filter: Optional[models.Filter] = None,
+) -> List[models.Prefetch]:
+    """Prefetches dense and sparse candidates for reciprocal-rank fusion"""
+
+    return [
+        models.Prefetch(
+            query=vector,
+            using="",
+            filter=query_filter,
+            limit=VectorDb.HYBRID_PREFETCH,
+            params=get_search_params(),
+        ),
+        models.Prefetch(
+            query=sparse_vector,
+            using=VectorDb.SPARSE_VECTOR_NAME,
+            filter=query_filter,
+            limit=VectorDb.HYBRID_PREFETCH,
+        ),
+    ]
+
+
+def unexpired_filter(now: float) -> models.Filter:
+    """Matches the stored web results whose expiry has not passed"""
+
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key="metadata.expires_at", range=models.Range(gt=now)
+            )
+        ]
+    )
+
+
+def to_local_filter(query_filter: Optional[models.Filter]) -> Optional[dict]:
+    """Converts the `must` match and range conditions of a Qdrant filter for the local store
+
+    The local store filters on the document metadata, so the "metadata." prefix of the
+    payload keys is dropped.
+    """
+
+    if query_filter is None:
+        return None
+
+    local_filter = {}
+    for condition in query_filter.must or []:
+        key = condition.key.removeprefix("metadata.")
+        if condition.range is not None:
+            bounds = {bound: getattr(condition.range, bound) for bound in ("gt", "gte", "lt", "lte")}
+            local_filter[key] = {bound: limit for bound, limit in bounds.items() if limit is not None}
+        elif isinstance(condition.match, models.MatchAny):
+            local_filter[key] = list(condition.match.any)
+        else:
+            local_filter[key] = condition.match.value
+    return local_filter
+
+
+def batch_similarity_search_with_score(
+    queries: List[str],
+    k: int = VectorDb.SEARCH_K,
+    collection_name: str = VectorDb.COLLECTION_NAME,
+    retrieval_mode: str = VectorDb.RETRIEVAL_MODE,
+    query_filter: Optional[models.Filter] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """Searches the top k documents for every query with one embedding pass and one batch search"""
+
+    if not queries:
+        return []
+
+    embeddings = get_query_embeddings(VectorDb.EMBEDDING_MODEL)
+    vectors = embeddings.embed_queries(queries)
+
+    if VectorDb.BACKEND == "local":
+        store = get_local_vector_store(collection_name)
+        local_filter = to_local_filter(query_filter)
+        if retrieval_mode == "hybrid":
+            return store.hybrid_search(
+                vectors, queries, k=k, filter=local_filter, prefetch=VectorDb.HYBRID_PREFETCH
+            )
+        return store.search_by_vectors(vectors, k=k, filter=local_filter)
+
+    client = get_raw_qdrant_client()
+    retrieval_mode = resolve_retrieval_mode(retrieval_mode, collection_name)
+
+    if retrieval_mode == "hybrid":
+        sparse_vectors = embed_sparse_queries(queries)
+        responses = client.query_batch_points(
+            collection_name=collection_name,
+            requests=[
+                models.QueryRequest(
+                    prefetch=hybrid_prefetch(vector, sparse_vector, query_filter),
+                    query=models.FusionQuery(fusion=models.Fusion.RRF),
+                    filter=query_filter,
+                    limit=k,
+                    with_payload=True,
+                )
+                for vector, sparse_vector in zip(vectors, sparse_vectors)
+            ],
+        )
+        return [
+            [(point_to_document(point), point.score) for point in response.points]
+            for response in responses
+        ]
+
+    responses = client.search_batch(
+        collection_name=collection_name,
+        requests=[
+            models.SearchRequest(
+                vector=vector,
+                filter=query_filter,
+                limit=k,
+                with_payload=True,
+                params=get_search_params(),
+            )
+            for vector in vectors
+        ],
+    )
+
+    return [
+        [(point_to_document(point), point.score) for point in points]
+        for points in responses
+    ]
+
+
+async def abatch_similarity_search_with_score(
+    queries: List[str],
+    k: int = VectorDb.SEARCH_K,
+    collection_name: str = VectorDb.COLLECTION_NAME,
+    retrieval_mode: str = VectorDb.RETRIEVAL_MODE,
+    query_filter: Optional[models.Filter] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """Async version of `batch_similarity_search_with_score`, with the same single batch request"""
+
+    if not queries:
+        return []
+
+    # The forward pass is CPU bound, keep it off the event loop
+    embeddings = get_query_embeddings(VectorDb.EMBEDDING_MODEL)
+    loop = asyncio.get_running_loop()
+    with traced_call("embedding", "embed_queries", queries=len(queries)):
+        vectors = await loop.run_in_executor(None, embeddings.embed_queries, queries)
+
+    if VectorDb.BACKEND == "local":
+        store = get_local_vector_store(collection_name)
+        local_filter = to_local_filter(query_filter)
+        with traced_call("local_vector_store", retrieval_mode, queries=len(queries)):
+            if retrieval_mode == "hybrid":
+                return await loop.run_in_executor(
+                    None,
+                    store.hybrid_search,
+                    vectors,
+                    queries,
+                    k,
+                    local_filter,
+                    VectorDb.HYBRID_PREFETCH,
+                )
+            return await loop.run_in_executor(
+                None, store.search_by_vectors, vectors, k, local_filter
+            )
+
+    client = get_async_qdrant_client()
+    if retrieval_mode == "hybrid":
+        retrieval_mode = await loop.run_in_executor(
+            None, resolve_retrieval_mode, retrieval_mode, collection_name
+        )
+
+    if retrieval_mode == "hybrid":
+        sparse_vectors = await loop.run_in_executor(None, embed_sparse_queries, queries)
+        with traced_call(
+            "qdrant", "query_batch_points", collection=collection_name, queries=len(queries)
+        ):
+            responses = await client.query_batch_points(
+                collection_name=collection_name,
+                requests=[
+                    models.QueryRequest(
+                        prefetch=hybrid_prefetch(vector, sparse_vector, query_filter),
+                        query=models.FusionQuery(fusion=models.Fusion.RRF),
+                        filter=query_filter,
+                        limit=k,
+                        with_payload=True,
+                    )
+                    for vector, sparse_vector in zip(vectors, sparse_vectors)
+                ],
+            )
+        return [
+            [(point_to_document(point), point.score) for point in response.points]
+            for response in responses
+        ]
+
+    with traced_call("qdrant", "search_batch", collection=collection_name, queries=len(queries)):
+        responses = await client.search_batch(
+            collection_name=collection_name,
+            requests=[
+                models.SearchRequest(
+                    vector=vector,
+                    filter=query_filter,
+                    limit=k,
+                    with_payload=True,
+                    params=get_search_params(),
+                )
+                for vector in vectors
+            ],
+        )
+
+    return [
+        [(point_to_document(point), point.score) for point in points]
+        for points in responses
+    ]
+
+
+async def aretrieve_subqueries(
+    subqueries: List[str],
+    k: int = VectorDb.SEARCH_K,
+    retrieval_mode: str = VectorDb.RETRIEVAL_MODE,
+    web_results: bool = WebSearch.WRITE_BACK,
+) -> List[dict]:
+    """Retrieves documents for every subquery in the `{"question", "documents", "scores"}` shape"""
+
+    results = await abatch_similarity_search_with_score(
+        subqueries, k=k, retrieval_mode=retrieval_mode
+    )
+
+    # The query embeddings are cached by now, so this search only adds the round trip
+    loop = asyncio.get_running_loop()
+    if web_results and await loop.run_in_executor(
+        None, get_collection_exists, WebSearch.WRITE_BACK_COLLECTION
+    ):
+        web_hits = await abatch_similarity_search_with_score(
+            subqueries,
+            k=WebSearch.WRITE_BACK_SEARCH_K,
+            collection_name=WebSearch.WRITE_BACK_COLLECTION,
+            retrieval_mode=retrieval_mode,
+            query_filter=unexpired_filter(time.time()),
+        )
+        results = [hits + web for hits, web in zip(results, web_hits)]
+
+    return [
+        {
+            "question": subquery,
+            "documents": [format_document(doc) for doc, score in subquery_results],
+            "scores": [score for doc, score in subquery_results],
+        }
+        for subquery, subquery_results in zip(subqueries, results)
+    ]
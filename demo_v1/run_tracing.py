@@ -0,0 +1,594 @@
+"""
+Per-node and per-LLM-call tracing of graph runs.
+
+Every node added with `traced_node` runs with a `NodeTracer` installed in a context
+variable. The tracer is registered as a LangChain configure hook, so every chat model
+call made while the node runs, including the calls of tasks it gathers, reports to it
+without the nodes passing callbacks around. When the node returns, its span and the
+spans of its LLM calls are appended to the `trace` of the graph state:
+
+    {"type": "node", "name", "start", "end", "seconds", "calls": [
+        {"type": "llm", "agent", "model", "start", "end", "seconds", "queue_seconds",
+         "first_token_seconds", "prompt_tokens", "completion_tokens", "cost",
+         "cache_hit", "attempt", "streamed", "error"}, ...]}
+
+Calls that do not go through LangChain (Qdrant searches, query embedding, web search)
+are recorded with `traced_call` as `{"type", "name", "start", "end", "seconds",
+"error", ...}` spans next to the LLM calls.
+
+Times are epoch seconds. `summarize_trace` aggregates a trace per node and per model,
+`export_jsonl`, `export_otel_json` and `export_chrome_trace` write it out for other
+tools.
+"""
+
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+from constants import Tracing
+from llm_cache import CACHE_HIT_KEY
+
+run_tracer_var: ContextVar[Optional["NodeTracer"]] = ContextVar(
+    "run_tracer", default=None
+)
+register_configure_hook(run_tracer_var, inheritable=True)
+
+
+def llm_call_cost(
+    model: Optional[str], prompt_tokens: Optional[int], completion_tokens: Optional[int]
+) -> Optional[float]:
+    """Estimated cost of a call in USD, None when the model or token counts are unknown"""
+
+    prices = Tracing.COST_PER_MILLION_TOKENS.get(model)
+    if prices is None or prompt_tokens is None or completion_tokens is None:
+        return None
+    prompt_price, completion_price = prices
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def _attempt(tags: Optional[List[str]]) -> Optional[int]:
+    # `with_retry` tags the run of every attempt after the first "retry:attempt:<n>"
+    for tag in tags or []:
+        if tag.startswith("retry:attempt:"):
+            return int(tag.rsplit(":", 1)[1])
+    return None
+
+
+def _usage(response: LLMResult):
+    """Returns the prompt and completion tokens reported by the API, if any"""
+
+    token_usage = (response.llm_output or {}).get("token_usage")
+    if token_usage:
+        return token_usage.get("prompt_tokens"), token_usage.get("completion_tokens")
+
+    # Streamed responses carry the usage of the last chunk on the message
+    for generations in response.generations:
+        for generation in generations:
+            usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage_metadata:
+                return usage_metadata.get("input_tokens"), usage_metadata.get("output_tokens")
+    return None, None
+
+
+class NodeTracer(BaseCallbackHandler):
+    """Collects the spans of the chat model and other calls made while one node runs"""
+
+    run_inline = True
+
+    def __init__(self, node: str):
+        self.node = node
+        self._calls: Dict[UUID, dict] = {}
+        # Parent and retry attempt of the chain runs, the attempt tag is only put on
+        # the run directly under the retry, usually the chain around the chat model
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        self._attempts: Dict[UUID, int] = {}
+        self._spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span: dict):
+        with self._lock:
+            self._spans.append(span)
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            attempt = _attempt(tags)
+            if attempt is not None:
+                self._attempts[run_id] = attempt
+
+    def _inherited_attempt(self, run_id: Optional[UUID]) -> int:
+        # Attempt of the closest retried ancestor run, 1 if none was retried
+        while run_id is not None:
+            if run_id in self._attempts:
+                return self._attempts[run_id]
+            run_id = self._parents.get(run_id)
+        return 1
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[List[str]] = None,
+        invocation_params: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        invocation_params = invocation_params or {}
+        with self._lock:
+            attempt = _attempt(tags) or self._inherited_attempt(parent_run_id)
+            self._calls[run_id] = {
+                "type": "llm",
+                "agent": invocation_params.get("agent"),
+                "model": invocation_params.get("model_name") or invocation_params.get("model"),
+                "start": time.time(),
+                "end": None,
+                "seconds": None,
+                "queue_seconds": 0.0,
+                "first_token_seconds": None,
+                "prompt_tokens": None,
+                "completion_tokens": None,
+                "cost": None,
+                "cache_hit": False,
+                "attempt": attempt,
+                "streamed": False,
+                "error": None,
+            }
+
+    def record_queue_wait(self, run_id: UUID, seconds: float):
+        with self._lock:
+            if run_id in self._calls:
+                self._calls[run_id]["queue_seconds"] += seconds
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            call = self._calls.get(run_id)
+            if call is not None and not call["streamed"]:
+                call["streamed"] = True
+                call["first_token_seconds"] = time.time() - call["start"]
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            call = self._calls.get(run_id)
+            if call is None:
+                return
+            call["end"] = time.time()
+            call["seconds"] = call["end"] - call["start"]
+            prompt_tokens, completion_tokens = _usage(response)
+            call["prompt_tokens"] = prompt_tokens
+            call["completion_tokens"] = completion_tokens
+            call["cache_hit"] = any(
+                (generation.generation_info or {}).get(CACHE_HIT_KEY)
+                for generations in response.generations
+                for generation in generations
+            )
+            if not call["cache_hit"]:
+                call["cost"] = llm_call_cost(call["model"], prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            call = self._calls.get(run_id)
+            if call is None:
+                return
+            call["end"] = time.time()
+            call["seconds"] = call["end"] - call["start"]
+            call["error"] = type(error).__name__
+
+    def spans(self) -> List[dict]:
+        """Returns the finished calls in the order they started"""
+
+        with self._lock:
+            calls = [dict(call) for call in self._calls.values() if call["end"] is not None]
+            calls += self._spans
+        return sorted(calls, key=lambda call: call["start"])
+
+
+def record_queue_wait(run_manager, seconds: float):
+    """Adds the time a chat model call waited for a scheduler slot to its span"""
+
+    tracer = run_tracer_var.get()
+    if tracer is not None and run_manager is not None:
+        tracer.record_queue_wait(run_manager.run_id, seconds)
+
+
+@contextmanager
+def traced_call(span_type: str, name: str, **attributes):
+    """Records the enclosed call as a span of the running node, if it is traced"""
+
+    tracer = run_tracer_var.get()
+    start = time.time()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        if tracer is not None:
+            end = time.time()
+            tracer.add_span(
+                {
+                    "type": span_type,
+                    "name": name,
+                    "start": start,
+                    "end": end,
+                    "seconds": end - start,
+                    "error": error,
+                    **attributes,
+                }
+            )
+
+
+def traced_node(name: str, node):
+    """Wraps an async graph node so its span and LLM calls are added to the trace"""
+
+    accepts_config = "config" in inspect.signature(node).parameters
+
+    async def run_traced_node(graph_state, config):
+        tracer = NodeTracer(name)
+        token = run_tracer_var.set(tracer)
+        start = time.time()
+        try:
+            if accepts_config:
+                result = await node(graph_state, config)
+            else:
+                result = await node(graph_state)
+        finally:
+            run_tracer_var.reset(token)
+        end = time.time()
+
+        span = {
+            "type": "node",
+            "name": name,
+            "start": start,
+            "end": end,
+            "seconds": end - start,
+            "calls": tracer.spans(),
+        }
+        return {**result, "trace": [*graph_state.get("trace", []), span]}
+
+    run_traced_node.__name__ = node.__name__
+    return run_traced_node
+
+
+def summarize_trace(trace: List[dict]) -> dict:
+    """Aggregates a trace per node, agent, model and other called service"""
+
+    nodes, agents, models, services = {}, {}, {}, {}
+    for span in trace:
+        node = nodes.setdefault(span["name"], {"runs": 0, "seconds": 0.0, "llm_calls": 0})
+        node["runs"] += 1
+        node["seconds"] += span["seconds"]
+
+        for call in span["calls"]:
+            if call["type"] != "llm":
+                service = services.setdefault(
+                    call["type"], {"calls": 0, "seconds": 0.0, "errors": 0}
+                )
+                service["calls"] += 1
+                service["seconds"] += call["seconds"]
+                service["errors"] += call["error"] is not None
+                continue
+
+            node["llm_calls"] += 1
+            agent = agents.setdefault(
+                call["agent"] or "unknown", {"calls": 0, "seconds": 0.0, "queue_seconds": 0.0}
+            )
+            agent["calls"] += 1
+            agent["seconds"] += call["seconds"]
+            agent["queue_seconds"] += call["queue_seconds"]
+
+            model = models.setdefault(
+                call["model"] or "unknown",
+                {
+                    "calls": 0,
+                    "cache_hits": 0,
+                    "retries": 0,
+                    "errors": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "cost": 0.0,
+                },
+            )
+            model["calls"] += 1
+            model["cache_hits"] += call["cache_hit"]
+            model["retries"] += call["attempt"] > 1
+            model["errors"] += call["error"] is not None
+            model["prompt_tokens"] += call["prompt_tokens"] or 0
+            model["completion_tokens"] += call["completion_tokens"] or 0
+            model["cost"] += call["cost"] or 0.0
+
+    return {
+        "wall_seconds": trace[-1]["end"] - trace[0]["start"] if trace else 0.0,
+        "cost": sum(model["cost"] for model in models.values()),
+        "nodes": nodes,
+        "agents": agents,
+        "models": models,
+        "services": services,
+    }
+
+
+def export_jsonl(trace: List[dict], path: str):
+    """Writes one line per node span and per LLM call span, calls name their node"""
+
+    with open(path, "w") as f:
+        for span in trace:
+            f.write(json.dumps({k: v for k, v in span.items() if k != "calls"}) + "\n")
+            for call in span["calls"]:
+                f.write(json.dumps({**call, "node": span["name"]}) + "\n")
+
+
+def _otel_attributes(attributes: dict) -> List[dict]:
+    values = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            values.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            values.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            values.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            values.append({"key": key, "value": {"stringValue": str(value)}})
+    return values
+
+
+def _otel_span(trace_id, parent_span_id, name, start, end, attributes, error=None) -> dict:
+    span = {
+        "traceId": trace_id,
+        "spanId": uuid.uuid4().hex[:16],
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(int(start * 1e9)),
+        "endTimeUnixNano": str(int(end * 1e9)),
+        "attributes": _otel_attributes(attributes),
+        "status": {"code": 2, "message": error} if error else {"code": 1},
+    }
+    if parent_span_id:
+        span["parentSpanId"] = parent_span_id
+    return span
+
+
+def to_otel_spans(trace: List[dict]) -> List[dict]:
+    """Converts a trace to OTLP/JSON spans: the run, its nodes and their calls"""
+
+    if not trace:
+        return []
+
+    trace_id = uuid.uuid4().hex
+    root = _otel_span(trace_id, None, "graph_run", trace[0]["start"], trace[-1]["end"], {})
+    spans = [root]
+    for span in trace:
+        node = _otel_span(trace_id, root["spanId"], span["name"], span["start"], span["end"], {})
+        spans.append(node)
+        for call in span["calls"]:
+            if call["type"] != "llm":
+                attributes = {
+                    key: value
+                    for key, value in call.items()
+                    if key not in ("type", "name", "start", "end", "seconds", "error")
+                }
+                spans.append(
+                    _otel_span(
+                        trace_id,
+                        node["spanId"],
+                        f"{call['type']} {call['name']}",
+                        call["start"],
+                        call["end"],
+                        attributes,
+                        call["error"],
+                    )
+                )
+                continue
+
+            spans.append(
+                _otel_span(
+                    trace_id,
+                    node["spanId"],
+                    f"chat {call['model']}",
+                    call["start"],
+                    call["end"],
+                    {
+                        "gen_ai.system": "openai",
+                        "gen_ai.request.model": call["model"],
+                        "gen_ai.usage.input_tokens": call["prompt_tokens"],
+                        "gen_ai.usage.output_tokens": call["completion_tokens"],
+                        "agent": call["agent"],
+                        "queue_seconds": call["queue_seconds"],
+                        "first_token_seconds": call["first_token_seconds"],
+                        "cost_usd": call["cost"],
+                        "cache_hit": call["cache_hit"],
+                        "attempt": call["attempt"],
+                    },
+                    call["error"],
+                )
+            )
+    return spans
+
+
+def export_otel_json(trace: List[dict], path: str):
+    """Writes the trace as an OTLP/JSON export request, readable by OpenTelemetry collectors"""
+
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {
+                            "attributes": _otel_attributes({"service.name": "physiotriage"})
+                        },
+                        "scopeSpans": [
+                            {"scope": {"name": "run_tracing"}, "spans": to_otel_spans(trace)}
+                        ],
+                    }
+                ]
+            },
+            f,
+        )
+
+
+# Track names of the call types in the Chrome trace, concurrent calls get numbered lanes
+CHROME_TRACE_TRACKS = {"llm": "LLM", "qdrant": "Qdrant", "tavily": "Tavily"}
+
+
+def _assign_lanes(calls: List[dict]) -> List[int]:
+    """Assigns every call the first lane that is free when it starts"""
+
+    lane_ends, lanes = [], []
+    for call in calls:
+        for lane, end in enumerate(lane_ends):
+            if end <= call["start"]:
+                break
+        else:
+            lane = len(lane_ends)
+            lane_ends.append(0.0)
+        lane_ends[lane] = call["end"]
+        lanes.append(lane)
+    return lanes
+
+
+def chrome_trace_events(
+    trace: List[dict], pid: int, process_name: str, origin: float
+) -> List[dict]:
+    """Trace events of one run: a track per node, and a lane per concurrent call of
+    each type, so calls that were serialized by rate limits show up as a single lane"""
+
+    def microseconds(seconds: float) -> float:
+        return round((seconds - origin) * 1e6, 1)
+
+    events = [{"ph": "M", "name": "process_name", "pid": pid, "args": {"name": process_name}}]
+    tracks = {}
+
+    def track(name: str) -> int:
+        if name not in tracks:
+            tracks[name] = len(tracks) + 1
+            tid = tracks[name]
+            events.append(
+                {"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": name}}
+            )
+            events.append(
+                {
+                    "ph": "M",
+                    "name": "thread_sort_index",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"sort_index": tid},
+                }
+            )
+        return tracks[name]
+
+    for span in trace:
+        events.append(
+            {
+                "ph": "X",
+                "cat": "node",
+                "name": span["name"],
+                "pid": pid,
+                "tid": track(f"node {span['name']}"),
+                "ts": microseconds(span["start"]),
+                "dur": round(span["seconds"] * 1e6, 1),
+                "args": {"calls": len(span["calls"])},
+            }
+        )
+
+    calls = sorted(
+        (call for span in trace for call in span["calls"]), key=lambda call: call["start"]
+    )
+    for call_type in dict.fromkeys(call["type"] for call in calls):
+        typed_calls = [call for call in calls if call["type"] == call_type]
+        track_name = CHROME_TRACE_TRACKS.get(call_type, call_type)
+        for call, lane in zip(typed_calls, _assign_lanes(typed_calls)):
+            tid = track(f"{track_name} {lane + 1}")
+            args = {
+                key: value
+                for key, value in call.items()
+                if key not in ("type", "name", "start", "end", "seconds") and value is not None
+            }
+            name = (call["agent"] or call["model"]) if call_type == "llm" else call["name"]
+            events.append(
+                {
+                    "ph": "X",
+                    "cat": call_type,
+                    "name": name,
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": microseconds(call["start"]),
+                    "dur": round(call["seconds"] * 1e6, 1),
+                    "args": args,
+                }
+            )
+            # The wait for a scheduler slot, nested at the start of the call
+            if call_type == "llm" and call["queue_seconds"] > 0:
+                events.append(
+                    {
+                        "ph": "X",
+                        "cat": "queue",
+                        "name": "queued",
+                        "pid": pid,
+                        "tid": tid,
+                        "ts": microseconds(call["start"]),
+                        "dur": round(call["queue_seconds"] * 1e6, 1),
+                    }
+                )
+    return events
+
+
+def to_chrome_trace(runs: List[Tuple[str, List[dict]]]) -> dict:
+    """Converts (name, trace) runs to a Chrome/Perfetto trace, one process per run on a
+    shared timeline, so concurrent runs can be compared"""
+
+    starts = [trace[0]["start"] for _, trace in runs if trace]
+    origin = min(starts) if starts else 0.0
+    events = []
+    for pid, (name, trace) in enumerate(runs, start=1):
+        events += chrome_trace_events(trace, pid, name, origin)
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(runs: List[Tuple[str, List[dict]]], path: str):
+    """Writes the runs as a trace event JSON file, open it in Perfetto or chrome://tracing"""
+
+    with open(path, "w") as f:
+        json.dump(to_chrome_trace(runs), f)
+
+
+def export_trace(trace: List[dict], directory: str, name: str) -> List[str]:
+    """Writes the trace in every format of `Tracing.EXPORT_FORMATS`, returns the paths"""
+
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for export_format in Tracing.EXPORT_FORMATS:
+        if export_format == "jsonl":
+            path = os.path.join(directory, f"{name}.jsonl")
+            export_jsonl(trace, path)
+        elif export_format == "otel":
+            path = os.path.join(directory, f"{name}.otel.json")
+            export_otel_json(trace, path)
+        elif export_format == "chrome":
+            path = os.path.join(directory, f"{name}.trace.json")
+            export_chrome_trace([(name, trace)], path)
+        else:
+            continue
+        paths.append(path)
+    return paths
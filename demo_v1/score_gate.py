@@ -0,0 +1,104 @@
+"""
+Similarity-score gate in front of the LLM retrieval grader.
+
+Retrieval already returns a similarity score for every chunk. Thresholds fitted
+offline on logged grader decisions (evaluation/fit-score-gate.py) let confident pairs
+be accepted or rejected without an LLM call; only uncertain pairs reach the grader.
+"""
+
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+from constants import ScoreGate
+from registry import registry
+
+
+@dataclass
+class GraderDecision:
+    """A retrieval grader verdict logged together with the retrieval score
+
+    `source` is what decided the verdict: "llm" when the LLM graded every pair of the
+    run, "llm-borderline" when a cross-encoder or the gate only left it the uncertain
+    pairs, or "cross-encoder" and "score-gate". Only "llm" verdicts are an unbiased
+    sample to fit the gate on.
+    """
+
+    subquery: str
+    chunk: str
+    score: float
+    is_relevant: bool
+    retrieval_mode: str
+    source: str = "llm"
+
+
+def log_grader_decisions(
+    decisions: List[GraderDecision], path: str = ScoreGate.DECISION_LOG
+):
+    """Appends grader decisions to the JSONL decision log"""
+
+    if not decisions:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        for decision in decisions:
+            f.write(json.dumps(asdict(decision)) + "\n")
+
+
+def load_grader_decisions(path: str = ScoreGate.DECISION_LOG) -> List[GraderDecision]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [GraderDecision(**json.loads(line)) for line in f if line.strip()]
+
+
+@dataclass
+class SimilarityGate:
+    """Score thresholds outside of which the grader verdict is predicted confidently
+
+    Scores below `reject_below` are auto-rejected and scores at or above
+    `accept_from` are auto-accepted. The gate only applies to the retrieval mode it
+    was fitted on, since dense cosine and hybrid RRF scores are not comparable.
+    """
+
+    reject_below: float
+    accept_from: float
+    retrieval_mode: str
+    target_agreement: float
+    agreement: float
+    skip_fraction: float
+
+    def decide(self, score: Optional[float], retrieval_mode: str) -> Optional[bool]:
+        """Returns the gated verdict for a pair, or None when the LLM grader should decide"""
+
+        if score is None or retrieval_mode != self.retrieval_mode:
+            return None
+        if score < self.reject_below:
+            return False
+        if score >= self.accept_from:
+            return True
+        return None
+
+    def save(self, path: str = ScoreGate.GATE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str = ScoreGate.GATE_PATH) -> Optional["SimilarityGate"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            fitted = json.load(f)
+        # Gates fitted before the unused logistic calibration was dropped still load
+        return cls(**{field: fitted[field] for field in cls.__dataclass_fields__})
+
+
+def get_score_gate(path: str = ScoreGate.GATE_PATH) -> Optional[SimilarityGate]:
+    """Returns the shared fitted gate, or None while none has been fitted, which is not
+    cached so a gate fitted later is picked up without a restart"""
+
+    if not os.path.exists(path):
+        return None
+    return registry.get_or_create(f"score-gate:{path}", lambda: SimilarityGate.load(path))
@@ -0,0 +1,324 @@
+"""
+Web search for the subqueries the vector store has no relevant documents for.
+
+Results are cached on disk keyed by the normalized query, so a subquery that comes up
+again in a later case skips the network round trip. Entries expire after a TTL and the
+table is bounded by evicting the least recently used rows, like the LLM response cache.
+Every entry keeps how long the original search took, which is the latency a hit saves.
+
+Searches go to a pluggable `WebSearchBackend`: Tavily, or a local corpus of markdown
+and text files ranked with BM25, for tests and air-gapped sites.
+
+Optionally the results that made it through translation and the hallucination check
+are written back into a vector store collection of their own, which `retrieve` searches
+next to the textbooks, so the same gap does not need a web search again.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain_core.documents import Document
+from constants import Caches, WebSearch
+from db import get_stored_metadata, store_documents
+from registry import registry
+from run_tracing import traced_call
+
+
+def normalize_query(query: str) -> str:
+    """Folds case, unicode forms, whitespace and trailing punctuation of a query"""
+
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?.!,;: ")
+
+
+@dataclass
+class WebSearchResult:
+    """Results of one search, with whether they came from the cache and the seconds
+    the search took, or saved when it was a hit"""
+
+    results: List[dict]
+    cache_hit: bool
+    seconds: float
+
+
+class WebSearchBackend:
+    """Answers a query with a list of `{"url", "content"}` results"""
+
+    name = "backend"
+
+    async def search(self, query: str, max_results: int) -> List[dict]:
+        raise NotImplementedError
+
+
+class TavilyBackend(WebSearchBackend):
+    name = "tavily"
+
+    async def search(self, query: str, max_results: int) -> List[dict]:
+        web_search_tool = TavilySearchResults(max_results=max_results)
+        with traced_call("tavily", "search", query=query):
+            return await web_search_tool.ainvoke(query, {"run_name": "web-search"})
+
+
+class LocalCorpusBackend(WebSearchBackend):
+    """Ranks the passages of the markdown and text files of a directory with BM25"""
+
+    name = "local"
+
+    def __init__(self, directory: str, min_words: int = 20):
+        self.directory = directory
+        self.passages = []
+        for root, _, file_names in os.walk(directory):
+            for file_name in sorted(file_names):
+                if not file_name.endswith((".md", ".txt")):
+                    continue
+                path = os.path.join(root, file_name)
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read().replace("<!-- image -->", "")
+                paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text)]
+                paragraphs = [p for p in paragraphs if len(p.split()) >= min_words]
+                relative_path = os.path.relpath(path, directory)
+                for i, paragraph in enumerate(paragraphs):
+                    self.passages.append(
+                        {"url": f"{relative_path}#passage-{i + 1}", "content": paragraph}
+                    )
+
+        self._postings: Dict[str, List[tuple]] = defaultdict(list)
+        lengths = []
+        for i, passage in enumerate(self.passages):
+            tokens = self._tokenize(passage["content"])
+            lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self._postings[term].append((i, frequency))
+        self._lengths = lengths
+        self._average_length = (sum(lengths) / len(lengths)) if lengths else 1.0
+
+    @staticmethod
+    def _tokenize(text: str) -> List[str]:
+        return re.findall(r"[a-z0-9]+", text.lower())
+
+    def rank(self, query: str, limit: int, k1: float = 1.2, b: float = 0.75) -> List[int]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(self._tokenize(query)):
+            postings = self._postings.get(term, [])
+            if not postings:
+                continue
+            idf = math.log(
+                1 + (len(self.passages) - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for i, frequency in postings:
+                norm = k1 * (1 - b + b * self._lengths[i] / self._average_length)
+                scores[i] += idf * frequency * (k1 + 1) / (frequency + norm)
+        return sorted(scores, key=lambda i: -scores[i])[:limit]
+
+    async def search(self, query: str, max_results: int) -> List[dict]:
+        with traced_call("local_corpus", "search", query=query):
+            return [self.passages[i] for i in self.rank(query, max_results)]
+
+
+class WebSearchStore:
+    """SQLite table of web search results with TTL and size-based eviction"""
+
+    def __init__(self, directory: str, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "web_search.sqlite"),
+            check_same_thread=False,
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, query TEXT NOT NULL, results TEXT NOT NULL, "
+            "seconds REAL NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(query: str, backend: str, max_results: int) -> str:
+        return hashlib.sha256(
+            f"{backend}\0{max_results}\0{normalize_query(query)}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Returns the stored (results, seconds) under the key, or None if absent or expired"""
+
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT results, seconds, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            results, seconds, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+
+            self._db.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return json.loads(results), seconds
+
+    def put(self, key: str, query: str, results: List[dict], seconds: float):
+        """Stores the results of a search, evicting expired and least recently used rows"""
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results "
+                "(key, query, results, seconds, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, query, json.dumps(results), seconds, now, now),
+            )
+            self._db.execute(
+                "DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self._db.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM results")
+            self._db.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+class CachedWebSearch:
+    """Searches a backend through the result cache, keeping hit and saved time counters"""
+
+    def __init__(self, backend: WebSearchBackend, store: Optional[WebSearchStore]):
+        self.backend = backend
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    async def search(self, query: str, max_results: int) -> WebSearchResult:
+        key = None
+        if self.store is not None:
+            key = WebSearchStore.key(query, self.backend.name, max_results)
+            cached = self.store.get(key)
+            if cached is not None:
+                results, seconds = cached
+                self.hits += 1
+                self.seconds_saved += seconds
+                return WebSearchResult(results=results, cache_hit=True, seconds=seconds)
+
+        start = time.perf_counter()
+        results = await self.backend.search(query, max_results)
+        seconds = time.perf_counter() - start
+        self.misses += 1
+
+        results = [{"url": doc["url"], "content": doc["content"]} for doc in results]
+        if self.store is not None and results:
+            self.store.put(key, query, results, seconds)
+        return WebSearchResult(results=results, cache_hit=False, seconds=seconds)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "seconds_saved": self.seconds_saved,
+            "entries": self.store.size() if self.store is not None else 0,
+        }
+
+
+def get_web_search_backend(backend: str = WebSearch.BACKEND) -> WebSearchBackend:
+    if backend == "local":
+        return registry.get_or_create(
+            f"web-search-backend:local:{WebSearch.LOCAL_CORPUS}",
+            lambda: LocalCorpusBackend(WebSearch.LOCAL_CORPUS),
+        )
+    if backend == "tavily":
+        return TavilyBackend()
+    raise ValueError(f"Unknown web search backend: {backend}")
+
+
+def get_web_search(backend: str = WebSearch.BACKEND) -> CachedWebSearch:
+    """Returns the shared web search of a backend, cached unless disabled in `Caches`"""
+
+    def create_web_search():
+        store = None
+        if Caches.WEB_SEARCH_ENABLED:
+            store = WebSearchStore(
+                Caches.DIRECTORY,
+                ttl_seconds=Caches.WEB_SEARCH_TTL_SECONDS,
+                max_entries=Caches.WEB_SEARCH_MAX_ENTRIES,
+            )
+        return CachedWebSearch(get_web_search_backend(backend), store)
+
+    return registry.get_or_create(f"web-search:{backend}", create_web_search)
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def web_result_id(url: str, content: str) -> str:
+    """Returns the point ID of a web result, the same URL and content give the same ID"""
+
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{url}#{content_hash(content)}"))
+
+
+def store_web_results(
+    results: List[dict],
+    collection_name: str = WebSearch.WRITE_BACK_COLLECTION,
+    ttl_seconds: float = WebSearch.WRITE_BACK_TTL_SECONDS,
+) -> int:
+    """Embeds and stores `{"question", "url", "content"}` web results, skipping those
+    already stored and unexpired, and returns how many were written"""
+
+    now = time.time()
+    results = {web_result_id(r["url"], r["content"]): r for r in results}
+    stored = get_stored_metadata(collection_name, list(results))
+
+    ids, documents = [], []
+    for point_id, result in results.items():
+        if stored.get(point_id, {}).get("expires_at", 0) > now:
+            continue
+        ids.append(point_id)
+        documents.append(
+            Document(
+                page_content=result["content"],
+                metadata={
+                    "source": result["url"],
+                    "WebSource": result["url"],
+                    "query": result["question"],
+                    "content_hash": content_hash(result["content"]),
+                    "written_at": now,
+                    "expires_at": now + ttl_seconds,
+                },
+            )
+        )
+
+    if documents:
+        store_documents(documents, collection_name=collection_name, ids=ids)
+    return len(documents)